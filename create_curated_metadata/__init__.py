@@ -5,15 +5,13 @@ import os
 import logging
 from datetime import datetime
 import azure.functions as func
-from azure.identity import ManagedIdentityCredential
-from azure.purview.catalog import PurviewCatalogClient
 from azure.core.exceptions import ResourceExistsError
 import azure.functions as func
 
-from services import utils, purview_utils
+from services import clients, utils, purview_utils
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     """Create Purview metadata to track curation data ingestion lineage.
 
     Args:
@@ -31,14 +29,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
         context = utils.DataMovement(req_body)
 
-        credential = ManagedIdentityCredential(
+        client = clients.get_purview_client(
             client_id=os.environ['errorlog__clientId'])
 
-        client = PurviewCatalogClient(
-            endpoint=f"https://{os.environ['purview_account_name']}"
-                     ".purview.azure.com",
-            credential=credential)
-
         collection = f'pview-collection-{context.environment}'
         adf_pl_qname = purview_utils.build_adf_pipeline_qname(
             context.data_factory,
@@ -110,12 +103,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         for col in columns_def:
             dataset_entities['entities'].append(col)
 
-        col_mapping = purview_utils.get_purview_column_mapping(
+        col_mapping, input_datasets = purview_utils.get_purview_lineage(
             context.structure, context.datalake_name, curated_qname)
 
-        input_datasets = purview_utils.get_purview_datasets(
-            context.structure, context.datalake_name)
-
         operation_entity = {
             "entity": {
                 "typeName": "adf_activity_operation",
@@ -160,18 +150,24 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         }
 
         # Create the ADF pipeline
-        client.collection.create_or_update(collection, adf_pipeline_asset)
+        await client.collection.create_or_update(collection,
+                                                 adf_pipeline_asset)
 
         # Create the dataset entities
-        client.collection.create_or_update_bulk(collection, dataset_entities)
+        await client.collection.create_or_update_bulk(collection,
+                                                      dataset_entities)
 
         # Create the operation entity
-        client.collection.create_or_update(collection, operation_entity)
+        await client.collection.create_or_update(collection, operation_entity)
+
+        await purview_utils.invalidate_entities(adf_pipeline_asset,
+                                                dataset_entities,
+                                                operation_entity)
 
         # Link the staging operation to the staging activity
         # There is not upsert logic for relationship
         try:
-            client.relationship.create(operation_rel)
+            await client.relationship.create(operation_rel)
         except ResourceExistsError:
             pass
 
@@ -5,14 +5,10 @@ import os
 import logging
 import azure.functions as func
 
-from azure.storage.blob import BlobServiceClient
-from azure.purview.catalog import PurviewCatalogClient
-from azure.identity import DefaultAzureCredential, ManagedIdentityCredential
+from services import clients, utils, cherwell_utils, purview_utils
 
-from services import utils, cherwell_utils, purview_utils
 
-
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     """Create a service desk incident for the Azure Data Factory Pipeline
         passed as a param 'pipeline_run_id'.
         The function will collect all the error files for this pipeline
@@ -37,35 +33,30 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             raise ValueError(("The Azure Data Factory Pipeline Run ID must be "
                              "passed as pipeline_run_id"))
 
-        managed_credential = ManagedIdentityCredential(
-            client_id=os.environ['errorlog__clientId'])
-        blob_service_client = BlobServiceClient(
+        blob_service_client = clients.get_blob_service_client(
             os.environ['errorlog__serviceUri'],
-            credential=managed_credential)
+            os.environ['errorlog__clientId'])
 
         container_client = blob_service_client.get_container_client(
             'error-files')
-        blob_list = list(container_client.list_blobs(
-            name_starts_with=f'{pipeline_run_id}/'))
+        blob_list = [blob async for blob in container_client.list_blobs(
+            name_starts_with=f'{pipeline_run_id}/')]
 
-        files = utils.load_blobs_json(blob_list, container_client)
+        files = await utils.load_blobs_json(
+            blob_list, container_client,
+            int(os.environ.get('blob_max_concurrency',
+                               utils.BLOB_MAX_CONCURRENCY)))
 
         if not files:
             raise ValueError("No error files to process")
 
         error_context = [utils.ErrorContext(item) for item in files]
 
-        purview_endpoint = (f"https://{os.environ['purview_account_name']}"
-                            "purview.azure.com")
-
-        credential = DefaultAzureCredential()
-        client = PurviewCatalogClient(
-            endpoint=purview_endpoint,
-            credential=credential)
+        client = clients.get_purview_client()
 
         error_type = utils.get_error_type(error_context[0].error_message)
         affected_assets = [asset.name for asset in error_context]
-        affected_dependencies = purview_utils.get_dependencies_list(
+        affected_dependencies = await purview_utils.get_dependencies_list(
             client, error_context)
         error_message = cherwell_utils.format_incident_description(
             affected_assets,
@@ -83,15 +74,22 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             f"username={os.environ['service_desk_username']}&"
             f"password={os.environ['service_desk_password']}")
 
-        auth_token = utils.get_auth_token(auth_url, body, 'access_token')
+        auth_token = await utils.get_auth_token(auth_url, body,
+                                                'access_token')
         payload = cherwell_utils.configure_incident(error_message, error_type)
 
-        incident_id = cherwell_utils.create_incident(
+        incident_id = await cherwell_utils.create_incident(
             os.environ['service_desk_base_url'], payload, auth_token)
 
         logging.info('Created service desk incident #%s', incident_id)
 
-        utils.delete_blobs(blob_list, container_client)
+        delete_results = await utils.delete_blobs(blob_list,
+                                                  container_client)
+        failed_deletes = [name for name, error in delete_results.items()
+                          if error]
+        if failed_deletes:
+            logging.warning('Failed to delete %d error files: %s',
+                            len(failed_deletes), ', '.join(failed_deletes))
 
         return func.HttpResponse(
             incident_id,
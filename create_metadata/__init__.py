@@ -5,15 +5,12 @@ import os
 import logging
 from datetime import datetime
 import azure.functions as func
-from azure.identity import ManagedIdentityCredential
-from azure.purview.catalog import PurviewCatalogClient
-from azure.purview.administration.account import PurviewAccountClient
-from azure.core.exceptions import ResourceExistsError
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
 
-from services import utils, purview_utils
+from services import clients, utils, purview_utils
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     """Create Purview metadata to track data ingestion lineage.
 
     Args:
@@ -32,34 +29,16 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
         context = utils.DataMovement(req_body)
 
-        credential = ManagedIdentityCredential(
+        client = clients.get_purview_client(
+            client_id=os.environ['errorlog__clientId'])
+        account_client = clients.get_purview_account_client(
             client_id=os.environ['errorlog__clientId'])
-
-        client = PurviewCatalogClient(
-            endpoint=f"https://{os.environ['purview_account_name']}"
-                     ".purview.azure.com",
-            credential=credential)
-
-        account_client = PurviewAccountClient(
-            endpoint=f"https://{os.environ['purview_account_name']}"
-                     ".purview.azure.com",
-            credential=credential)
 
         collection = f'pview-collection-{context.environment}'
-        collection_entity = {
-            "name": collection
-        }
 
-        # Attempt to upsert the collection.
-        # In case of a Purview concurrency exception, ignore the failure and
-        # let the other instance perform the upsert.
-        try:
-            account_client.collections.create_or_update_collection(
-                collection, collection_entity)
-        except ResourceExistsError as ex:
-            warning_message = f'Purview collection concurrency issue: {repr(ex)}'
-            logging.warning(str(warning_message))
-            pass
+        # Upsert the collection once per worker, it almost never changes
+        await purview_utils.COLLECTION_CACHE.ensure(account_client,
+                                                    collection)
 
         adf_qname = purview_utils.build_adf_qname(
             context.data_factory,
@@ -74,197 +53,167 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         source_host = (f'{source_prefix}://{context.system}_'
                        f'{context.environment}')
 
-        adf_entity = {
-            "entity":
-            {
-                "typeName": "azure_data_factory",
-                "attributes": {
-                    "resourceGroupName": os.environ['azure_resource_group'],
-                    "qualifiedName": adf_qname,
-                    "name": context.data_factory,
-                    "subscriptionId": os.environ['azure_subscription']
-                },
-                "status": "ACTIVE"
-            }
-        }
+        raw_qname = (f"https://{os.environ['datalake_name']}.dfs.core.windows"
+                     f".net/raw/{context.system}/{context.display_name}/v"
+                     f"{context.version}/{{Year}}/{{Month}}/{{Day}}/"
+                     f"{context.display_name}")
+
+        # Read the current run statistics of the copy activity.
+        # Row count and data size are accumulated over the runs of a day.
+        copy_attributes = await purview_utils.get_entity_attributes(
+            client, 'adf_copy_activity', adf_copy_qname)
+
+        row_count = context.rows_copied
+        data_size = context.data_written
+        last_run_ts = copy_attributes.get('lastRunTime')
+
+        if (last_run_ts and datetime.fromtimestamp(last_run_ts / 1000).date()
+                == context.start_date.date()):
+            row_count += copy_attributes.get('rowCount') or 0
+            data_size += copy_attributes.get('dataSize') or 0
+
+        # Plan every entity in a single bulk upsert, cross referencing
+        # the entities of the payload by placeholder GUIDs
+        plan = purview_utils.BulkEntityPlan()
+
+        plan.add({
+            "typeName": "azure_data_factory",
+            "attributes": {
+                "resourceGroupName": os.environ['azure_resource_group'],
+                "qualifiedName": adf_qname,
+                "name": context.data_factory,
+                "subscriptionId": os.environ['azure_subscription']
+            },
+            "status": "ACTIVE"
+        })
+
+        plan.add({
+            "typeName": f"{context.purview_prefix}_server",
+            "attributes": {
+                "qualifiedName": source_host,
+                "name": context.system,
+                "description": f"Source server for the "
+                               f"{context.system} system"
+            },
+            "status": "ACTIVE"
+        })
+
+        plan.add({
+            "typeName": "adf_pipeline",
+            "attributes": {
+                "qualifiedName": (f"{adf_qname}/pipelines/"
+                                  f"{context.pipeline_name}"),
+                "name": context.pipeline_name
+            },
+            "status": "ACTIVE"
+        })
 
-        adf_copy_template = {
+        plan.add({
             "typeName": "adf_copy_activity",
             "attributes": {
                 "outputs": [],
                 "qualifiedName": adf_copy_qname,
                 "inputs": [],
                 "name": "copy_datalake_raw",
-                "status": "Completed"
+                "status": "Completed",
+                "rowCount": row_count,
+                "dataSize": data_size,
+                "lastRunTime": context.start_date.timestamp() * 1000
             },
             "status": "ACTIVE"
-        }
-        adf_copy_template['guid'] = -50
-
-        adf_pipeline_assets = {
-            "entities": [
-                {
-                    "typeName": f"{context.purview_prefix}_server",
-                    "attributes": {
-                        "qualifiedName": source_host,
-                        "name": context.system,
-                        "description": f"Source server for the "
-                                       f"{context.system} system"
-                    },
-                    "status": "ACTIVE"
-                },
-                {
-                    "typeName": "adf_pipeline",
-                    "attributes": {
-                        "qualifiedName": (f"{adf_qname}/pipelines/"
-                                          f"{context.pipeline_name}"),
-                        "name": context.pipeline_name
-                    },
-                    "status": "ACTIVE"
-                },
-                adf_copy_template
-            ]
-        }
-
-        # Create the ADF instance
-        client.collection.create_or_update(collection, adf_entity)
-
-        # Create ADF structure
-        response = client.collection.create_or_update_bulk(collection,
-                                                           adf_pipeline_assets)
-        adf_copy_guid = response['guidAssignments']['-50']
-
-        # Update the row count and the last run date
-        response = client.entity.get_by_guid(adf_copy_guid)
-
-        last_run_ts = response['entity']['attributes']['lastRunTime']
-        last_run_date = datetime.fromtimestamp(last_run_ts / 1000)
-        row_count = context.rows_copied
-        data_size = context.data_written
+        })
 
-        if last_run_date.date() == context.start_date.date():
-            row_count += response['entity']['attributes']['rowCount']
-            data_size += response['entity']['attributes']['dataSize']
-
-        adf_copy_template['guid'] = adf_copy_guid
-        adf_copy_template['attributes']['rowCount'] = row_count
-        adf_copy_template['attributes']['dataSize'] = data_size
-        adf_copy_template['attributes']['lastRunTime'] = \
-            context.start_date.timestamp() * 1000
-        updated_adf_copy = {
-            "entity": adf_copy_template
-        }
+        if context.entity_type == 'azure_sql_table':
+            source_host += f'/{context.system}DB'
 
-        client.collection.create_or_update(collection, updated_adf_copy)
+        plan.add({
+            "typeName": f"{context.purview_prefix}_schema",
+            "attributes": {
+                "qualifiedName": f"{source_host}/{context.schema}",
+                "name": context.schema,
+            },
+            "status": "ACTIVE"
+        })
 
-        raw_qname = (f"https://{os.environ['datalake_name']}.dfs.core.windows"
-                     f".net/raw/{context.system}/{context.display_name}/v"
-                     f"{context.version}/{{Year}}/{{Month}}/{{Day}}/"
-                     f"{context.display_name}")
+        schema_guid = plan.add({
+            "typeName": "tabular_schema",
+            "attributes": {
+                "qualifiedName": f"{raw_qname}#tabular_schema",
+                "name": "tabular_schema",
+            },
+            "status": "ACTIVE"
+        })
 
-        if context.entity_type == 'azure_sql_table':
-            source_host += f'/{context.system}DB'
+        table_guid = plan.add({
+            "typeName": context.entity_type,
+            "attributes": {
+                "qualifiedName": f"{source_host}/"
+                                 f"{context.schema}/{context.name}",
+                "name": context.name,
+                "source": context.system
+            },
+            "status": "ACTIVE"
+        })
 
-        dataset_entities = {
-            "entities": [
-                {
-                    "typeName": f"{context.purview_prefix}_schema",
-                    "attributes": {
-                        "qualifiedName": f"{source_host}/{context.schema}",
-                        "name": context.schema,
-                    },
-                    "status": "ACTIVE"
-                },
-                {
-                    "typeName": "tabular_schema",
-                    "attributes": {
-                        "qualifiedName": f"{raw_qname}#tabular_schema",
-                        "name": "tabular_schema",
-                    },
-                    "status": "ACTIVE",
-                    "guid": -100
-                },
-                {
-                    "typeName": context.entity_type,
-                    "attributes": {
-                        "qualifiedName": f"{source_host}/"
-                                         f"{context.schema}/{context.name}",
-                        "name": context.name,
-                        "source": context.system
-                    },
-                    "status": "ACTIVE"
-                },
-                {
-                    "typeName": "azure_datalake_gen2_resource_set",
-                    "attributes": {
-                        "qualifiedName": raw_qname,
-                        "name": context.display_name,
-                        "description": "Parquet Data File",
-                        "modifiedTime": context.start_date.timestamp() * 1000,
-                    },
-                    "status": "ACTIVE",
-                    "relationshipAttributes": {
-                        "tabular_schema": {
-                            "guid": -100
-                        }
-                    }
+        raw_guid = plan.add({
+            "typeName": "azure_datalake_gen2_resource_set",
+            "attributes": {
+                "qualifiedName": raw_qname,
+                "name": context.display_name,
+                "description": "Parquet Data File",
+                "modifiedTime": context.start_date.timestamp() * 1000,
+            },
+            "status": "ACTIVE",
+            "relationshipAttributes": {
+                "tabular_schema": {
+                    "guid": schema_guid
                 }
-            ]
-        }
+            }
+        })
 
         # Create columns
-        for col in context.structure:
-            col_raw = {
+        structure = context.structure
+        for name, data_type in zip(structure.names, structure.types):
+            plan.add({
                 "typeName": "column",
                 "attributes": {
-                    "qualifiedName": f"{raw_qname}#tabular_schema//{col.name}",
-                    "name": col.name,
-                    "type": col.type
+                    "qualifiedName": f"{raw_qname}#tabular_schema//{name}",
+                    "name": name,
+                    "type": data_type
                 },
                 "relationshipAttributes": {
                     "composeSchema": {
-                        "guid": -100
+                        "guid": schema_guid
                     }
                 }
-            }
-            dataset_entities['entities'].append(col_raw)
+            })
 
-        col_mapping = [{'Source': col.name, 'Sink': col.name} for col in
-                       context.structure if not col.name.startswith('meta_')]
+        col_mapping = [{'Source': name, 'Sink': name} for name in
+                       structure.names if not name.startswith('meta_')]
         col_mapping = str(col_mapping).replace("'", '"')
 
-        operation_entity = {
-            "entity": {
-                "typeName": "adf_copy_operation",
-                "attributes": {
-                    "outputs": [
-                        {
-                            "typeName": "azure_datalake_gen2_resource_set",
-                            "uniqueAttributes": {
-                                "qualifiedName": raw_qname
-                            }
-                        }
-                    ],
-                    "qualifiedName": f"{adf_copy_qname}#{raw_qname}"
-                                     "#azure_datalake_gen2_resource_set",
-                    "inputs": [
-                        {
-                            "typeName": context.entity_type,
-                            "uniqueAttributes": {
-                                "qualifiedName": f"{source_host}/"
-                                                 f"{context.schema}"
-                                                 f"/{context.name}"
-                            }
-                        }
-                    ],
-                    "name": "copy_datalake_raw",
-                    "columnMapping": f'[{{"DatasetMapping":{{"Source":"*",'
-                                     f'"Sink":"{raw_qname}"}},"ColumnMapping"'
-                                     f':{col_mapping}}}]',
-                },
-                "status": "ACTIVE"
-            }
-        }
+        plan.add({
+            "typeName": "adf_copy_operation",
+            "attributes": {
+                "outputs": [
+                    {
+                        "guid": raw_guid
+                    }
+                ],
+                "qualifiedName": f"{adf_copy_qname}#{raw_qname}"
+                                 "#azure_datalake_gen2_resource_set",
+                "inputs": [
+                    {
+                        "guid": table_guid
+                    }
+                ],
+                "name": "copy_datalake_raw",
+                "columnMapping": f'[{{"DatasetMapping":{{"Source":"*",'
+                                 f'"Sink":"{raw_qname}"}},"ColumnMapping"'
+                                 f':{col_mapping}}}]',
+            },
+            "status": "ACTIVE"
+        })
 
         operation_rel = {
             "typeName": "process_parent",
@@ -287,16 +236,21 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             "propagatedClassifications": []
         }
 
-        # Create the dataset entities
-        client.collection.create_or_update_bulk(collection, dataset_entities)
+        # Create all the entities
+        try:
+            await client.collection.create_or_update_bulk(collection,
+                                                         plan.payload())
+        except HttpResponseError:
+            # The collection may have been deleted since it was cached
+            purview_utils.COLLECTION_CACHE.invalidate(collection)
+            raise
 
-        # Create the operation entity
-        client.collection.create_or_update(collection, operation_entity)
+        await purview_utils.invalidate_entities(plan.payload())
 
         # Link the copy operation to the copy activity
         # There is not upsert logic for relationship
         try:
-            client.relationship.create(operation_rel)
+            await client.relationship.create(operation_rel)
         except ResourceExistsError:
             pass
 
@@ -3,14 +3,12 @@
 """
 import os
 import logging
-from azure.identity import ManagedIdentityCredential
-from azure.purview.catalog import PurviewCatalogClient
 import azure.functions as func
 
-from services import utils, purview_utils
+from services import clients, utils, purview_utils
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     """Create Purview metadata to track Synapse and Power BI
        data ingestion lineage.
 
@@ -40,12 +38,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         if not datamart_name:
             raise ValueError("Missing parameter 'datamart_name'")
 
-        credential = ManagedIdentityCredential(
+        client = clients.get_purview_client(
             client_id=os.environ['errorlog__clientId'])
-        client = PurviewCatalogClient(
-            endpoint=f"https://{os.environ['purview_account_name']}"
-                     ".purview.azure.com",
-            credential=credential)
 
         datalake_name = os.environ['datalake_name']
         collection = f"pview-collection-{os.environ['environment']}"
@@ -53,7 +47,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             datalake_name,
             datamart_name)
 
-        curated_response = client.entity.get_by_unique_attributes(
+        curated_response = await client.entity.get_by_unique_attributes(
             type_name='tabular_schema',
             attr_qualified_name=f'{curated_qname}#tabular_schema',
             min_ext_info=False, ignore_relationships=False)
@@ -67,7 +61,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             'pview-scan',
             'azure_synapse_serverless_sql_view')
 
-        response = client.discovery.query(query)
+        response = await client.discovery.query(query)
 
         if '@search.count' not in response or response['@search.count'] == 0:
             logging.warning('The Synapse view could not be found in Purview')
@@ -75,7 +69,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
         synapse_view_qname = response['value'][0]['qualifiedName']
 
-        synapse_view_response = client.entity.get_by_unique_attributes(
+        synapse_view_response = await client.entity.get_by_unique_attributes(
             type_name='azure_synapse_serverless_sql_view',
             attr_qualified_name=synapse_view_qname,
             min_ext_info=False, ignore_relationships=False)
@@ -87,9 +81,10 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
         columns = list(set(dest_columns).intersection(source_columns))
 
-        entities = [utils.DataEntity({'name': col, 'source_name': col,
-                                      'source_dataset': datamart_name,
-                                      'system': 'curated'}) for col in columns]
+        entities = utils.DataEntity.from_payloads(
+            {'name': col, 'source_name': col,
+             'source_dataset': datamart_name,
+             'system': 'curated'} for col in columns)
 
         col_mapping = purview_utils.get_purview_column_mapping(
             entities, datalake_name, synapse_view_qname)
@@ -99,7 +94,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             'pview-scan',
             'powerbi_dataset')
 
-        response = client.discovery.query(query)
+        response = await client.discovery.query(query)
 
         if '@search.count' not in response or response['@search.count'] == 0:
             logging.warning(
@@ -165,7 +160,10 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             ]
         }
 
-        client.collection.create_or_update_bulk(collection, operation_entities)
+        await client.collection.create_or_update_bulk(collection,
+                                                      operation_entities)
+
+        await purview_utils.invalidate_entities(operation_entities)
 
         return 'OK'
     except Exception as ex:
@@ -2,15 +2,13 @@ import os
 import logging
 from datetime import datetime
 import azure.functions as func
-from azure.identity import ManagedIdentityCredential
-from azure.purview.catalog import PurviewCatalogClient
 from azure.core.exceptions import ResourceExistsError
 import azure.functions as func
 
-from services import utils, purview_utils
+from services import clients, utils, purview_utils
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     """Create Purview metadata to track staging data ingestion lineage.
 
     Args:
@@ -28,14 +26,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
         context = utils.DataMovement(req_body)
 
-        credential = ManagedIdentityCredential(
+        client = clients.get_purview_client(
             client_id=os.environ['errorlog__clientId'])
 
-        client = PurviewCatalogClient(
-            endpoint=f"https://{os.environ['purview_account_name']}"
-                     ".purview.azure.com",
-            credential=credential)
-
         collection = f'pview-collection-{context.environment}'
         adf_pl_qname = purview_utils.build_adf_pipeline_qname(
             context.data_factory,
@@ -98,9 +91,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         for col in columns_def:
             dataset_entities['entities'].append(col)
 
-        col_mapping = [{'Source': col.name, 'Sink': col.name} for col in
-                       context.structure if not
-                       col.name.startswith('meta_staging')]
+        col_mapping = [{'Source': name, 'Sink': name} for name in
+                       context.structure.names if not
+                       name.startswith('meta_staging')]
         col_mapping = str(col_mapping).replace("'", '"')
 
         operation_entity = {
@@ -156,15 +149,18 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         }
 
         # Create the dataset entities
-        client.collection.create_or_update_bulk(collection, dataset_entities)
+        await client.collection.create_or_update_bulk(collection,
+                                                      dataset_entities)
 
         # Create the operation entity
-        client.collection.create_or_update(collection, operation_entity)
+        await client.collection.create_or_update(collection, operation_entity)
+
+        await purview_utils.invalidate_entities(dataset_entities, operation_entity)
 
         # Link the staging operation to the staging activity
         # There is not upsert logic for relationship
         try:
-            client.relationship.create(operation_rel)
+            await client.relationship.create(operation_rel)
         except ResourceExistsError:
             pass
 
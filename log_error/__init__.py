@@ -6,7 +6,7 @@ import logging
 import azure.functions as func
 
 
-def main(req: func.HttpRequest, outputblob: func.Out[bytes]) -> func.HttpResponse:
+async def main(req: func.HttpRequest, outputblob: func.Out[bytes]) -> func.HttpResponse:
     """Create an error file in Azure Blob Storage.
         The file gets an random name and is saved under
         'errors/{run_pipeline_id}/
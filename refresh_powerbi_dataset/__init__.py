@@ -2,18 +2,72 @@
 Azure Function to refresh PowerBI Dataset.
 """
 import json
+import math
 import os
 import logging
+from typing import Dict, Optional
 import azure.functions as func
 
-from services.power_bi_utils import PowerBIClient
+from services import clients
+from services.power_bi_utils import (PowerBIClient, RefreshCoalescer, RefreshThrottledError,
+                                     REFRESH_MAX_CONCURRENCY, REFRESH_WAIT_TIMEOUT)
 
+# Refresh statuses of the datasets that are being refreshed, or will be by the trailing refresh of their last refresh
+REFRESHING_STATUSES = ('refreshing', 'queued')
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+
+def get_refresh_coalescer(req_body: dict) -> Optional[RefreshCoalescer]:
+    """
+    Builds the coalescer merging the refresh requests of a dataset, with its state in the errorlog storage account
+    :param req_body: The request body, which may override the coalesce window
+    :return: The coalescer, or None when the coalesce window is 0, which it is unless set by the request or the
+             powerbi_refresh_coalesce_window app setting
+    """
+    window = float(req_body.get('coalesce_window', os.environ.get('powerbi_refresh_coalesce_window', 0)))
+    if window <= 0:
+        return None
+
+    container = clients.get_blob_service_client(
+        os.environ['errorlog__serviceUri'],
+        os.environ.get('errorlog__clientId')).get_container_client(
+            os.environ.get('powerbi_refresh_state_container', 'powerbi-refreshes'))
+    return RefreshCoalescer(container, window)
+
+
+async def wait_for_refreshes(powerbi_client: PowerBIClient, powerbi_organisation: str, workspace_id: str,
+                             statuses: Dict[str, dict], req_body: dict, max_concurrency: int):
     """
-    Refreshes a powerbi dataset
+    Waits for the refreshes of the datasets being refreshed and adds their outcome to their status, the queued
+    datasets are not waited for as their trailing refresh has not started yet
+    :param powerbi_client      : The client polling the refreshes
+    :param powerbi_organisation: The organisation name used to create powerBI instance
+    :param workspace_id        : The ID of the workspace where the datasets live
+    :param statuses            : The refresh status of each dataset, updated with the outcome of its refresh
+    :param req_body            : The request body, which may override the wait timeout
+    :param max_concurrency     : The maximum number of refresh histories requested at once
+    """
+    logging.info("wait for refreshes")
+    refreshes = {status['dataset_id']: status['request_id'] for status in statuses.values()
+                 if status['status'] == 'refreshing'}
+    timeout = float(req_body.get('wait_timeout',
+                                 os.environ.get('powerbi_refresh_wait_timeout', REFRESH_WAIT_TIMEOUT)))
+    outcomes = await powerbi_client.wait_for_refreshes(powerbi_organisation, workspace_id, refreshes,
+                                                       timeout=timeout, max_concurrency=max_concurrency)
+    for status in statuses.values():
+        status.update(outcomes.get(status['dataset_id'], {}))
+
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Refreshes a powerbi dataset, or several datasets at once when a list of dataset_names is passed.
+    When a coalesce window is set, the requests for a dataset arriving within the window of its last refresh, or
+    while that refresh is running, are queued into a single trailing refresh.
+    With wait set, the function returns once the refreshes of the datasets completed, with their timings.
     :param req: The request received by the endpoint
-    :return: The status code of the endpoint
+    :return: The status code of the endpoint, with a 207 status and the status of each dataset
+             when some of the datasets could not be refreshed, a 202 status when the refresh of a single dataset
+             waited for is queued, or a 429 status with a Retry-After header when PowerBI throttled the refresh of
+             a single dataset
     """
     try:
         logging.info("start function")
@@ -34,15 +88,59 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         logging.info("instantiate client")
         powerbi_client = PowerBIClient(tenant_id, client_id, client_secret)
 
+        workspace_id = await powerbi_client.get_workspace_id(powerbi_organisation, powerbi_workspace_name)
+        coalescer = get_refresh_coalescer(req_body)
+        max_concurrency = int(req_body.get('max_concurrency',
+                                           os.environ.get('powerbi_refresh_max_concurrency',
+                                                          REFRESH_MAX_CONCURRENCY)))
+
+        if 'dataset_names' in req_body:
+            logging.info("refresh datasets")
+            statuses = await powerbi_client.refresh_datasets(powerbi_organisation, workspace_id,
+                                                             req_body['dataset_names'], max_concurrency,
+                                                             coalescer)
+            expected_statuses = REFRESHING_STATUSES
+
+            if req_body.get('wait'):
+                await wait_for_refreshes(powerbi_client, powerbi_organisation, workspace_id, statuses, req_body,
+                                         max_concurrency)
+                expected_statuses = ('completed',)
+
+            all_refreshed = all(status['status'] in expected_statuses for status in statuses.values())
+            return func.HttpResponse(status_code=200 if all_refreshed else 207,
+                                     body=json.dumps({"datasets": statuses}), mimetype="application/json")
+
         logging.info("refresh dataset")
-        workspace_id = powerbi_client.get_workspace_id(powerbi_organisation, powerbi_workspace_name)
-        dataset_id = powerbi_client.get_dataset_id(powerbi_organisation, workspace_id, req_body['dataset_name'])
-        refresh_status = powerbi_client.refresh_dataset(powerbi_organisation, workspace_id, dataset_id)
+        dataset_id = await powerbi_client.get_dataset_id(powerbi_organisation, workspace_id, req_body['dataset_name'])
+        try:
+            if coalescer is not None:
+                status, request_id = await coalescer.refresh(powerbi_client, powerbi_organisation, workspace_id,
+                                                             dataset_id)
+            else:
+                refresh_status, request_id = await powerbi_client.start_refresh(powerbi_organisation, workspace_id,
+                                                                                dataset_id)
+                status = "refreshing" if refresh_status else "failed"
+        except RefreshThrottledError as e:
+            logging.warning(str(e))
+            headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after is not None else None
+            return func.HttpResponse(status_code=429, headers=headers)
+
+        statuses = {req_body['dataset_name']: {"dataset_id": dataset_id, "status": status, "request_id": request_id}}
+        expected_statuses = REFRESHING_STATUSES
+        if req_body.get('wait'):
+            await wait_for_refreshes(powerbi_client, powerbi_organisation, workspace_id, statuses, req_body,
+                                     max_concurrency)
+            expected_statuses = ('completed',)
 
-        if refresh_status:
-            return func.HttpResponse(status_code=200, body=json.dumps({"dataset_id": dataset_id}), mimetype="application/json")
+        status = statuses[req_body['dataset_name']]
+        if status['status'] in expected_statuses:
+            status_code = 200
+        elif status['status'] == 'queued':
+            # The trailing refresh serving the request has not started yet, there is nothing to wait for
+            status_code = 202
         else:
-            return func.HttpResponse(status_code=403)
+            status_code = 403
+        return func.HttpResponse(status_code=status_code, body=json.dumps(status), mimetype="application/json")
     except Exception as e:
         logging.error("Error refreshing the PowerBI dataset", stack_info=e)
         return func.HttpResponse(status_code=500)
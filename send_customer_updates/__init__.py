@@ -5,11 +5,38 @@
 import os
 import json
 import logging
-from azure.servicebus import ServiceBusClient, ServiceBusMessage
+from typing import Dict, Iterable, List, Tuple
+from azure.servicebus import ServiceBusMessage
 import azure.functions as func
 
+from services import clients, service_bus_utils, utils
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+
+def index_customer_updates(
+        records: Iterable[Dict]) -> Dict[str, Tuple[Dict, List[str]]]:
+    """Index the customer records by PAR_REFNO in a single pass.
+
+    Args:
+        records (Iterable[Dict]): The customer records, oldest first
+
+    Returns:
+        Dict[str, Tuple[Dict, List[str]]]: The latest record and the
+            SEQUENCE_IDs of every record of each customer, ordered by the
+            position of the latest record
+    """
+    index = {}
+
+    for record in records:
+        customer_ref = record['PAR_REFNO']
+        # Move the customer to the end, after its latest record
+        _, ids = index.pop(customer_ref, (None, []))
+        ids.append(str(record['SEQUENCE_ID']))
+        index[customer_ref] = (record, ids)
+
+    return index
+
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     """ Send the input messages to the Dynamics Customer Sync Service Bus.
 
     Args:
@@ -22,39 +49,38 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             Service Bus topic.
     """
     session_id = req.params.get('session_id')
-    req_body = req.get_json()
+
+    # Parse the body record by record, only the latest record of each
+    # customer is kept in memory
+    messages = index_customer_updates(
+        utils.iter_json_array(utils.iter_chunks(req.get_body())))
 
     updated_ids = set()
 
     try:
-        servicebus_client = ServiceBusClient.from_connection_string(
-            conn_str=os.environ['service_bus_connection'],
-            logging_enable=True)
-
-        with servicebus_client:
-            sender = servicebus_client.get_topic_sender(
-                topic_name=os.environ['service_bus_topic'])
-
-            with sender:
-                messages = dict()
+        topic_name = os.environ['service_bus_topic']
+        # The sender and its AMQP link are shared by the invocations
+        sender = await clients.get_topic_sender(topic_name)
 
-                for item in reversed(req_body):
-                    customer_ref = item['PAR_REFNO']
-                    if customer_ref not in messages:
-                        messages[customer_ref] = item
+        async def reconnect():
+            return await clients.reconnect_topic_sender(topic_name)
 
-                for item in reversed(messages):
-                    msg = ServiceBusMessage(json.dumps(messages[item]),
-                                            session_id=session_id)
+        def get_messages():
+            for item, ids in messages.values():
+                msg = ServiceBusMessage(json.dumps(item),
+                                        session_id=session_id)
 
-                    sender.send_messages(msg)
+                yield msg, ids
 
-                    ids = [str(it['SEQUENCE_ID']) for it in req_body
-                           if it['PAR_REFNO'] == messages[item]['PAR_REFNO']]
-                    for id in ids:
-                        updated_ids.add(id)
+        # Pack the messages in as few batches as possible
+        async for ids in service_bus_utils.send_message_batches(
+                sender, get_messages(), reconnect):
+            updated_ids.update(ids)
 
         return ','.join(updated_ids)
     except (Exception) as ex:
         logging.error(f"Error: {ex}")
+        if isinstance(ex, service_bus_utils.RECONNECT_ERRORS):
+            # The next invocation renews the link instead of reusing it
+            sender.healthy = False
         return ','.join(updated_ids)
@@ -1,14 +1,13 @@
 """Utils functions for the Cherwell service desk.
 
 """
-import requests
 from typing import List
 from pathlib import Path
 
-from services import utils
+from services import http_utils, utils
 
 
-def create_incident(base_url: str, payload: str, auth_token: str) -> str:
+async def create_incident(base_url: str, payload: str, auth_token: str) -> str:
     """Create a service desk incident.
 
     Args:
@@ -23,7 +22,7 @@ def create_incident(base_url: str, payload: str, auth_token: str) -> str:
         "Authorization": "Bearer " + auth_token,
         "Content-Type": "application/json",
     }
-    response = requests.post(
+    response = await http_utils.post(
         url=f"{base_url}/api/V1/savebusinessobject",
         data=payload,
         headers=headers)
@@ -0,0 +1,276 @@
+"""Factory of the asynchronous Azure SDK clients shared across invocations.
+
+Credentials and clients are built on first use and kept for the lifetime
+of the worker process, so warm invocations reuse their token caches and
+HTTP pipelines. The worker runs every invocation on the same event loop.
+
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional, Union
+
+from azure.identity.aio import (DefaultAzureCredential,
+                                ManagedIdentityCredential)
+from azure.purview.catalog.aio import PurviewCatalogClient
+from azure.purview.administration.account.aio import PurviewAccountClient
+from azure.servicebus.aio import ServiceBusClient, ServiceBusSender
+from azure.storage.blob.aio import BlobServiceClient
+
+from services.rate_limit import (PURVIEW_REQUESTS_PER_SECOND,
+                                 RateLimitPolicy, TokenBucket)
+from services.service_bus_utils import TopicSender
+
+Credential = Union[DefaultAzureCredential, ManagedIdentityCredential]
+
+# Seconds after which an idle link is renewed, Service Bus detaches the links
+# idle for 10 minutes
+SERVICE_BUS_LINK_IDLE_TIMEOUT = 300
+
+_clients: Dict[Hashable, object] = {}
+_clients_lock = threading.RLock()
+
+
+def _get_or_create(key: Hashable, factory: Callable[[], object]):
+    """Return the memoized client for the key, building it on first use.
+        A client is only closed after being dropped from the memo, so the
+        memoized clients are always open.
+
+    Args:
+        key (Hashable): The client key
+        factory (Callable[[], object]): Builds the client
+
+    Returns:
+        object: The client
+    """
+    client = _clients.get(key)
+
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+
+    return client
+
+
+def get_purview_endpoint(account_name: Optional[str] = None) -> str:
+    """Return the endpoint of a Purview account.
+
+    Args:
+        account_name (Optional[str]): The Purview account name, defaults to
+            the purview_account_name app setting
+
+    Returns:
+        str: The Purview endpoint
+    """
+    account_name = account_name or os.environ['purview_account_name']
+    return f"https://{account_name}.purview.azure.com"
+
+
+def get_credential(client_id: Optional[str] = None) -> Credential:
+    """Return the credential of a managed identity.
+
+    Args:
+        client_id (Optional[str]): The client ID of the user assigned managed
+            identity, or None for the default Azure credential chain
+
+    Returns:
+        Credential: The credential
+    """
+    if client_id:
+        return _get_or_create(
+            ('credential', client_id),
+            lambda: ManagedIdentityCredential(client_id=client_id))
+
+    return _get_or_create(('credential', None), DefaultAzureCredential)
+
+
+def get_purview_rate_limit() -> TokenBucket:
+    """Return the token bucket shared by the Purview clients.
+
+    The rate can be configured with the purview_requests_per_second app
+    setting, to match the capacity units of the Purview account.
+
+    Returns:
+        TokenBucket: The Purview token bucket
+    """
+    return _get_or_create(
+        'purview_rate_limit',
+        lambda: TokenBucket(float(os.environ.get(
+            'purview_requests_per_second', PURVIEW_REQUESTS_PER_SECOND))))
+
+
+def get_purview_client(
+        endpoint: Optional[str] = None,
+        client_id: Optional[str] = None) -> PurviewCatalogClient:
+    """Return a Purview catalog client.
+
+    Args:
+        endpoint (Optional[str]): The Purview endpoint, defaults to the
+            endpoint of the purview_account_name app setting
+        client_id (Optional[str]): The client ID of the managed identity,
+            or None for the default Azure credential chain
+
+    Returns:
+        PurviewCatalogClient: The Purview catalog client
+    """
+    endpoint = endpoint or get_purview_endpoint()
+
+    return _get_or_create(
+        ('purview_catalog', endpoint, client_id),
+        lambda: PurviewCatalogClient(
+            endpoint=endpoint, credential=get_credential(client_id),
+            per_retry_policies=[RateLimitPolicy(get_purview_rate_limit())]))
+
+
+def get_purview_account_client(
+        endpoint: Optional[str] = None,
+        client_id: Optional[str] = None) -> PurviewAccountClient:
+    """Return a Purview account client.
+
+    Args:
+        endpoint (Optional[str]): The Purview endpoint, defaults to the
+            endpoint of the purview_account_name app setting
+        client_id (Optional[str]): The client ID of the managed identity,
+            or None for the default Azure credential chain
+
+    Returns:
+        PurviewAccountClient: The Purview account client
+    """
+    endpoint = endpoint or get_purview_endpoint()
+
+    return _get_or_create(
+        ('purview_account', endpoint, client_id),
+        lambda: PurviewAccountClient(
+            endpoint=endpoint, credential=get_credential(client_id),
+            per_retry_policies=[RateLimitPolicy(get_purview_rate_limit())]))
+
+
+def get_blob_service_client(
+        service_uri: str,
+        client_id: Optional[str] = None) -> BlobServiceClient:
+    """Return an Azure Storage Blob service client.
+
+    Args:
+        service_uri (str): The Blob service URI
+        client_id (Optional[str]): The client ID of the managed identity,
+            or None for the default Azure credential chain
+
+    Returns:
+        BlobServiceClient: The Blob service client
+    """
+    return _get_or_create(
+        ('blob_service', service_uri, client_id),
+        lambda: BlobServiceClient(
+            service_uri, credential=get_credential(client_id)))
+
+
+def get_service_bus_client(
+        connection_string: Optional[str] = None) -> ServiceBusClient:
+    """Return a Service Bus client.
+
+    Args:
+        connection_string (Optional[str]): The Service Bus connection
+            string, defaults to the service_bus_connection app setting
+
+    Returns:
+        ServiceBusClient: The Service Bus client
+    """
+    connection_string = (connection_string
+                         or os.environ['service_bus_connection'])
+
+    return _get_or_create(
+        ('service_bus', connection_string),
+        lambda: ServiceBusClient.from_connection_string(
+            conn_str=connection_string, logging_enable=True))
+
+
+async def get_topic_sender(
+        topic_name: str,
+        connection_string: Optional[str] = None) -> TopicSender:
+    """Return a sender to a Service Bus topic, shared by the invocations.
+        The sender keeps its AMQP link open between invocations, the link is
+        renewed before reuse when it was idle long enough for Service Bus
+        to detach it, or when a send failed on it even after reconnecting.
+
+    Args:
+        topic_name (str): The topic name
+        connection_string (Optional[str]): The Service Bus connection
+            string, defaults to the service_bus_connection app setting
+
+    Returns:
+        TopicSender: The topic sender, with the lock to hold for each batch
+    """
+    connection_string = (connection_string
+                         or os.environ['service_bus_connection'])
+
+    topic = _get_or_create(
+        ('service_bus_sender', connection_string, topic_name),
+        lambda: TopicSender(get_service_bus_client(
+            connection_string).get_topic_sender(topic_name=topic_name)))
+
+    if not _is_usable(topic):
+        async with topic.lock:
+            if not _is_usable(topic):
+                await reconnect_topic_sender(topic_name, connection_string)
+
+    topic.last_used = time.monotonic()
+    return topic
+
+
+def _is_usable(topic: TopicSender) -> bool:
+    """Return whether the link of a shared sender can be reused, from the
+        state tracked by the invocations rather than the SDK internals.
+    """
+    return (topic.healthy and time.monotonic() - topic.last_used
+            < SERVICE_BUS_LINK_IDLE_TIMEOUT)
+
+
+async def reconnect_topic_sender(
+        topic_name: str,
+        connection_string: Optional[str] = None) -> ServiceBusSender:
+    """Replace the sender of a shared topic sender by a sender on a new
+        link, e.g. after its link was detached. The caller holds the lock of
+        the shared sender, the client is kept since each sender owns its
+        connection.
+
+    Args:
+        topic_name (str): The topic name
+        connection_string (Optional[str]): The Service Bus connection
+            string, defaults to the service_bus_connection app setting
+
+    Returns:
+        ServiceBusSender: The new sender
+    """
+    connection_string = (connection_string
+                         or os.environ['service_bus_connection'])
+    topic = _clients[('service_bus_sender', connection_string, topic_name)]
+
+    try:
+        await topic.sender.close()
+    except Exception:
+        pass
+
+    topic.sender = get_service_bus_client(
+        connection_string).get_topic_sender(topic_name=topic_name)
+    topic.healthy = True
+    topic.last_used = time.monotonic()
+    return topic.sender
+
+
+async def reset_clients():
+    """Close and drop every memoized client and credential.
+    """
+    with _clients_lock:
+        closing = list(_clients.values())
+        _clients.clear()
+
+    for client in closing:
+        close = getattr(client, 'close', None)
+        if close:
+            try:
+                await close()
+            except Exception:
+                pass
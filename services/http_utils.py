@@ -0,0 +1,227 @@
+"""Shared asynchronous HTTP session for the outbound REST calls.
+
+"""
+import asyncio
+import json
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Dict, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+from multidict import CIMultiDict
+
+# (connect, read) timeouts in seconds
+Timeout = Tuple[float, float]
+
+DEFAULT_TIMEOUT = (5, 30)
+
+# Timeouts for the hosts we call
+HOST_TIMEOUTS = {
+    'login.microsoftonline.com': (5, 15),
+    'api.powerbi.com': (5, 60)
+}
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Non-idempotent requests (e.g. creating an incident) are only retried
+# when the server guarantees the request was not processed.
+NON_IDEMPOTENT_RETRY_STATUSES = frozenset({429, 503})
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class RequestError(Exception):
+    """Raised when an HTTP request cannot be completed
+    """
+
+
+class HTTPStatusError(RequestError):
+    """Raised for an HTTP error status
+    """
+    def __init__(self, message: str, response: 'Response'):
+        super().__init__(message)
+        self.response = response
+
+
+@dataclass
+class Response:
+    """A fully read HTTP response
+    """
+    status_code: int
+    content: bytes = b''
+    headers: Mapping[str, str] = field(default_factory=dict)
+    url: str = ''
+
+    def __post_init__(self):
+        # Header names are case insensitive
+        self.headers = CIMultiDict(self.headers)
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPStatusError(
+                f'{self.status_code} error for url: {self.url}', self)
+
+
+@dataclass
+class RetryPolicy:
+    """Retry with exponential backoff and jitter on throttling and server
+        errors, honouring Retry-After
+    """
+    max_retries: int = 3
+    backoff_factor: float = 0.5
+    max_backoff: float = 60
+
+    def is_retry(self, method: str, status_code: int) -> bool:
+        if method.upper() in IDEMPOTENT_METHODS:
+            return status_code in RETRY_STATUSES
+        return status_code in NON_IDEMPOTENT_RETRY_STATUSES
+
+    def get_backoff(self, attempt: int,
+                    retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        backoff = self.backoff_factor * (2 ** attempt)
+        return min(backoff * random.uniform(0.5, 1.5), self.max_backoff)
+
+
+class Session:
+    """An aiohttp session with keep-alive connection pooling, timeouts per
+        host and retries.
+    """
+    def __init__(self,
+                 pool_size: int = 10,
+                 retry: Optional[RetryPolicy] = None,
+                 host_timeouts: Optional[Dict[str, Timeout]] = None,
+                 default_timeout: Timeout = DEFAULT_TIMEOUT):
+        self.pool_size = pool_size
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.host_timeouts = (host_timeouts if host_timeouts is not None
+                              else HOST_TIMEOUTS)
+        self.default_timeout = default_timeout
+        self._session = None
+        self._loop = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # aiohttp sessions are bound to the event loop they were created in
+        loop = asyncio.get_running_loop()
+        if (self._session is None or self._session.closed
+                or self._loop is not loop):
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size,
+                                               limit_per_host=self.pool_size))
+            self._loop = loop
+        return self._session
+
+    def get_timeout(self, url: str) -> aiohttp.ClientTimeout:
+        connect, read = self.host_timeouts.get(urlparse(url).hostname,
+                                               self.default_timeout)
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+    async def _send(self, method: str, url: str, **kwargs) -> Response:
+        async with self._get_session().request(method, url,
+                                               **kwargs) as response:
+            return Response(status_code=response.status,
+                            content=await response.read(),
+                            headers=response.headers,
+                            url=str(response.url))
+
+    async def request(self, method: str, url: str,
+                      timeout: Optional[Timeout] = None,
+                      **kwargs) -> Response:
+        """Send a request, retrying on throttling and server errors.
+
+        Args:
+            method (str): The HTTP method
+            url (str): The URL
+            timeout (Optional[Timeout]): (connect, read) timeouts overriding
+                the timeouts of the host
+
+        Raises:
+            RequestError: If the request cannot be completed
+
+        Returns:
+            Response: The last response received
+        """
+        client_timeout = (
+            aiohttp.ClientTimeout(sock_connect=timeout[0],
+                                  sock_read=timeout[1])
+            if timeout else self.get_timeout(url))
+
+        for attempt in range(self.retry.max_retries + 1):
+            try:
+                response = await self._send(method, url,
+                                            timeout=client_timeout, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                raise RequestError(
+                    f'{method} {url} failed: {ex!r}') from ex
+
+            if (attempt == self.retry.max_retries
+                    or not self.retry.is_retry(method, response.status_code)):
+                return response
+
+            await asyncio.sleep(self.retry.get_backoff(
+                attempt, response.headers.get('Retry-After')))
+
+        return response
+
+    async def close(self):
+        if (self._session is not None
+                and self._loop is asyncio.get_running_loop()):
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+
+_session = None
+
+
+def get_session() -> Session:
+    """Return the process-wide HTTP session, creating it on first use.
+
+    The pool size, retry count and backoff factor can be configured with the
+    http_pool_size, http_max_retries and http_backoff_factor app settings.
+
+    Returns:
+        Session: The shared HTTP session
+    """
+    global _session
+
+    if _session is None:
+        _session = Session(
+            pool_size=int(os.environ.get('http_pool_size', 10)),
+            retry=RetryPolicy(
+                max_retries=int(os.environ.get('http_max_retries', 3)),
+                backoff_factor=float(
+                    os.environ.get('http_backoff_factor', 0.5))))
+
+    return _session
+
+
+async def reset_session():
+    """Close and drop the shared HTTP session.
+    """
+    global _session
+
+    if _session is not None:
+        await _session.close()
+    _session = None
+
+
+async def get(url: str, **kwargs) -> Response:
+    """Send a GET request with the shared session.
+    """
+    return await get_session().request('GET', url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> Response:
+    """Send a POST request with the shared session.
+    """
+    return await get_session().request('POST', url, **kwargs)
@@ -1,25 +1,304 @@
 """
 Utils functions for PowerBI
 """
-import requests
+import asyncio
 import logging
+import random
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+from azure.storage.blob.aio import ContainerClient
+
+from services import http_utils
+from services.utils import (load_blob_json_with_etag, run_concurrently, save_blob_json,
+                            save_blob_json_if_match)
+
+REFRESH_MAX_CONCURRENCY = 4
+
+# Seconds between the polls of the refresh history, doubled after every poll up to the maximum
+REFRESH_POLL_INTERVAL = 5
+REFRESH_MAX_POLL_INTERVAL = 60
+REFRESH_WAIT_TIMEOUT = 600
+
+# Status of a refresh that has not completed yet in the refresh history
+REFRESH_IN_PROGRESS = "Unknown"
+
+# Seconds during which the refresh requests of a dataset are merged into the last refresh
+REFRESH_COALESCE_WINDOW = 60
+
+
+class RefreshThrottledError(Exception):
+    """
+    Raised when PowerBI keeps throttling the refresh requests of a dataset after the retries of the HTTP session
+    """
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        """
+        :param message    : The error message
+        :param retry_after: Seconds to wait before requesting the refresh again, when PowerBI sent a Retry-After
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenCache:
+    """
+    Cache of bearer tokens, shared by every PowerBIClient of the worker process
+    so warm invocations reuse the same token until it expires.
+    """
+    def __init__(self, refresh_margin: float = 300, expiry_skew: float = 60):
+        """
+        :param refresh_margin: Seconds before expiry from which a background refresh is started
+        :param expiry_skew   : Seconds before expiry from which a token is no longer handed out
+        """
+        self.refresh_margin = refresh_margin
+        self.expiry_skew = expiry_skew
+        self.hits = 0
+        self.misses = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+        self._tokens = {}
+        self._pending = {}
+        self._refreshing = {}
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Tuple[str, float]]]) -> str:
+        """
+        Return the cached token for the key, fetching a new one when needed.
+        Concurrent misses for the same key share a single fetch.
+        :param key  : The cache key identifying the token audience
+        :param fetch: A coroutine function returning a (token, expires_on) tuple, expires_on being an epoch time
+        :return: The access token
+        """
+        now = time.time()
+        token, expires_on = self._tokens.get(key, (None, 0))
+
+        if token is not None and now < expires_on - self.expiry_skew:
+            self.hits += 1
+            if (now >= expires_on - self.refresh_margin and key not in self._pending
+                    and key not in self._refreshing):
+                # Keep a reference, the event loop only holds weak references to its tasks
+                refreshing = asyncio.ensure_future(self._refresh(key, fetch))
+                self._refreshing[key] = refreshing
+                refreshing.add_done_callback(lambda task: self._refreshed(key, task))
+            return token
+
+        self.misses += 1
+        return await self._fetch(key, fetch)
+
+    def invalidate(self, key: Hashable):
+        """
+        Drop the cached token for the key.
+        :param key: The cache key identifying the token audience
+        """
+        self._tokens.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every cached token and reset the counters.
+        """
+        self._tokens.clear()
+        self._pending.clear()
+        self._refreshing.clear()
+        self.hits = 0
+        self.misses = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The cache counters
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "background_refreshes": self.background_refreshes,
+            "refresh_failures": self.refresh_failures
+        }
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Tuple[str, float]]]) -> str:
+        pending = self._pending.get(key)
+        if pending is None or pending.get_loop() is not asyncio.get_running_loop():
+            pending = asyncio.ensure_future(fetch())
+            self._pending[key] = pending
+            pending.add_done_callback(lambda future: self._store(key, future))
+        return (await asyncio.shield(pending))[0]
+
+    def _store(self, key: Hashable, future: asyncio.Future):
+        if self._pending.get(key) is future:
+            del self._pending[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        token, expires_on = future.result()
+        # Tokens without a known lifetime are never reused
+        if expires_on - self.expiry_skew > time.time():
+            self._tokens[key] = (token, expires_on)
+
+    async def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[Tuple[str, float]]]):
+        await self._fetch(key, fetch)
+        self.background_refreshes += 1
+
+    def _refreshed(self, key: Hashable, task: asyncio.Future):
+        if self._refreshing.get(key) is task:
+            del self._refreshing[key]
+        if task.cancelled():
+            logging.warning("Background refresh of the PowerBI access token was cancelled")
+            self.refresh_failures += 1
+        elif task.exception() is not None:
+            logging.warning("Background refresh of the PowerBI access token failed: %s", task.exception())
+            self.refresh_failures += 1
+
+
+TOKEN_CACHE = TokenCache()
+
+
+class IdCache:
+    """
+    Cache of the PowerBI workspace and dataset IDs by name, shared by every PowerBIClient of the worker process.
+    """
+    def __init__(self, ttl: float = 3600):
+        """
+        :param ttl: Seconds an ID is kept for
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._ids = {}
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """
+        :param key: The cache key identifying the named object
+        :return: The cached ID, or None if it is unknown or expired
+        """
+        object_id, expires_on = self._ids.get(key, (None, 0))
+        if object_id is not None and time.time() < expires_on:
+            self.hits += 1
+            return object_id
+        self._ids.pop(key, None)
+        self.misses += 1
+        return None
+
+    def set(self, key: Hashable, object_id: str):
+        """
+        :param key      : The cache key identifying the named object
+        :param object_id: The ID of the object
+        """
+        self._ids[key] = (object_id, time.time() + self.ttl)
+
+    def invalidate_id(self, object_id: str):
+        """
+        Drop every name mapped to an ID, e.g. when the object was not found.
+        :param object_id: The ID of the object
+        """
+        for key in [key for key, (cached_id, _) in self._ids.items() if cached_id == object_id]:
+            del self._ids[key]
+
+    def clear(self):
+        """
+        Drop every cached ID and reset the counters.
+        """
+        self._ids.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The cache counters
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._ids)}
+
+
+ID_CACHE = IdCache()
+
+
+def _get_token_expiry(json_response: dict) -> float:
+    """
+    Get the expiry epoch time of an OAuth token response.
+    :param json_response: The token endpoint response body
+    :return: The expiry time, or 0 if the response does not carry one
+    """
+    if 'expires_on' in json_response:
+        return float(json_response['expires_on'])
+    if 'expires_in' in json_response:
+        return time.time() + float(json_response['expires_in'])
+    return 0
+
+
+def _get_refresh_request_id(headers: Dict[str, str]) -> Optional[str]:
+    """
+    Get the request ID of an accepted refresh, from the Location of an enhanced refresh or the RequestId header.
+    :param headers: The headers of the refresh response
+    :return: The request ID, or None if the response does not carry one
+    """
+    headers = {name.lower(): value for name, value in headers.items()}
+    if headers.get('location'):
+        return headers['location'].rstrip('/').rsplit('/', 1)[-1]
+    return headers.get('requestid') or headers.get('x-ms-request-id')
+
+
+def _get_retry_after(headers: Dict[str, str]) -> Optional[float]:
+    """
+    Get the delay requested by a throttled response.
+    :param headers: The headers of the response
+    :return: The delay in seconds, or None if the response does not carry a Retry-After in seconds
+    """
+    try:
+        return float(headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _get_refresh_duration(refresh: dict) -> Optional[float]:
+    """
+    Get the duration of a completed refresh from its start and end times.
+    :param refresh: The refresh from the refresh history
+    :return: The duration in seconds, or None if the refresh does not carry both times
+    """
+    try:
+        start_time = datetime.fromisoformat(refresh['startTime'].replace('Z', '+00:00'))
+        end_time = datetime.fromisoformat(refresh['endTime'].replace('Z', '+00:00'))
+    except (KeyError, AttributeError, ValueError):
+        return None
+    return (end_time - start_time).total_seconds()
+
+
+def _get_poll_interval(attempt: int, poll_interval: float, max_poll_interval: float) -> float:
+    """
+    Get the delay before the next poll, with exponential backoff and jitter.
+    :param attempt          : The number of polls already made
+    :param poll_interval    : The delay before the second poll
+    :param max_poll_interval: The maximum delay
+    :return: The delay in seconds
+    """
+    return min(poll_interval * (2 ** attempt) * random.uniform(0.5, 1.5), max_poll_interval)
 
 
 class PowerBIClient:
     """
     Anchor's PowerBI client that allows users to interact with the API
     """
-    def __init__(self, tenant_id: str, client_id: str, client_secret: str):
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str,
+                 token_cache: Optional[TokenCache] = None, id_cache: Optional[IdCache] = None):
         self._tenant_id = tenant_id
         self._client_id = client_id
         self._client_secret = client_secret
+        self._token_cache = token_cache if token_cache is not None else TOKEN_CACHE
+        self._id_cache = id_cache if id_cache is not None else ID_CACHE
 
-    def _get_access_token(self) -> str:
+    async def _get_access_token(self) -> str:
         """
-        Get the access token needed to call PowerBI APIs.
+        Get the access token needed to call PowerBI APIs, reusing the cached one while it is valid.
 
         :return: The access token
         """
+        return await self._token_cache.get((self._tenant_id, self._client_id), self._fetch_access_token)
+
+    async def _fetch_access_token(self) -> Tuple[str, float]:
+        """
+        Request a new access token from Azure AD.
+
+        :return: The access token and its expiry epoch time
+        """
         try:
             url = f"https://login.microsoftonline.com/{self._tenant_id}/oauth2/token?api-version=1.0"
             body = {
@@ -31,48 +310,55 @@ class PowerBIClient:
             headers = {
                 "Content-Type": "application/x-www-form-urlencoded"
             }
-            response = requests.post(url, data=body, headers=headers)
+            response = await http_utils.post(url, data=body, headers=headers)
             if response.status_code == 200:
                 json_response = response.json()
                 access_token = json_response['access_token']
+                expires_on = _get_token_expiry(json_response)
             else:
                 raise Exception("Error authenticating to microsoft to get a bearer token")
-        except requests.exceptions.RequestException as request_exception:
+        except http_utils.RequestError as request_exception:
             raise Exception("Error with API requests") from request_exception
         except Exception as e:
             raise Exception("Error getting access token for PowerBI") from e
         else:
-            return access_token
+            return access_token, expires_on
 
-    def get_workspace_id(self, powerbi_organisation: str, workspace_name: str) -> str:
+    async def get_workspace_id(self, powerbi_organisation: str, workspace_name: str) -> str:
         """
         Gets the workspace id from the workspace name
         :param powerbi_organisation: The organisation name used to create powerBI instance
         :param workspace_name      : The name of the workspace for which to return the ID
         :return: The ID of the workspace
         """
+        cache_key = ("workspace", powerbi_organisation, workspace_name)
+        workspace_id = self._id_cache.get(cache_key)
+        if workspace_id is not None:
+            return workspace_id
+
         try:
             url = f"https://api.powerbi.com/v1.0/{powerbi_organisation}/groups?$filter=name eq '{workspace_name}'"
             headers = {
-                "Authorization": "Bearer " + self._get_access_token()
+                "Authorization": "Bearer " + await self._get_access_token()
             }
-            response = requests.get(url=url, headers=headers)
+            response = await http_utils.get(url=url, headers=headers)
             if response.status_code == 200:
                 json_response = response.json()
                 if len(json_response['value']) == 1:
                     workspace_id = json_response['value'][0]['id']
+                    self._id_cache.set(cache_key, workspace_id)
                 else:
                     raise Exception("Error finding the correct workspace")
             else:
                 raise Exception("Error connecting to the PowerBI API to get the workspace ID")
-        except requests.exceptions.RequestException as request_exception:
+        except http_utils.RequestError as request_exception:
             raise Exception("Error with API requests") from request_exception
         except Exception as e:
             raise Exception("Error getting workspace ID for PowerBI") from e
         else:
             return workspace_id
 
-    def get_dataset_id(self, powerbi_organisation: str, workspace_id: str, dataset_name: str) -> str:
+    async def get_dataset_id(self, powerbi_organisation: str, workspace_id: str, dataset_name: str) -> str:
         """
         Gets the dataset id from the dataset name
         :param powerbi_organisation: The organisation name used to create powerBI instance
@@ -80,52 +366,452 @@ class PowerBIClient:
         :param dataset_name        : The name of the dataset for which to return the ID
         :return: The ID of the dataset
         """
+        dataset_id = self._id_cache.get(("dataset", powerbi_organisation, workspace_id, dataset_name))
+        if dataset_id is not None:
+            return dataset_id
+
         try:
-            url = f"https://api.powerbi.com/v1.0/{powerbi_organisation}/groups/{workspace_id}/datasets"
-            headers = {
-                "Authorization": "Bearer " + self._get_access_token()
-            }
-            response = requests.get(url=url, headers=headers)
-            if response.status_code == 200:
-                json_response = response.json()
-                datasets_filtered = [dataset for dataset in json_response['value'] if dataset['name'] == dataset_name]
-                if len(datasets_filtered) == 1:
-                    dataset_id = datasets_filtered[0]['id']
-                else:
-                    raise Exception("Error finding the correct Dataset")
+            datasets = await self._list_datasets(powerbi_organisation, workspace_id)
+            if datasets.get(dataset_name) is not None:
+                dataset_id = datasets[dataset_name]
             else:
-                raise Exception("Error connecting to the PowerBI API to get the Dataset ID")
-        except requests.exceptions.RequestException as request_exception:
+                raise Exception("Error finding the correct Dataset")
+        except http_utils.RequestError as request_exception:
             raise Exception("Error with API requests") from request_exception
         except Exception as e:
             raise Exception("Error getting Dataset ID for PowerBI") from e
         else:
             return dataset_id
 
-    def refresh_dataset(self, powerbi_organisation: str, workspace_id: str, dataset_id: str) -> bool:
+    async def prewarm_datasets(self, powerbi_organisation: str, workspace_id: str) -> Dict[str, Optional[str]]:
+        """
+        Caches the IDs of every dataset of a workspace from a single dataset listing
+        :param powerbi_organisation: The organisation name used to create powerBI instance
+        :param workspace_id        : The ID of the workspace where the datasets live
+        :return: The dataset IDs by name, None for the names shared by several datasets
+        """
+        try:
+            datasets = await self._list_datasets(powerbi_organisation, workspace_id)
+        except http_utils.RequestError as request_exception:
+            raise Exception("Error with API requests") from request_exception
+        except Exception as e:
+            raise Exception("Error listing the PowerBI Datasets") from e
+        else:
+            return datasets
+
+    async def _list_datasets(self, powerbi_organisation: str, workspace_id: str) -> Dict[str, Optional[str]]:
+        """
+        Lists the datasets of a workspace and caches their IDs
+        :param powerbi_organisation: The organisation name used to create powerBI instance
+        :param workspace_id        : The ID of the workspace where the datasets live
+        :return: The dataset IDs by name, None for the names shared by several datasets
+        """
+        url = f"https://api.powerbi.com/v1.0/{powerbi_organisation}/groups/{workspace_id}/datasets"
+        headers = {
+            "Authorization": "Bearer " + await self._get_access_token()
+        }
+        response = await http_utils.get(url=url, headers=headers)
+        if response.status_code != 200:
+            raise Exception("Error connecting to the PowerBI API to get the Dataset ID")
+
+        datasets = {}
+        for dataset in response.json()['value']:
+            # Names matching several datasets cannot be resolved
+            datasets[dataset['name']] = None if dataset['name'] in datasets else dataset['id']
+
+        for dataset_name, dataset_id in datasets.items():
+            if dataset_id is not None:
+                self._id_cache.set(("dataset", powerbi_organisation, workspace_id, dataset_name), dataset_id)
+
+        return datasets
+
+    async def refresh_dataset(self, powerbi_organisation: str, workspace_id: str, dataset_id: str) -> bool:
         """
         Refreshes a PowerBI dataset.
         :param powerbi_organisation: The organisation name used to create powerBI instance
         :param workspace_id        : The ID of the workspace where the dataset lives
         :param dataset_id          : The ID of the dataset to refresh
-        :return:
+        :return: Whether the refresh was accepted, False when PowerBI throttled it
+        """
+        try:
+            refresh_status, _ = await self.start_refresh(powerbi_organisation, workspace_id, dataset_id)
+        except RefreshThrottledError as e:
+            logging.warning(str(e))
+            return False
+        return refresh_status
+
+    async def start_refresh(self, powerbi_organisation: str, workspace_id: str,
+                            dataset_id: str) -> Tuple[bool, Optional[str]]:
+        """
+        Refreshes a PowerBI dataset and returns the request ID to track the refresh with.
+        :param powerbi_organisation: The organisation name used to create powerBI instance
+        :param workspace_id        : The ID of the workspace where the dataset lives
+        :param dataset_id          : The ID of the dataset to refresh
+        :return: Whether the refresh was accepted, and its request ID when PowerBI returned one
+        :raises RefreshThrottledError: If PowerBI still throttled the refresh after the retries of the HTTP session,
+                                       which already waited for the Retry-After delays
         """
         try:
             url = f"https://api.powerbi.com/v1.0/{powerbi_organisation}/groups/{workspace_id}/datasets/{dataset_id}/refreshes"
             headers = {
-                "Authorization": "Bearer " + self._get_access_token()
+                "Authorization": "Bearer " + await self._get_access_token()
             }
-            response = requests.post(url=url, headers=headers)
+            response = await http_utils.post(url=url, headers=headers)
+            request_id = None
             if response.status_code == 202:
                 refresh_status = True
+                request_id = _get_refresh_request_id(response.headers)
             elif response.status_code == 429:
-                logging.warn("Too many requests to refresh this powerBI dataset")
-                refresh_status = True
+                raise RefreshThrottledError("Too many requests to refresh this powerBI dataset",
+                                            _get_retry_after(response.headers))
+            elif response.status_code == 404:
+                # The workspace or dataset was deleted or recreated
+                self._id_cache.invalidate_id(dataset_id)
+                self._id_cache.invalidate_id(workspace_id)
+                refresh_status = False
             else:
                 refresh_status = False
-        except requests.exceptions.RequestException as request_exception:
+        except RefreshThrottledError:
+            raise
+        except http_utils.RequestError as request_exception:
             raise Exception("Error with API requests") from request_exception
         except Exception as e:
             raise Exception("Error refreshing Dataset") from e
         else:
-            return refresh_status
+            return refresh_status, request_id
+
+    async def get_refresh_history(self, powerbi_organisation: str, workspace_id: str, dataset_id: str,
+                                  top: int = 5) -> List[dict]:
+        """
+        Gets the latest refreshes of a PowerBI dataset.
+        :param powerbi_organisation: The organisation name used to create powerBI instance
+        :param workspace_id        : The ID of the workspace where the dataset lives
+        :param dataset_id          : The ID of the dataset
+        :param top                 : The number of refreshes to return
+        :return: The refreshes, most recent first
+        """
+        try:
+            url = f"https://api.powerbi.com/v1.0/{powerbi_organisation}/groups/{workspace_id}/datasets/{dataset_id}/refreshes?$top={top}"
+            headers = {
+                "Authorization": "Bearer " + await self._get_access_token()
+            }
+            response = await http_utils.get(url=url, headers=headers)
+            if response.status_code == 200:
+                refreshes = response.json()['value']
+            else:
+                raise Exception("Error connecting to the PowerBI API to get the refresh history")
+        except http_utils.RequestError as request_exception:
+            raise Exception("Error with API requests") from request_exception
+        except Exception as e:
+            raise Exception("Error getting the Dataset refresh history") from e
+        else:
+            return refreshes
+
+    async def wait_for_refreshes(self, powerbi_organisation: str, workspace_id: str,
+                                 refreshes: Dict[str, Optional[str]],
+                                 poll_interval: float = REFRESH_POLL_INTERVAL,
+                                 max_poll_interval: float = REFRESH_MAX_POLL_INTERVAL,
+                                 timeout: float = REFRESH_WAIT_TIMEOUT,
+                                 max_concurrency: int = REFRESH_MAX_CONCURRENCY) -> Dict[str, dict]:
+        """
+        Waits for several PowerBI dataset refreshes to complete, polling the refresh history of every pending
+        dataset in a single loop with exponential backoff and jitter.
+        :param powerbi_organisation: The organisation name used to create powerBI instance
+        :param workspace_id        : The ID of the workspace where the datasets live
+        :param refreshes           : The request ID of each refresh by dataset ID, None when PowerBI did not return
+                                     one, as the latest refresh of the history may be a previous refresh
+        :param poll_interval       : Seconds before the second poll
+        :param max_poll_interval   : The maximum number of seconds between two polls
+        :param timeout             : Seconds after which the refreshes still running are no longer waited for
+        :param max_concurrency     : The maximum number of refresh histories requested at once
+        :return: The outcome of each refresh by dataset ID: its request ID, its status (completed, failed, cancelled,
+                 disabled, timeout, error, or untracked for the refreshes without request ID), its start and end
+                 times, its duration in seconds as reported by PowerBI and the number of seconds waited
+        """
+        start = time.monotonic()
+        pending = {dataset_id: request_id for dataset_id, request_id in refreshes.items() if request_id is not None}
+        outcomes = {dataset_id: {"request_id": None, "status": "untracked", "waited": 0}
+                    for dataset_id, request_id in refreshes.items() if request_id is None}
+        attempt = 0
+
+        while pending:
+            dataset_ids = list(pending)
+            results = await run_concurrently(
+                lambda dataset_id: self.get_refresh_history(powerbi_organisation, workspace_id, dataset_id),
+                dataset_ids, max_concurrency)
+            waited = time.monotonic() - start
+
+            for dataset_id, (history, error) in zip(dataset_ids, results):
+                request_id = pending[dataset_id]
+                if error is not None:
+                    logging.error("Error polling the refresh of the PowerBI dataset %s: %s", dataset_id, error)
+                    outcomes[dataset_id] = {"request_id": request_id, "status": "error", "waited": waited}
+                    del pending[dataset_id]
+                    continue
+
+                refresh = next((refresh for refresh in history if refresh.get('requestId') == request_id), None)
+                if refresh is None or refresh.get('status') == REFRESH_IN_PROGRESS:
+                    continue
+
+                outcomes[dataset_id] = {
+                    "request_id": request_id,
+                    "status": refresh['status'].lower(),
+                    "start_time": refresh.get('startTime'),
+                    "end_time": refresh.get('endTime'),
+                    "duration": _get_refresh_duration(refresh),
+                    "waited": waited
+                }
+                del pending[dataset_id]
+
+            if not pending:
+                break
+
+            delay = _get_poll_interval(attempt, poll_interval, max_poll_interval)
+            if waited + delay > timeout:
+                for dataset_id, request_id in pending.items():
+                    outcomes[dataset_id] = {"request_id": request_id, "status": "timeout", "waited": waited}
+                break
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        return outcomes
+
+    async def refresh_datasets(self, powerbi_organisation: str, workspace_id: str, dataset_names: List[str],
+                               max_concurrency: int = REFRESH_MAX_CONCURRENCY,
+                               coalescer: Optional['RefreshCoalescer'] = None) -> Dict[str, Dict[str, Optional[str]]]:
+        """
+        Refreshes several PowerBI datasets concurrently, resolving their IDs from a single dataset listing.
+        :param powerbi_organisation: The organisation name used to create powerBI instance
+        :param workspace_id        : The ID of the workspace where the datasets live
+        :param dataset_names       : The names of the datasets to refresh
+        :param max_concurrency     : The maximum number of refreshes requested at once
+        :param coalescer           : Merges the refreshes into the recent or running refreshes of the datasets
+        :return: The dataset ID, the refresh status and the refresh request ID of each dataset by name,
+                 the status being refreshing, coalesced, not_found, throttled, failed or error, with the seconds
+                 to wait before retrying as retry_after for the throttled datasets
+        """
+        dataset_names = list(dict.fromkeys(dataset_names))
+        cached_ids = [self._id_cache.get(("dataset", powerbi_organisation, workspace_id, dataset_name))
+                      for dataset_name in dataset_names]
+
+        if None in cached_ids:
+            datasets = await self.prewarm_datasets(powerbi_organisation, workspace_id)
+            cached_ids = [cached_id or datasets.get(dataset_name)
+                          for dataset_name, cached_id in zip(dataset_names, cached_ids)]
+
+        async def refresh(dataset_id: Optional[str]) -> Tuple[str, Optional[str]]:
+            if dataset_id is None:
+                return "not_found", None
+            if coalescer is not None:
+                return await coalescer.refresh(self, powerbi_organisation, workspace_id, dataset_id)
+            refresh_status, request_id = await self.start_refresh(powerbi_organisation, workspace_id, dataset_id)
+            return ("refreshing" if refresh_status else "failed"), request_id
+
+        results = await run_concurrently(refresh, cached_ids, max_concurrency)
+
+        statuses = {}
+        for dataset_name, dataset_id, (result, error) in zip(dataset_names, cached_ids, results):
+            if isinstance(error, RefreshThrottledError):
+                logging.warning("Refresh of the PowerBI dataset %s throttled: %s", dataset_name, error)
+                statuses[dataset_name] = {"dataset_id": dataset_id, "status": "throttled", "request_id": None,
+                                          "retry_after": error.retry_after}
+                continue
+            if error is not None:
+                logging.error("Error refreshing the PowerBI dataset %s: %s", dataset_name, error)
+                result = ("error", None)
+            status, request_id = result
+            statuses[dataset_name] = {"dataset_id": dataset_id, "status": status, "request_id": request_id}
+
+        return statuses
+
+
+class RefreshCoalescer:
+    """
+    Merges the refresh requests of a dataset arriving within a window of the last refresh, or while the last refresh
+    is still running, into a single trailing refresh requested once the window and the running refresh ended, so the
+    merged requests are served by a refresh started after them. The last refresh of every dataset is kept in a Blob,
+    updated with ETag conditions, so the requests are merged across the scaled out instances of the function app.
+    """
+    # The trailing refreshes scheduled by the worker process, the event loop only holds weak references to its tasks
+    _trailing: Dict[str, asyncio.Future] = {}
+
+    def __init__(self, container: ContainerClient, window: float = REFRESH_COALESCE_WINDOW,
+                 max_attempts: int = 5):
+        """
+        :param container   : The container of the refresh state Blobs
+        :param window      : Seconds during which the requests are merged into the last refresh
+        :param max_attempts: The maximum number of times the refresh state is read again after a concurrent update
+        """
+        self.window = window
+        self.max_attempts = max_attempts
+        self._container = container
+
+    async def refresh(self, powerbi_client: PowerBIClient, powerbi_organisation: str, workspace_id: str,
+                      dataset_id: str) -> Tuple[str, Optional[str]]:
+        """
+        Refreshes a PowerBI dataset unless the request can be merged into the trailing refresh of its last refresh.
+        The instance merging the first request after a refresh schedules the trailing refresh.
+        :param powerbi_client      : The client refreshing the dataset
+        :param powerbi_organisation: The organisation name used to create powerBI instance
+        :param workspace_id        : The ID of the workspace where the dataset lives
+        :param dataset_id          : The ID of the dataset to refresh
+        :return: The refresh status, refreshing with the request ID of the refresh, queued when the request is merged
+                 into the trailing refresh which has not started yet, or failed
+        """
+        blob_name = f"{workspace_id}/{dataset_id}.json"
+
+        for _ in range(self.max_attempts):
+            state, etag = await load_blob_json_with_etag(self._container, blob_name)
+
+            if state is not None and await self._is_pending(powerbi_client, powerbi_organisation, workspace_id,
+                                                            dataset_id, state):
+                if state.get('pending'):
+                    return "queued", None
+                try:
+                    await save_blob_json_if_match(self._container, blob_name, dict(state, pending=True), etag)
+                except (ResourceExistsError, ResourceModifiedError):
+                    continue
+                self._schedule_trailing(powerbi_client, powerbi_organisation, workspace_id, dataset_id)
+                return "queued", None
+
+            # Only one of the instances racing for the refresh wins the claim, the others merge into its trailing
+            # refresh
+            claim = {"requested_at": time.time(), "request_id": None, "pending": False}
+            try:
+                await save_blob_json_if_match(self._container, blob_name, claim, etag)
+            except (ResourceExistsError, ResourceModifiedError):
+                continue
+            return await self._start(powerbi_client, powerbi_organisation, workspace_id, dataset_id)
+
+        logging.warning("The refresh state %s kept being updated, merging the request into its trailing refresh",
+                        blob_name)
+        return "queued", None
+
+    async def drain(self):
+        """
+        Waits for the trailing refreshes scheduled by the worker process.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(task for task in list(self._trailing.values()) if task.get_loop() is loop),
+                             return_exceptions=True)
+
+    async def _start(self, powerbi_client: PowerBIClient, powerbi_organisation: str, workspace_id: str,
+                     dataset_id: str) -> Tuple[str, Optional[str]]:
+        """
+        Refreshes a dataset once its refresh was claimed, then saves the request ID of the refresh.
+        :return: The refresh status, refreshing or failed, and the request ID of the refresh
+        """
+        blob_name = f"{workspace_id}/{dataset_id}.json"
+        try:
+            refresh_status, request_id = await powerbi_client.start_refresh(powerbi_organisation, workspace_id,
+                                                                            dataset_id)
+        except Exception:
+            await self._release(blob_name)
+            raise
+
+        if not refresh_status:
+            await self._release(blob_name)
+            return "failed", None
+
+        # The requests merged in the meantime may have set the pending flag
+        for _ in range(self.max_attempts):
+            state, etag = await load_blob_json_with_etag(self._container, blob_name)
+            try:
+                await save_blob_json_if_match(self._container, blob_name, dict(state, request_id=request_id), etag)
+                break
+            except (ResourceExistsError, ResourceModifiedError):
+                continue
+        else:
+            logging.warning("Error saving the request ID of the refresh state %s", blob_name)
+
+        return "refreshing", request_id
+
+    def _schedule_trailing(self, powerbi_client: PowerBIClient, powerbi_organisation: str, workspace_id: str,
+                           dataset_id: str):
+        """
+        Schedules the trailing refresh of a dataset in the background.
+        """
+        blob_name = f"{workspace_id}/{dataset_id}.json"
+        trailing = asyncio.ensure_future(self._refresh_trailing(powerbi_client, powerbi_organisation, workspace_id,
+                                                                dataset_id))
+        self._trailing[blob_name] = trailing
+        trailing.add_done_callback(lambda task: self._trailing_done(blob_name, task))
+
+    async def _refresh_trailing(self, powerbi_client: PowerBIClient, powerbi_organisation: str, workspace_id: str,
+                                dataset_id: str):
+        """
+        Waits for the end of the window and of the running refresh of a dataset, then claims and refreshes it again.
+        When the worker process stops in the meantime, the next request after the window refreshes the dataset.
+        """
+        blob_name = f"{workspace_id}/{dataset_id}.json"
+        state, _ = await load_blob_json_with_etag(self._container, blob_name)
+        delay = state['requested_at'] + self.window - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # The request ID is saved once PowerBI accepted the refresh, shortly after the claim
+        state, _ = await load_blob_json_with_etag(self._container, blob_name)
+        if state.get('request_id') is not None:
+            # PowerBI rejects a refresh while the previous one is running, keep polling until it ended
+            while True:
+                outcomes = await powerbi_client.wait_for_refreshes(powerbi_organisation, workspace_id,
+                                                                   {dataset_id: state['request_id']})
+                if outcomes.get(dataset_id, {}).get('status') != "timeout":
+                    break
+
+        # The pending flag is set by the merged requests, so the trailing refresh claims the state directly
+        for _ in range(self.max_attempts):
+            state, etag = await load_blob_json_with_etag(self._container, blob_name)
+            if state is None or not state.get('pending'):
+                # A request refreshed the dataset once the running refresh ended, serving the merged requests
+                return
+            claim = {"requested_at": time.time(), "request_id": None, "pending": False}
+            try:
+                await save_blob_json_if_match(self._container, blob_name, claim, etag)
+            except (ResourceExistsError, ResourceModifiedError):
+                continue
+            status, request_id = await self._start(powerbi_client, powerbi_organisation, workspace_id, dataset_id)
+            logging.info("Trailing refresh of the PowerBI dataset %s: %s %s", dataset_id, status, request_id)
+            return
+
+        logging.warning("The refresh state %s kept being updated, the trailing refresh was not requested", blob_name)
+
+    def _trailing_done(self, blob_name: str, task: asyncio.Future):
+        if self._trailing.get(blob_name) is task:
+            del self._trailing[blob_name]
+        if task.cancelled():
+            logging.warning("Trailing refresh of %s was cancelled", blob_name)
+        elif task.exception() is not None:
+            logging.warning("Trailing refresh of %s failed: %s", blob_name, task.exception())
+
+    async def _is_pending(self, powerbi_client: PowerBIClient, powerbi_organisation: str, workspace_id: str,
+                          dataset_id: str, state: dict) -> bool:
+        """
+        Checks whether the last refresh of a dataset was requested within the window or is still running.
+        :param state: The last refresh of the dataset
+        :return: Whether new requests are merged into the trailing refresh of the last refresh
+        """
+        if time.time() - state['requested_at'] < self.window:
+            return True
+        if state.get('request_id') is None:
+            return False
+
+        try:
+            refreshes = await powerbi_client.get_refresh_history(powerbi_organisation, workspace_id, dataset_id)
+        except Exception as e:
+            logging.warning("Error getting the refresh history of the PowerBI dataset %s: %s", dataset_id, e)
+            return False
+
+        return any(refresh.get('requestId') == state['request_id'] and refresh.get('status') == REFRESH_IN_PROGRESS
+                   for refresh in refreshes)
+
+    async def _release(self, blob_name: str):
+        """
+        Gives up the claim of a refresh that was not accepted, so the next request refreshes the dataset.
+        :param blob_name: The name of the refresh state Blob
+        """
+        try:
+            await save_blob_json(self._container, blob_name, {"requested_at": 0, "request_id": None, "pending": False})
+        except Exception as e:
+            logging.warning("Error releasing the refresh state %s: %s", blob_name, e)
@@ -1,13 +1,22 @@
 """Utils functions for Azure Purview.
 
 """
+import asyncio
+import hashlib
 import json
+import logging
+import os
 import re
-from typing import Dict, List
-from azure.purview.catalog import PurviewCatalogClient
-from dataclasses import asdict
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from azure.core.exceptions import (HttpResponseError, ResourceExistsError,
+                                   ResourceNotFoundError)
+from azure.purview.catalog.aio import PurviewCatalogClient
 
-from services.utils import DataEntity
+from services.utils import DataEntity, Schema, as_schema, run_concurrently
 
 ENTITY_TYPE_PREFIX_MAPPING = {
     'azure_sql_table': 'mssql',
@@ -15,6 +24,15 @@ ENTITY_TYPE_PREFIX_MAPPING = {
 }
 
 
+PURVIEW_MAX_CONCURRENCY = 8
+
+# Maximum number of entities per bulk classification request
+CLASSIFICATION_BATCH_SIZE = 1000
+
+# Maximum number of results per discovery query page
+DISCOVERY_PAGE_SIZE = 1000
+
+
 PURVIEW_DATA_TYPE_MAPPING = {
     'string': 'String',
     'decimal': 'Decimal',
@@ -29,7 +47,507 @@ PURVIEW_DATA_TYPE_MAPPING = {
 }
 
 
-def get_dependencies(
+class MemoryCacheStore:
+    """In-process storage of the entity GUID cache. Entries are lost when
+        the worker process stops.
+    """
+    def load(self) -> Dict[str, list]:
+        return {}
+
+    def save(self, entries: Dict[str, list]):
+        pass
+
+
+class FileCacheStore:
+    """JSON file storage of the entity GUID cache, so entries survive
+        cold starts when the file lives on persistent storage.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, list]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, entries: Dict[str, list]):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                'w', dir=directory, delete=False, encoding='utf-8') as file:
+            json.dump(entries, file)
+        os.replace(file.name, self.path)
+
+
+class EntityGuidCache:
+    """An LRU cache of Purview entity GUIDs keyed by type name and
+        qualified name, with a time to live per entry.
+    """
+    def __init__(self, store=None, ttl: float = 3600,
+                 max_entries: int = 10000):
+        self.store = store if store is not None else MemoryCacheStore()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._dirty = False
+        self._flushing = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(type_name: str, qualified_name: str) -> str:
+        return f'{type_name}|{qualified_name}'
+
+    def _load(self) -> OrderedDict:
+        if self._entries is None:
+            now = time.time()
+            self._entries = OrderedDict(
+                (key, entry) for key, entry in self.store.load().items()
+                if entry[1] > now)
+        return self._entries
+
+    def get(self, type_name: str, qualified_name: str) -> Optional[str]:
+        """Return the cached GUID of an entity.
+
+        Args:
+            type_name (str): The entity type name
+            qualified_name (str): The entity qualified name
+
+        Returns:
+            Optional[str]: The GUID, or None if it is not cached or expired
+        """
+        key = self._key(type_name, qualified_name)
+
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+
+            if entry and entry[1] > time.time():
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if entry:
+                del entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, type_name: str, qualified_name: str, guid: str):
+        """Cache the GUID of an entity.
+
+        Args:
+            type_name (str): The entity type name
+            qualified_name (str): The entity qualified name
+            guid (str): The entity GUID
+        """
+        key = self._key(type_name, qualified_name)
+
+        with self._lock:
+            entries = self._load()
+            entries[key] = [guid, time.time() + self.ttl]
+            entries.move_to_end(key)
+
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+            self._dirty = True
+
+    def invalidate(self, type_name: str, qualified_name: str):
+        """Remove an entity from the cache.
+
+        Args:
+            type_name (str): The entity type name
+            qualified_name (str): The entity qualified name
+        """
+        key = self._key(type_name, qualified_name)
+
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def clear(self):
+        """Remove every entity from the cache and reset the counters.
+        """
+        with self._lock:
+            self._entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+            self._dirty = True
+
+    async def flush(self):
+        """Save the entries changed since the last flush to the store, in
+            a worker thread so the event loop is not blocked. A flush
+            requested while another one is running is merged into it.
+        """
+        if self._flushing:
+            return
+
+        self._flushing = True
+        loop = asyncio.get_running_loop()
+        try:
+            while self._dirty:
+                with self._lock:
+                    entries = dict(self._load())
+                    self._dirty = False
+                try:
+                    await loop.run_in_executor(None, self.store.save, entries)
+                except OSError as ex:
+                    logging.warning('The entity GUID cache could not be '
+                                    'saved: %s', ex)
+                    self._dirty = True
+                    return
+        finally:
+            self._flushing = False
+
+
+_guid_cache = None
+_guid_cache_lock = threading.Lock()
+
+
+def get_guid_cache() -> EntityGuidCache:
+    """Return the process-wide entity GUID cache, creating it on first use.
+
+    The cache is file backed when the purview_guid_cache_path app setting
+    is set, and its time to live in seconds can be set with
+    purview_guid_cache_ttl.
+
+    Returns:
+        EntityGuidCache: The entity GUID cache
+    """
+    global _guid_cache
+
+    if _guid_cache is None:
+        with _guid_cache_lock:
+            if _guid_cache is None:
+                path = os.environ.get('purview_guid_cache_path')
+                _guid_cache = EntityGuidCache(
+                    store=FileCacheStore(path) if path else None,
+                    ttl=float(os.environ.get('purview_guid_cache_ttl', 3600)))
+
+    return _guid_cache
+
+
+def set_guid_cache(cache: Optional[EntityGuidCache]):
+    """Replace the process-wide entity GUID cache.
+
+    Args:
+        cache (Optional[EntityGuidCache]): The new cache, or None to
+            rebuild it from the app settings on next use
+    """
+    global _guid_cache
+
+    with _guid_cache_lock:
+        _guid_cache = cache
+
+
+async def resolve_entity_guid(
+        client: PurviewCatalogClient,
+        type_name: str,
+        qualified_name: str) -> str:
+    """Get the GUID of an entity from its qualified name, using the
+        entity GUID cache.
+
+    Args:
+        client (PurviewCatalogClient): An authentified Purview client object
+        type_name (str): The entity type name
+        qualified_name (str): The entity qualified name
+
+    Returns:
+        str: The entity GUID
+    """
+    cache = get_guid_cache()
+    guid = cache.get(type_name, qualified_name)
+
+    if guid is None:
+        response = await client.entity.get_by_unique_attributes(
+            type_name, attr_qualified_name=qualified_name)
+        guid = response['entity']['guid']
+        cache.set(type_name, qualified_name, guid)
+        await cache.flush()
+
+    return guid
+
+
+async def invalidate_entities(*payloads: Dict):
+    """Remove the entities of Purview write payloads from the GUID cache,
+        saving the cache once for all of them.
+
+    Args:
+        payloads (Dict): Payloads of entities created or updated, either
+            single ({"entity": ...}) or bulk ({"entities": [...]})
+    """
+    cache = get_guid_cache()
+
+    for payload in payloads:
+        entities = payload.get('entities') or [payload.get('entity', {})]
+
+        for entity in entities:
+            qualified_name = entity.get('attributes', {}).get('qualifiedName')
+            if qualified_name:
+                cache.invalidate(entity.get('typeName'), qualified_name)
+
+    await cache.flush()
+
+
+class CollectionCache:
+    """Process-wide record of the Purview collections known to exist, so
+        that collections are only upserted once per worker per time to live.
+    """
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.upserts = 0
+        self.skipped_upserts = 0
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    async def ensure(self, account_client, collection: str) -> bool:
+        """Upsert a collection unless it is known to exist.
+
+        Args:
+            account_client (PurviewAccountClient): An authentified Purview
+                account client object
+            collection (str): The collection name
+
+        Returns:
+            bool: True if the collection was upserted, False if skipped
+        """
+        with self._lock:
+            if self._collections.get(collection, 0) > time.time():
+                self.skipped_upserts += 1
+                return False
+
+        # In case of a Purview concurrency exception, ignore the failure and
+        # let the other instance perform the upsert.
+        try:
+            await account_client.collections.create_or_update_collection(
+                collection, {"name": collection})
+        except ResourceExistsError as ex:
+            warning_message = f'Purview collection concurrency issue: {repr(ex)}'
+            logging.warning(str(warning_message))
+
+        with self._lock:
+            self._collections[collection] = time.time() + self.ttl
+            self.upserts += 1
+
+        return True
+
+    def invalidate(self, collection: str):
+        """Forget that a collection exists.
+
+        Args:
+            collection (str): The collection name
+        """
+        with self._lock:
+            self._collections.pop(collection, None)
+
+    def clear(self):
+        """Forget every collection and reset the counters.
+        """
+        with self._lock:
+            self._collections.clear()
+            self.upserts = 0
+            self.skipped_upserts = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache counters.
+
+        Returns:
+            Dict[str, int]: The number of upserts and skipped upserts
+        """
+        with self._lock:
+            return {
+                "upserts": self.upserts,
+                "skipped_upserts": self.skipped_upserts
+            }
+
+
+COLLECTION_CACHE = CollectionCache(
+    ttl=float(os.environ.get('purview_collection_cache_ttl', 3600)))
+
+
+class BulkEntityPlan:
+    """Collects the entities of a single create_or_update_bulk call.
+        Each entity gets a negative placeholder GUID that the other
+        entities of the payload can reference before it exists.
+    """
+    def __init__(self):
+        self.entities = []
+
+    def add(self, entity: Dict) -> int:
+        """Add an entity to the plan.
+
+        Args:
+            entity (Dict): The Purview entity definition
+
+        Returns:
+            int: The placeholder GUID of the entity
+        """
+        guid = -(len(self.entities) + 1)
+        self.entities.append(dict(entity, guid=guid))
+        return guid
+
+    def payload(self) -> Dict:
+        """Return the bulk payload of the planned entities.
+
+        Returns:
+            Dict: The create_or_update_bulk payload
+        """
+        return {"entities": self.entities}
+
+
+async def get_entity_attributes(
+        client: PurviewCatalogClient,
+        type_name: str,
+        qualified_name: str) -> Dict:
+    """Get the attributes of an entity from its qualified name.
+
+    Args:
+        client (PurviewCatalogClient): An authentified Purview client object
+        type_name (str): The entity type name
+        qualified_name (str): The entity qualified name
+
+    Returns:
+        Dict: The entity attributes, empty if the entity does not exist
+    """
+    try:
+        response = await client.entity.get_by_unique_attributes(
+            type_name, attr_qualified_name=qualified_name,
+            min_ext_info=True, ignore_relationships=True)
+    except ResourceNotFoundError:
+        return {}
+
+    return response['entity'].get('attributes', {})
+
+
+def get_column_classifications(schema: Dict) -> Dict[str, List[str]]:
+    """Get the classifications of the columns of a tabular schema.
+
+    Args:
+        schema (Dict): The tabular schema entity with its referred entities
+
+    Returns:
+        Dict[str, List[str]]: The classification type names by column name,
+            for the classified columns only
+    """
+    columns = {}
+
+    for col in schema['referredEntities'].values():
+        classifications = col.get('classifications')
+
+        if classifications:
+            columns[col['attributes']['name']] = [
+                item['typeName'] for item in classifications]
+
+    return columns
+
+
+def get_classifications_fingerprint(columns: Dict[str, List[str]]) -> str:
+    """Get a fingerprint of the classifications of the columns of a schema,
+        changing whenever a classified column or its classifications change.
+
+    Args:
+        columns (Dict[str, List[str]]): The classification type names by
+            column name
+
+    Returns:
+        str: The fingerprint
+    """
+    content = json.dumps({name: sorted(type_names)
+                          for name, type_names in columns.items()},
+                         sort_keys=True)
+
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def plan_classifications(columns: Dict[str, List[str]],
+                         schema: Dict) -> Dict[str, List[str]]:
+    """Plan the classifications to add to the columns of a tabular schema.
+        Classifications the columns already have are left out, so
+        unchanged columns generate no write.
+
+    Args:
+        columns (Dict[str, List[str]]): The classification type names to
+            apply by column name
+        schema (Dict): The tabular schema entity with its referred entities
+
+    Returns:
+        Dict[str, List[str]]: The column GUIDs by classification type name
+    """
+    assignments = {}
+
+    for guid, col in schema['referredEntities'].items():
+        type_names = columns.get(col['attributes']['name'])
+        if not type_names:
+            continue
+
+        existing = {item['typeName']
+                    for item in col.get('classifications') or []}
+
+        for type_name in type_names:
+            if type_name not in existing:
+                assignments.setdefault(type_name, []).append(guid)
+
+    return assignments
+
+
+async def apply_classifications(
+        client: PurviewCatalogClient,
+        assignments: Dict[str, List[str]],
+        max_concurrency: int = PURVIEW_MAX_CONCURRENCY) -> int:
+    """Apply classifications with the bulk classification API, one request
+        per classification type and batch of CLASSIFICATION_BATCH_SIZE
+        entities.
+
+    Args:
+        client (PurviewCatalogClient): An authentified Purview client object
+        assignments (Dict[str, List[str]]): The entity GUIDs by
+            classification type name
+        max_concurrency (int): The maximum number of concurrent requests
+
+    Raises:
+        HttpResponseError: If a classification could not be applied
+
+    Returns:
+        int: The number of bulk classification requests sent
+    """
+    batches = [(type_name, guids[start:start + CLASSIFICATION_BATCH_SIZE])
+               for type_name, guids in assignments.items()
+               for start in range(0, len(guids), CLASSIFICATION_BATCH_SIZE)]
+
+    async def apply(batch):
+        type_name, guids = batch
+        classification = {'typeName': type_name}
+
+        try:
+            await client.entity.add_classification({
+                'classification': classification,
+                'entityGuids': guids
+            })
+        except HttpResponseError:
+            # An entity may have been classified since it was read,
+            # which fails the whole batch
+            for guid in guids:
+                try:
+                    await client.entity.add_classifications(
+                        guid, [classification])
+                except HttpResponseError:
+                    await client.entity.update_classifications(
+                        guid, [classification])
+
+    results = await run_concurrently(apply, batches, max_concurrency)
+
+    for _, error in results:
+        if error:
+            raise error
+
+    return len(batches)
+
+
+async def get_dependencies(
         client: PurviewCatalogClient,
         entity_qname: str,
         entity_type: str) -> List[str]:
@@ -44,12 +562,18 @@ def get_dependencies(
         List[str]: A list of dependent assets with their type
     """
     try:
-        response_get_id = client.entity.get_by_unique_attributes(
-            entity_type, attr_qualified_name=entity_qname)
-        entity_guid = response_get_id['entity']['guid']
-
-        response_lineage = client.lineage.get_lineage_graph(
-            entity_guid, direction="OUTPUT")
+        entity_guid = await resolve_entity_guid(client, entity_type,
+                                                entity_qname)
+
+        try:
+            response_lineage = await client.lineage.get_lineage_graph(
+                entity_guid, direction="OUTPUT")
+        except Exception:
+            # The cached GUID may belong to a deleted entity
+            cache = get_guid_cache()
+            cache.invalidate(entity_type, entity_qname)
+            await cache.flush()
+            raise
 
         return [f"{attr['attributes']['name']} ({attr.get('typeName')})"
                 for attr in response_lineage['guidEntityMap'].values()
@@ -206,28 +730,36 @@ def build_purview_qname(
     return f'{prefix}://{server_name}/{schema}/{name}'
 
 
-def get_dependencies_list(
+async def get_dependencies_list(
         client: PurviewCatalogClient,
-        error_context) -> List[str]:
+        error_context,
+        max_concurrency: int = PURVIEW_MAX_CONCURRENCY) -> List[str]:
     """Get a list of dependencies based on the input error context.
+        Each distinct asset is looked up once and the lookups run
+        concurrently.
 
     Args:
         client (PurviewCatalogClient): An authentified Purview client object
         error_context ([type]): The error context
+        max_concurrency (int): The maximum number of concurrent lookups
 
     Returns:
         List[str]: A list of distinct dependent assets with their type
     """
-    affected_dependencies = set()
+    assets = list(dict.fromkeys(
+        (build_purview_qname(asset.name, asset.schema,
+                             asset.entity_type, asset.server_name),
+         asset.entity_type)
+        for asset in error_context))
 
-    for asset in error_context:
-        asset_qname = build_purview_qname(asset.name, asset.schema,
-                                          asset.entity_type, asset.server_name)
-        dependencies = get_dependencies(client, asset_qname, asset.entity_type)
+    results = await run_concurrently(
+        lambda asset: get_dependencies(client, *asset),
+        assets, max_concurrency)
 
-        for dependency in dependencies:
-            if dependency not in affected_dependencies:
-                affected_dependencies.add(dependency)
+    affected_dependencies = set()
+
+    for dependencies, _ in results:
+        affected_dependencies.update(dependencies)
 
     return affected_dependencies
 
@@ -251,27 +783,28 @@ def get_purview_data_type(data_type: str) -> str:
     return purview_data_type
 
 
-def get_purview_columns(columns: List[DataEntity], base_qname: str,
-                        guid: int) -> Dict:
+def get_purview_columns(columns: Union[Schema, List[DataEntity]],
+                        base_qname: str, guid: int) -> Dict:
     """Get a list Purview columns definition.
 
     Args:
-        columns (List[DataEntity]): A list of columns.
+        columns (Union[Schema, List[DataEntity]]): The columns
         base_qname (str): The base qualified name of the asset
         guid (int): The parent GUID
 
     Returns:
         Dict: The list of Purview columns definition
     """
+    schema = as_schema(columns)
     columns_def = []
 
-    for col in columns:
+    for name, data_type in zip(schema.names, schema.types):
         col_def = {
             "typeName": "column",
             "attributes": {
-                "qualifiedName": f"{base_qname}#tabular_schema//{col.name}",
-                "name": col.name,
-                "type": get_purview_data_type(col.type)
+                "qualifiedName": f"{base_qname}#tabular_schema//{name}",
+                "name": name,
+                "type": get_purview_data_type(data_type)
             },
             "relationshipAttributes": {
                 "composeSchema": {
@@ -284,87 +817,127 @@ def get_purview_columns(columns: List[DataEntity], base_qname: str,
     return columns_def
 
 
-def get_purview_column_mapping(columns: List[DataEntity],
-                               datalake_name: str,
-                               sink_qname: str) -> str:
-    """Get a list of Purview column mapping definition.
+def get_source_qname(schema: Schema, index: int, datalake_name: str) -> str:
+    """Get the qualified name of the source file of a column.
 
     Args:
-        columns (List[DataEntity]): A list of columns to map
+        schema (Schema): The columns
+        index (int): The index of the column
         datalake_name (str): The name of the Azure Data Lake
-        sink_qname (str): The qualified name of the sink file
 
     Returns:
-        str: The Purview columns definition
+        str: The qualified name of the source file
     """
-    seen = set()
-    sources = [col.source_dataset for col in columns if not
-               (col.source_dataset in seen or seen.add(col.source_dataset))]
-    mapping = []
+    source_dataset = schema.source_datasets[index]
+
+    if schema.systems[index] == 'curated':
+        return build_curated_file_qname(datalake_name, source_dataset)
+    return build_staging_file_qname(datalake_name, DataEntity({
+        'system': schema.systems[index], 'display_name': source_dataset,
+        'version': schema.versions[index]}))
 
-    for source in sources:
-        items = [col for col in columns if col.source_dataset == source]
 
-        payload = asdict(items[0])
-        payload['display_name'] = items[0].source_dataset
-        config = DataEntity(payload)
+def group_columns_by_source(schema: Schema) -> Dict[str, List[int]]:
+    """Group the columns by source dataset in a single pass.
 
-        if config.system == 'curated':
-            qname = build_curated_file_qname(datalake_name,
-                                             config.source_dataset)
+    Args:
+        schema (Schema): The columns
+
+    Returns:
+        Dict[str, List[int]]: The indexes of the columns of each source
+            dataset, in the order the source datasets first appear
+    """
+    groups = {}
+
+    for index, source in enumerate(schema.source_datasets):
+        items = groups.get(source)
+        if items is None:
+            groups[source] = [index]
         else:
-            qname = build_staging_file_qname(datalake_name, config)
+            items.append(index)
+
+    return groups
+
+
+def get_purview_lineage(columns: Union[Schema, List[DataEntity]],
+                        datalake_name: str,
+                        sink_qname: str) -> Tuple[str, List[Dict]]:
+    """Get the Purview column mapping definition and the list of Purview
+        datasets of the source datasets of the columns, grouping the columns
+        once.
+
+    Args:
+        columns (Union[Schema, List[DataEntity]]): The columns to map
+        datalake_name (str): The name of the Azure Data Lake
+        sink_qname (str): The qualified name of the sink file
+
+    Returns:
+        Tuple[str, List[Dict]]: The Purview columns definition and the
+            Purview datasets definition
+    """
+    schema = as_schema(columns)
+    names = schema.names
+    source_names = schema.source_names
+    mapping = []
+    datasets = []
+
+    for items in group_columns_by_source(schema).values():
+        qname = get_source_qname(schema, items[0], datalake_name)
 
         mapping.append({
             "DatasetMapping": {
                 "Source": qname,
                 "Sink": sink_qname
             },
-            "ColumnMapping": [{"Source": item.source_name, "Sink": item.name}
-                              for item in items]
+            "ColumnMapping": [{"Source": source_names[index],
+                               "Sink": names[index]}
+                              for index in items]
+        })
+        datasets.append({
+            "typeName": "azure_datalake_gen2_resource_set",
+            "uniqueAttributes": {
+                "qualifiedName": qname
+            }
         })
 
-    return json.dumps(mapping)
+    return json.dumps(mapping), datasets
 
 
-def get_purview_datasets(columns: List[DataEntity],
-                         datalake_name: str) -> Dict:
-    """Get a list of Purview datasets.
+def get_purview_column_mapping(columns: Union[Schema, List[DataEntity]],
+                               datalake_name: str,
+                               sink_qname: str) -> str:
+    """Get a list of Purview column mapping definition.
 
     Args:
-        columns (List[DataEntity]): A list of columns to map
+        columns (Union[Schema, List[DataEntity]]): The columns to map
         datalake_name (str): The name of the Azure Data Lake
+        sink_qname (str): The qualified name of the sink file
 
     Returns:
-        str: The Purview datasets definition
+        str: The Purview columns definition
     """
-    # sources = set(col.source_dataset for col in columns)
-    seen = set()
-    sources = [col.source_dataset for col in columns if not
-               (col.source_dataset in seen or seen.add(col.source_dataset))]
-    datasets = []
+    return get_purview_lineage(columns, datalake_name, sink_qname)[0]
 
-    for source in sources:
-        items = [col for col in columns if col.source_dataset == source]
 
-        payload = asdict(items[0])
-        payload['display_name'] = items[0].source_dataset
-        config = DataEntity(payload)
+def get_purview_datasets(columns: Union[Schema, List[DataEntity]],
+                         datalake_name: str) -> Dict:
+    """Get a list of Purview datasets.
 
-        if config.system == 'curated':
-            qname = build_curated_file_qname(datalake_name,
-                                             config.source_dataset)
-        else:
-            qname = build_staging_file_qname(datalake_name, config)
+    Args:
+        columns (Union[Schema, List[DataEntity]]): The columns to map
+        datalake_name (str): The name of the Azure Data Lake
 
-        datasets.append({
-            "typeName": "azure_datalake_gen2_resource_set",
-            "uniqueAttributes": {
-                "qualifiedName": qname
-            }
-        })
+    Returns:
+        str: The Purview datasets definition
+    """
+    schema = as_schema(columns)
 
-    return datasets
+    return [{
+        "typeName": "azure_datalake_gen2_resource_set",
+        "uniqueAttributes": {
+            "qualifiedName": get_source_qname(schema, items[0], datalake_name)
+        }
+    } for items in group_columns_by_source(schema).values()]
 
 
 def purview_search_query(keyword: str, collection: str,
@@ -393,3 +966,47 @@ def purview_search_query(keyword: str, collection: str,
             ]
         }
     }
+
+
+async def iter_discovery_query(
+        client: PurviewCatalogClient,
+        query: Dict,
+        page_size: int = DISCOVERY_PAGE_SIZE) -> AsyncIterator[Dict]:
+    """Iterate lazily over every result of a Purview search query, one page
+        at a time. Pages are requested with the continuation token of the
+        previous page when the service returns one, by offset otherwise.
+
+    Args:
+        client (PurviewCatalogClient): An authentified Purview client object
+        query (Dict): The Purview search query, its limit and offset are
+            managed by the iterator
+        page_size (int): The number of results per page
+
+    Yields:
+        Dict: The search results
+    """
+    offset = 0
+    continuation_token = None
+
+    while True:
+        if continuation_token:
+            page_query = dict(query, limit=page_size,
+                              continuationToken=continuation_token)
+        else:
+            page_query = dict(query, limit=page_size, offset=offset)
+
+        response = await client.discovery.query(page_query)
+        results = response.get('value', [])
+
+        if not results:
+            return
+
+        for result in results:
+            yield result
+
+        if response.get('continuationToken'):
+            continuation_token = response['continuationToken']
+        elif continuation_token or len(results) < page_size:
+            return
+        else:
+            offset += len(results)
@@ -0,0 +1,108 @@
+"""Client side rate limiting of the Azure SDK clients.
+
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from azure.core.pipeline import PipelineRequest, PipelineResponse
+from azure.core.pipeline.policies import AsyncHTTPPolicy
+
+# Purview Data Map throughput of one capacity unit, in operations per second
+PURVIEW_REQUESTS_PER_SECOND = 25
+
+
+class TokenBucket():
+    """An asynchronous token bucket allowing a sustained rate of requests
+        with bursts up to its capacity. The bucket can be paused, e.g. for
+        the Retry-After delay of a throttled response.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Awaitable] = asyncio.sleep):
+        """
+        Args:
+            rate (float): The number of tokens added per second
+            capacity (Optional[float]): The maximum number of tokens,
+                defaults to one second worth of tokens
+            clock (Callable[[], float]): Returns the current time in seconds
+            sleep (Callable[[float], Awaitable]): Waits for a number of
+                seconds
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.throttled = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = None
+        self._loop = None
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait for a token to be available and take it.
+        """
+        # asyncio locks are bound to the event loop they are used in
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+
+        async with self._lock:
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    await self._sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                # Tolerate the rounding of the refill after a computed wait
+                if self._tokens >= 1 - 1e-9:
+                    self._tokens -= 1
+                    return
+
+                await self._sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for a number of seconds.
+
+        Args:
+            seconds (float): The pause duration
+        """
+        self.throttled += 1
+        self._paused_until = max(self._paused_until,
+                                 self._clock() + seconds)
+        self._tokens = 0
+
+
+class RateLimitPolicy(AsyncHTTPPolicy):
+    """An Azure SDK pipeline policy waiting for a token of a shared bucket
+        before every attempt of a request, and pausing the bucket for the
+        Retry-After delay of throttled responses.
+    """
+    def __init__(self, bucket: TokenBucket):
+        super().__init__()
+        self.bucket = bucket
+
+    async def send(self, request: PipelineRequest) -> PipelineResponse:
+        await self.bucket.acquire()
+        response = await self.next.send(request)
+
+        if response.http_response.status_code == 429:
+            retry_after = response.http_response.headers.get('Retry-After')
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = 1
+            logging.warning('Throttled by %s, pausing requests for %ss',
+                            request.http_request.url, delay)
+            self.bucket.pause(delay)
+
+        return response
@@ -0,0 +1,96 @@
+"""Utils functions for Azure Service Bus.
+
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import (AsyncIterator, Awaitable, Callable, Iterable, List,
+                    Optional, Tuple, Union)
+
+from azure.servicebus import ServiceBusMessage
+from azure.servicebus.aio import ServiceBusSender
+from azure.servicebus.exceptions import (MessageSizeExceededError,
+                                         ServiceBusCommunicationError,
+                                         ServiceBusConnectionError)
+
+# Errors after which the sender link must be recreated
+RECONNECT_ERRORS = (ServiceBusConnectionError, ServiceBusCommunicationError)
+
+
+@dataclass
+class TopicSender:
+    """A topic sender shared by concurrent invocations. The SDK senders and
+        message batches are not coroutine-safe, so each batch is built and
+        sent holding the lock.
+    """
+    sender: ServiceBusSender
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # When the link was last handed out, and whether a send failed on it
+    # even after reconnecting
+    last_used: float = field(default_factory=time.monotonic)
+    healthy: bool = True
+
+    async def close(self):
+        await self.sender.close()
+
+
+async def send_message_batches(
+        sender: Union[ServiceBusSender, TopicSender],
+        messages: Iterable[Tuple[ServiceBusMessage, List[str]]],
+        reconnect: Optional[Callable[[], Awaitable[ServiceBusSender]]] = None
+        ) -> AsyncIterator[List[str]]:
+    """Send messages in batches of the maximum size allowed by the entity.
+        A batch is sent as soon as the next message does not fit in it.
+
+    Args:
+        sender (Union[ServiceBusSender, TopicSender]): A Service Bus sender,
+            or a shared sender whose lock is held for every batch
+        messages (Iterable[Tuple[ServiceBusMessage, List[str]]]): The
+            messages to send, each with the IDs of the records it carries
+        reconnect (Optional[Callable[[], Awaitable[ServiceBusSender]]]):
+            Returns a new sender when the link of the sender was lost, the
+            batch is then sent again once. It is called holding the lock
+
+    Raises:
+        MessageSizeExceededError: If a single message exceeds the maximum
+            batch size
+        ServiceBusError: If a batch could not be sent, the IDs of the
+            batches sent before are yielded first
+
+    Yields:
+        List[str]: The record IDs of each batch successfully sent
+    """
+    topic = sender if isinstance(sender, TopicSender) else TopicSender(sender)
+    messages = iter(messages)
+    message = next(messages, None)
+    batch_count = 0
+
+    while message is not None:
+        async with topic.lock:
+            batch = await topic.sender.create_message_batch()
+            batch_ids = []
+
+            while message is not None:
+                try:
+                    batch.add_message(message[0])
+                except MessageSizeExceededError:
+                    if not len(batch):
+                        raise
+                    break
+                batch_ids.extend(message[1])
+                message = next(messages, None)
+
+            try:
+                await topic.sender.send_messages(batch)
+            except RECONNECT_ERRORS as ex:
+                if reconnect is None:
+                    raise
+                logging.warning('Service Bus link lost, reconnecting: %s', ex)
+                topic.sender = await reconnect()
+                await topic.sender.send_messages(batch)
+
+        batch_count += 1
+        logging.info('Sent Service Bus batch #%d of %d messages: %s',
+                     batch_count, len(batch), ','.join(batch_ids))
+        yield batch_ids
@@ -1,14 +1,83 @@
 """Utils functions for API and I/O.
 
 """
-import requests
+import asyncio
+import codecs
 import json
-from typing import List
+import sys
+from typing import (Any, AsyncIterable, AsyncIterator, Awaitable, Callable,
+                    Dict, FrozenSet, Iterable, Iterator, List, Optional,
+                    Tuple, Union)
 from datetime import datetime
 from dataclasses import dataclass, fields, field, InitVar
-from azure.storage.blob import ContainerClient
+from azure.core import MatchConditions
+from azure.core.exceptions import (HttpResponseError, ResourceExistsError,
+                                   ResourceNotFoundError)
+from azure.storage.blob.aio import ContainerClient
 
+from services import http_utils
 
+BLOB_MAX_CONCURRENCY = 8
+JSON_CHUNK_SIZE = 64 * 1024
+BLOB_BATCH_SIZE = 256
+
+
+class BlobOperationError(Exception):
+    """Raised when some Blobs of a list could not be processed
+    """
+    def __init__(self, message: str, failures: Dict[str, Exception]):
+        super().__init__(message)
+        self.failures = failures
+
+
+_field_names: Dict[type, FrozenSet[str]] = {}
+
+
+def _get_field_names(cls: type) -> FrozenSet[str]:
+    """Return the names of the fields of a dataclass, computed once per class.
+
+    Args:
+        cls (type): A dataclass
+
+    Returns:
+        FrozenSet[str]: The field names
+    """
+    names = _field_names.get(cls)
+    if names is None:
+        names = _field_names[cls] = frozenset(
+            data_field.name for data_field in fields(cls))
+    return names
+
+
+def _add_slots(cls: type) -> type:
+    """Recreate a dataclass with __slots__ holding its fields, as
+        dataclass(slots=True) does from Python 3.10.
+
+    Args:
+        cls (type): A dataclass, whose bases are slotted dataclasses
+
+    Returns:
+        type: The slotted dataclass
+    """
+    names = [data_field.name for data_field in fields(cls)]
+    inherited = {name for base in cls.__mro__[1:]
+                 for name in base.__dict__.get('__slots__', ())}
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = tuple(name for name in names
+                                  if name not in inherited)
+    # The defaults are bound to __init__, as class attributes they would
+    # conflict with the slots
+    for name in names:
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+# Entities are built for every column of every ADF structure, slots keep
+# them compact. Zero-argument super() does not work in classes recreated
+# with slots, the subclasses call the base __post_init__ explicitly.
+@_add_slots
 @dataclass
 class DataEntity:
     """Base class mapping the data entities
@@ -27,15 +96,147 @@ class DataEntity:
     mapped_name: str = ''
 
     def __post_init__(self, payload):
-        for data_field in fields(self):
-            if data_field.name in payload:
-                self.__setattr__(data_field.name, payload.get(data_field.name))
+        for name in _get_field_names(type(self)).intersection(payload):
+            setattr(self, name, payload[name])
 
         # Backward compatibility - Fix ASAP
         if not self.display_name and 'displayName' in payload:
-            self.display_name = payload.get('displayName')
+            self.display_name = payload['displayName']
+
+    @classmethod
+    def from_payloads(cls, payloads: Iterable[dict]) -> List['DataEntity']:
+        """Build an entity per payload.
+
+        Args:
+            payloads (Iterable[dict]): The payloads, e.g. the columns of an
+                ADF structure
+
+        Returns:
+            List[DataEntity]: The entities
+        """
+        return [cls(payload) for payload in payloads]
 
 
+_COLUMN_DEFAULTS = {data_field.name: data_field.default
+                    for data_field in fields(DataEntity)}
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+
+@_add_slots
+@dataclass
+class Column:
+    """A column of a schema, restricted to the attributes the schema stores
+    """
+    name: str
+    type: str
+    source_dataset: str
+    source_name: str
+    system: str
+    version: int
+
+
+@_add_slots
+@dataclass
+class Schema:
+    """Columnar representation of the columns of a structure, holding one
+        list per column attribute instead of an entity per column. Strings
+        are interned, so the types and source datasets repeated across the
+        columns are stored once.
+
+        Only the attributes listed in COLUMNS are stored, the others, e.g.
+        display_name or mapped_name, are dropped. Rows are therefore
+        returned as a Column rather than as a DataEntity.
+    """
+    names: List[str] = field(default_factory=list)
+    types: List[str] = field(default_factory=list)
+    source_datasets: List[str] = field(default_factory=list)
+    source_names: List[str] = field(default_factory=list)
+    systems: List[str] = field(default_factory=list)
+    versions: List[int] = field(default_factory=list)
+
+    # The DataEntity field stored by each list, in the order of the Column
+    # fields
+    COLUMNS = (('names', 'name'), ('types', 'type'),
+               ('source_datasets', 'source_dataset'),
+               ('source_names', 'source_name'), ('systems', 'system'),
+               ('versions', 'version'))
+
+    @classmethod
+    def from_payloads(cls, payloads: Iterable[dict]) -> 'Schema':
+        """Build a schema from column payloads, e.g. an ADF structure.
+
+        Args:
+            payloads (Iterable[dict]): The column payloads
+
+        Returns:
+            Schema: The schema
+        """
+        schema = cls()
+        columns = [(getattr(schema, attribute).append, name,
+                    _COLUMN_DEFAULTS[name])
+                   for attribute, name in cls.COLUMNS]
+
+        for payload in payloads:
+            for append, name, default in columns:
+                append(_intern(payload[name]) if name in payload
+                       else default)
+
+        return schema
+
+    @classmethod
+    def from_entities(cls, entities: Iterable[Union[DataEntity, Column]]
+                      ) -> 'Schema':
+        """Build a schema from column entities.
+
+        Args:
+            entities (Iterable[Union[DataEntity, Column]]): The column
+                entities
+
+        Returns:
+            Schema: The schema
+        """
+        schema = cls()
+        columns = [(getattr(schema, attribute).append, name)
+                   for attribute, name in cls.COLUMNS]
+
+        for entity in entities:
+            for append, name in columns:
+                append(_intern(getattr(entity, name)))
+
+        return schema
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> Column:
+        """Return a column, for row-wise access.
+        """
+        return Column(*(getattr(self, attribute)[index]
+                        for attribute, _ in self.COLUMNS))
+
+    def __iter__(self) -> Iterator[Column]:
+        return (self[index] for index in range(len(self)))
+
+
+def as_schema(columns: Union[Schema, Iterable[Union[DataEntity, Column]]]
+              ) -> Schema:
+    """Return columns as a schema, building it if they are entities.
+
+    Args:
+        columns (Union[Schema, Iterable[Union[DataEntity, Column]]]): The
+            columns
+
+    Returns:
+        Schema: The columns schema
+    """
+    return columns if isinstance(columns, Schema) else (
+        Schema.from_entities(columns))
+
+
+@_add_slots
 @dataclass
 class ErrorContext(DataEntity):
     """Contains the details of an error and the concerned assets
@@ -44,13 +245,14 @@ class ErrorContext(DataEntity):
     error_message: str = field(init=False)
 
     def __post_init__(self, payload):
-        super().__post_init__(payload)
+        DataEntity.__post_init__(self, payload)
 
         self.error_message = payload.get('error_message', (
                                         'Unknown error. Is there a valid'
                                         'config.json input file?'))
 
 
+@_add_slots
 @dataclass
 class DataMovement(DataEntity):
     """Contains the details of a data movement
@@ -68,16 +270,13 @@ class DataMovement(DataEntity):
     environment: str = ''
     purview_prefix: str = ''
     datalake_name: str = 'unknown'
-    structure: List[DataEntity] = field(default_factory=list)
+    structure: Schema = field(default_factory=Schema)
 
     def __post_init__(self, payload):
-        super().__post_init__(payload)
+        DataEntity.__post_init__(self, payload)
 
         # ADF outputs schemas as 'structure'
-        structure = []
-        for col in payload.get('structure', {}):
-            structure.append(DataEntity(col))
-        self.structure = structure
+        self.structure = Schema.from_payloads(payload.get('structure', {}))
 
         self.status = payload.get('executionDetails', [{}])[0].get('status')
 
@@ -111,7 +310,7 @@ class ColMap():
                 self.source_name)
 
 
-def get_auth_token(url: str, body: str, token_name: str) -> str:
+async def get_auth_token(url: str, body: str, token_name: str) -> str:
     """Obtains an API authentication token.
 
     Args:
@@ -123,7 +322,7 @@ def get_auth_token(url: str, body: str, token_name: str) -> str:
     Returns:
         str: The authentication token
     """
-    response = requests.post(url=url, data=body)
+    response = await http_utils.post(url=url, data=body)
 
     response.raise_for_status()
 
@@ -131,6 +330,100 @@ def get_auth_token(url: str, body: str, token_name: str) -> str:
     return data.get(token_name)
 
 
+def iter_chunks(data: bytes, size: int = JSON_CHUNK_SIZE) -> Iterator[bytes]:
+    """Split binary data into chunks.
+
+    Args:
+        data (bytes): The data to split
+        size (int): The maximum chunk size
+
+    Yields:
+        bytes: The next chunk
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), size):
+        yield view[start:start + size].tobytes()
+
+
+def iter_json_array(chunks: Iterable[bytes],
+                    encoding: str = 'utf-8') -> Iterator[Any]:
+    """Parse a JSON array incrementally, yielding its items as soon as they
+        are parsed so the array is never held in memory as a whole.
+
+    Args:
+        chunks (Iterable[bytes]): The encoded JSON array, in chunks
+        encoding (str): The text encoding
+
+    Raises:
+        ValueError: If the data is not a valid JSON array
+
+    Yields:
+        Any: The items of the array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    whitespace = ' \t\n\r'
+    buffer = ''
+    position = 0
+    # start: before '[', first: before the first item or ']',
+    # item: before an item, separator: before ',' or ']', end: after ']'
+    state = 'start'
+
+    def parse(final: bool):
+        nonlocal position, state
+
+        while True:
+            while position < len(buffer) and buffer[position] in whitespace:
+                position += 1
+            if position == len(buffer):
+                return
+
+            char = buffer[position]
+
+            if state == 'start':
+                if char != '[':
+                    raise ValueError(f'Expected a JSON array at {position}')
+                position += 1
+                state = 'first'
+            elif state == 'first' and char == ']':
+                position += 1
+                state = 'end'
+            elif state in ('first', 'item'):
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    return
+                # A number or literal not followed by a delimiter yet, e.g.
+                # '1.' or '1e', may go on in the next chunk
+                if (not final and not isinstance(item, (dict, list, str))
+                        and (end == len(buffer)
+                             or buffer[end] not in whitespace + ',]')):
+                    return
+                position = end
+                state = 'separator'
+                yield item
+            elif state == 'separator' and char in ',]':
+                position += 1
+                state = 'item' if char == ',' else 'end'
+            else:
+                raise ValueError(
+                    f'Unexpected character {char!r} in JSON array')
+
+    for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        yield from parse(final=False)
+
+    buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+    position = 0
+    yield from parse(final=True)
+
+    if state != 'end':
+        raise ValueError('Unexpected end of JSON array')
+
+
 def substitute_token(data: str, tokens: tuple) -> str:
     """[summary]
 
@@ -168,32 +461,297 @@ def get_error_type(error_message: str) -> str:
     return 'Data Pipeline failure'
 
 
-def load_blobs_json(blobs: iter, container: ContainerClient) -> List[object]:
-    """Load a list a Blobs into a JSON list
+async def run_concurrently(function: Callable[[Any], Awaitable[Any]],
+                           items: Iterable, max_concurrency: int
+                           ) -> List[Tuple[Any, Optional[Exception]]]:
+    """Await a coroutine function for each item, with a bounded number of
+        calls in flight.
+
+    Args:
+        function (Callable): The coroutine function to apply to each item
+        items (Iterable): The items to process
+        max_concurrency (int): The maximum number of concurrent calls
+
+    Returns:
+        List[Tuple[Any, Optional[Exception]]]: The (result, exception) of
+            each call, in the order of the input items
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def call(item):
+        async with semaphore:
+            try:
+                return await function(item), None
+            except Exception as ex:
+                return None, ex
+
+    return list(await asyncio.gather(*(call(item) for item in items)))
+
+
+async def iter_concurrently(function: Callable[[Any], Awaitable[Any]],
+                            items: AsyncIterable, workers: int
+                            ) -> AsyncIterator[Tuple[Any, Optional[Exception]]]:
+    """Await a coroutine function for each item of an asynchronous iterable
+        with a pool of workers. Items are read from the iterable as the
+        workers free up, so only a few items are held at any time.
+
+    Args:
+        function (Callable): The coroutine function to apply to each item
+        items (AsyncIterable): The items to process
+        workers (int): The number of concurrent workers
+
+    Raises:
+        Exception: Any exception raised while iterating over the items
+
+    Yields:
+        Tuple[Any, Optional[Exception]]: The (result, exception) of each
+            call, in the order of completion
+    """
+    workers = max(1, workers)
+    pending = asyncio.Queue(maxsize=workers)
+    done = asyncio.Queue()
+    end = object()
+
+    async def produce():
+        cancelled = False
+        try:
+            async for item in items:
+                await pending.put(item)
+        except asyncio.CancelledError:
+            # The workers are cancelled too, the queue may be full and is no
+            # longer drained
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                for _ in range(workers):
+                    await pending.put(end)
+
+    async def work():
+        try:
+            while True:
+                item = await pending.get()
+                if item is end:
+                    break
+                try:
+                    await done.put((await function(item), None))
+                except Exception as ex:
+                    await done.put((None, ex))
+        finally:
+            await done.put(end)
+
+    producer = asyncio.ensure_future(produce())
+    tasks = [asyncio.ensure_future(work()) for _ in range(workers)]
+
+    try:
+        running = workers
+        while running:
+            result = await done.get()
+            if result is end:
+                running -= 1
+            else:
+                yield result
+
+        # Raise the errors of the iterable
+        await producer
+    finally:
+        for task in [producer, *tasks]:
+            task.cancel()
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
+
+
+def get_blob_name(blob) -> str:
+    """Return the name of a Blob or Blob name.
+
+    Args:
+        blob: A Blob name or a BlobProperties object
+
+    Returns:
+        str: The name of the Blob
+    """
+    return getattr(blob, 'name', blob)
+
+
+async def load_blobs_json(blobs: iter, container: ContainerClient,
+                          max_concurrency: int = BLOB_MAX_CONCURRENCY
+                          ) -> List[object]:
+    """Load a list a Blobs into a JSON list, downloading them concurrently
 
     Args:
         blobs (iter): A list of Blobs
         container (ContainerClient): An Azure Storage Container Client
+        max_concurrency (int): The maximum number of concurrent downloads
+
+    Raises:
+        BlobOperationError: If any Blob could not be downloaded or parsed
+
+    Returns:
+        List[object]: A list of JSON objects contained in the Blobs, in the
+            order of the input Blobs
+    """
+    blobs = list(blobs)
+
+    async def load(blob):
+        data = await container.download_blob(blob)
+        return json.loads(await data.readall())
+
+    results = await run_concurrently(load, blobs, max_concurrency)
+
+    failures = {get_blob_name(blob): error
+                for blob, (_, error) in zip(blobs, results) if error}
+    if failures:
+        raise BlobOperationError(
+            f'Failed to load {len(failures)} of {len(blobs)} blobs: '
+            + ', '.join(f'{name} ({error!r})'
+                        for name, error in failures.items()),
+            failures)
+
+    return [item for item, _ in results]
+
+
+async def load_blob_json(container: ContainerClient, name: str,
+                         default: Any = None) -> Any:
+    """Load a JSON Blob.
+
+    Args:
+        container (ContainerClient): An Azure Storage Container Client
+        name (str): The Blob name
+        default (Any): The value returned if the Blob or its container does
+            not exist
+
+    Returns:
+        Any: The JSON object contained in the Blob
+    """
+    try:
+        data = await container.download_blob(name)
+    except ResourceNotFoundError:
+        return default
+
+    return json.loads(await data.readall())
+
+
+async def save_blob_json(container: ContainerClient, name: str,
+                         content: Any):
+    """Save a JSON object into a Blob, creating the container if needed.
+
+    Args:
+        container (ContainerClient): An Azure Storage Container Client
+        name (str): The Blob name
+        content (Any): The JSON object to save
+    """
+    data = json.dumps(content)
+
+    try:
+        await container.upload_blob(name, data, overwrite=True)
+    except ResourceNotFoundError:
+        await container.create_container()
+        await container.upload_blob(name, data, overwrite=True)
+
+
+async def load_blob_json_with_etag(container: ContainerClient, name: str,
+                                   default: Any = None
+                                   ) -> Tuple[Any, Optional[str]]:
+    """Load a JSON Blob with its ETag, to save it back only if it was not
+        modified in the meantime.
+
+    Args:
+        container (ContainerClient): An Azure Storage Container Client
+        name (str): The Blob name
+        default (Any): The value returned if the Blob or its container does
+            not exist
 
     Returns:
-        List[object]: A list of JSON objects contained in the Blobs
+        Tuple[Any, Optional[str]]: The JSON object contained in the Blob and
+            its ETag, None if the Blob does not exist
     """
-    blob_content = []
+    try:
+        data = await container.download_blob(name)
+    except ResourceNotFoundError:
+        return default, None
+
+    return json.loads(await data.readall()), data.properties.etag
 
-    for blob in blobs:
-        data = container.download_blob(blob)
-        item = json.loads(data.readall())
-        blob_content.append(item)
 
-    return blob_content
+async def save_blob_json_if_match(container: ContainerClient, name: str,
+                                  content: Any, etag: Optional[str]) -> str:
+    """Save a JSON object into a Blob only if the Blob was not modified
+        since it was loaded, creating the container if needed.
 
+    Args:
+        container (ContainerClient): An Azure Storage Container Client
+        name (str): The Blob name
+        content (Any): The JSON object to save
+        etag (Optional[str]): The ETag of the Blob when it was loaded, None
+            if the Blob did not exist
 
-def delete_blobs(blobs: iter, container: ContainerClient):
-    """Delete a list of Blobs
+    Raises:
+        ResourceExistsError: If the Blob was created in the meantime
+        ResourceModifiedError: If the Blob was modified in the meantime
+
+    Returns:
+        str: The new ETag of the Blob
+    """
+    data = json.dumps(content)
+    conditions = ({'overwrite': False} if etag is None else
+                  {'overwrite': True, 'etag': etag,
+                   'match_condition': MatchConditions.IfNotModified})
+
+    try:
+        properties = await container.upload_blob(name, data, **conditions)
+    except ResourceNotFoundError:
+        if etag is not None:
+            raise
+        try:
+            await container.create_container()
+        except ResourceExistsError:
+            pass
+        properties = await container.upload_blob(name, data, **conditions)
+
+    return properties['etag']
+
+
+async def delete_blobs(blobs: iter, container: ContainerClient,
+                       max_concurrency: int = BLOB_MAX_CONCURRENCY
+                       ) -> Dict[str, Optional[Exception]]:
+    """Delete a list of Blobs using the Blob batch API, falling back to
+        concurrent single deletes if a batch cannot be submitted
 
     Args:
         blobs (iter): A list of Blobs
         container (ContainerClient): An Azure Storage Container Client
+        max_concurrency (int): The maximum number of concurrent single deletes
+
+    Returns:
+        Dict[str, Optional[Exception]]: The error of each Blob by name,
+            None if the Blob was deleted
     """
-    for blob in blobs:
-        container.delete_blob(blob, delete_snapshots="include")
+    names = [get_blob_name(blob) for blob in blobs]
+    results = {}
+
+    for start in range(0, len(names), BLOB_BATCH_SIZE):
+        batch = names[start:start + BLOB_BATCH_SIZE]
+
+        try:
+            responses = await container.delete_blobs(
+                *batch, delete_snapshots='include',
+                raise_on_any_failure=False)
+
+            for name, response in zip(batch, [response async for response
+                                              in responses]):
+                results[name] = (
+                    None if response.status_code in (202, 404)
+                    else HttpResponseError(
+                        f'Failed to delete {name}', response=response))
+        except Exception:
+            deletes = await run_concurrently(
+                lambda name: container.delete_blob(
+                    name, delete_snapshots='include'),
+                batch, max_concurrency)
+
+            # As in a batch, a Blob already deleted is not a failure
+            for name, (_, error) in zip(batch, deletes):
+                results[name] = (
+                    None if isinstance(error, ResourceNotFoundError)
+                    else error)
+
+    return results
@@ -0,0 +1,142 @@
+"""Load tests of the asynchronous HTTP-triggered functions.
+
+A synchronous worker handles one invocation at a time, which is modelled by
+awaiting the invocations one after another. The asynchronous worker
+interleaves the invocations on its event loop while they wait on I/O.
+"""
+import asyncio
+import json
+import os
+import time
+from unittest.mock import patch
+import pytest
+import azure.functions as func
+
+import create_incident
+import refresh_powerbi_dataset
+from services import power_bi_utils, purview_utils
+from tests.fakes import FakeBlobServiceClient, FakeHttp, FakePurviewClient
+
+INVOCATIONS = 50
+LATENCY = 0.01
+
+HTTP_RESPONSE = {
+    'access_token': 'token',
+    'expires_in': 3600,
+    'busObPublicId': '59600',
+    'value': [{'id': 'id', 'name': 'my_dataset'}]
+}
+
+THROUGHPUT_TEST_ENV_VAR = {
+    'purview_account_name': 'purview',
+    'service_desk_base_url': 'https://servicedesk',
+    'service_desk_auth_endpoint': '/token',
+    'service_desk_client_id': '1234',
+    'service_desk_username': 'User',
+    'service_desk_password': 'Password',
+    'errorlog__clientId': '4440',
+    'errorlog__serviceUri': 'https://test.com',
+    'powerbi_organisation': 'myorg',
+    'environment': 'd01',
+    'powerbi_tenant_id': 'tenant_id',
+    'powerbi_client_id': 'client_id',
+    'powerbi_client_secret': 'client_secret'
+}
+
+
+async def invoke(main, requests, concurrent: bool):
+    """Invoke a function for every request, one at a time or concurrently
+    """
+    if concurrent:
+        return await asyncio.gather(*(main(req) for req in requests))
+    return [await main(req) for req in requests]
+
+
+def measure(main, prepare, concurrent: bool):
+    """Return the responses and the elapsed time of a load test run
+    """
+    requests = prepare()
+    start = time.perf_counter()
+    responses = asyncio.run(invoke(main, requests, concurrent))
+    return responses, time.perf_counter() - start
+
+
+def prepare_create_incident():
+    """Upload the error files of INVOCATIONS pipeline runs and return a
+        create_incident request per run
+    """
+    blob_service = FakeBlobServiceClient(latency=LATENCY)
+    container = blob_service.get_container_client('error-files')
+    requests = []
+
+    for run in range(INVOCATIONS):
+        for index in range(3):
+            container.upload_json(f'run{run}/{index}.json', {
+                'error_message': 'ErrorCode=SqlFailedToConnect',
+                'name': f'Table{index}',
+                'schema': 'dbo',
+                'system': 'Template'
+            })
+        requests.append(func.HttpRequest(
+            method='POST', body=b'', url='/api/create_incident',
+            params={'pipeline_run_id': f'run{run}'}))
+
+    purview_utils.set_guid_cache(purview_utils.EntityGuidCache())
+    patch('services.clients.get_blob_service_client',
+          return_value=blob_service).start()
+    patch('services.clients.get_purview_client',
+          return_value=FakePurviewClient(latency=LATENCY)).start()
+    http = FakeHttp(HTTP_RESPONSE, latency=LATENCY)
+    patch('services.http_utils.post', http.request).start()
+
+    return requests
+
+
+def prepare_refresh_powerbi_dataset():
+    """Return a refresh_powerbi_dataset request per invocation
+    """
+    power_bi_utils.TOKEN_CACHE.clear()
+    power_bi_utils.ID_CACHE.clear()
+    http = FakeHttp(HTTP_RESPONSE, latency=LATENCY,
+                    status_codes={'/refreshes': 202})
+    patch('services.http_utils.post', http.request).start()
+    patch('services.http_utils.get', http.request).start()
+
+    return [func.HttpRequest(
+        method='POST', body=json.dumps({'dataset_name': 'my_dataset'}).encode(
+            'utf8'), url='/api/refresh_powerbi_dataset')
+        for _ in range(INVOCATIONS)]
+
+
+LOAD_TESTS = [
+    (create_incident.main, prepare_create_incident),
+    (refresh_powerbi_dataset.main, prepare_refresh_powerbi_dataset)
+]
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('main, prepare', LOAD_TESTS)
+@patch.dict(os.environ, THROUGHPUT_TEST_ENV_VAR, clear=True)
+def test_benchmark_async_throughput(main, prepare):
+    """Compare the throughput of concurrent invocations with invocations
+        handled one at a time
+    """
+    try:
+        serial, serial_time = measure(main, prepare, concurrent=False)
+        patch.stopall()
+        concurrent, concurrent_time = measure(main, prepare, concurrent=True)
+    finally:
+        patch.stopall()
+        purview_utils.set_guid_cache(None)
+        power_bi_utils.TOKEN_CACHE.clear()
+        power_bi_utils.ID_CACHE.clear()
+
+    print(f'{main.__module__} {INVOCATIONS} invocations: serial '
+          f'{INVOCATIONS / serial_time:.0f}/s, concurrent '
+          f'{INVOCATIONS / concurrent_time:.0f}/s, '
+          f'speedup x{serial_time / concurrent_time:.1f}')
+
+    assert ([response.status_code for response in serial]
+            == [response.status_code for response in concurrent]
+            == [200] * INVOCATIONS
+            and serial_time / concurrent_time > 4)
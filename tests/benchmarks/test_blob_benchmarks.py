@@ -0,0 +1,46 @@
+"""Benchmarks of the Blob helpers against a local fake container.
+
+"""
+import asyncio
+import time
+import pytest
+
+from services import utils
+from tests.fakes import FakeContainerClient
+
+BLOB_COUNT = 200
+
+
+def prepare_container() -> FakeContainerClient:
+    """Create a fake container holding BLOB_COUNT error files
+    """
+    container = FakeContainerClient(latency=0.005)
+    for index in range(BLOB_COUNT):
+        container.upload_json(f'run_id/{index}.json',
+                              {'error_message': f'Error {index}'})
+    return container
+
+
+@pytest.mark.benchmark
+def test_benchmark_load_blobs_json():
+    """Compare the concurrent Blob loading with a sequential loop
+    """
+    container = prepare_container()
+    blobs = list(container.blobs)
+
+    start = time.perf_counter()
+    sequential = asyncio.run(
+        utils.load_blobs_json(blobs, container, max_concurrency=1))
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    concurrent = asyncio.run(
+        utils.load_blobs_json(blobs, container, max_concurrency=16))
+    concurrent_time = time.perf_counter() - start
+
+    print(f'load_blobs_json {BLOB_COUNT} blobs: sequential '
+          f'{sequential_time:.3f}s, concurrent {concurrent_time:.3f}s, '
+          f'speedup x{sequential_time / concurrent_time:.1f}')
+
+    assert (concurrent == sequential
+            and sequential_time / concurrent_time > 4)
@@ -0,0 +1,88 @@
+"""Benchmarks of the send_customer_updates indexing.
+
+"""
+import json
+import time
+import tracemalloc
+import pytest
+
+from send_customer_updates import index_customer_updates
+from services import utils
+
+ROW_COUNT = 100_000
+CUSTOMER_COUNT = 20_000
+
+
+def get_rows(count: int):
+    """Create count synthetic customer rows, five per customer
+    """
+    return [{'SEQUENCE_ID': index,
+             'PAR_REFNO': f'REF{index % (count // 5)}',
+             'NAME': f'Customer {index}'}
+            for index in range(count)]
+
+
+def measure(rows) -> float:
+    """Return the best time of three index builds
+    """
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        index_customer_updates(rows)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@pytest.mark.benchmark
+def test_benchmark_index_customer_updates():
+    """Check that the index build time grows linearly with the rows
+    """
+    small_rows = get_rows(ROW_COUNT // 10)
+    rows = get_rows(ROW_COUNT)
+
+    small_time = measure(small_rows)
+    full_time = measure(rows)
+    index = index_customer_updates(rows)
+
+    print(f'index_customer_updates {ROW_COUNT} rows: {full_time:.3f}s, '
+          f'{ROW_COUNT // 10} rows: {small_time:.3f}s')
+
+    # A quadratic scan would be a hundred times slower for ten times the rows
+    assert (len(index) == CUSTOMER_COUNT
+            and sum(len(ids) for _, ids in index.values()) == ROW_COUNT
+            and full_time / small_time < 50
+            and full_time < 2)
+
+
+def measure_peak_memory(function) -> int:
+    """Return the peak memory allocated by a function call
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.benchmark
+def test_benchmark_streaming_customer_updates_memory():
+    """Compare the peak memory of the streaming parser with json.loads
+    """
+    rows = get_rows(ROW_COUNT)
+    for row in rows:
+        row['PAR_REFNO'] = f'REF{row["SEQUENCE_ID"] % 1000}'
+    body = json.dumps(rows).encode('utf-8')
+    del rows
+
+    loaded_peak = measure_peak_memory(
+        lambda: index_customer_updates(json.loads(body)))
+    streamed_peak = measure_peak_memory(
+        lambda: index_customer_updates(
+            utils.iter_json_array(utils.iter_chunks(body))))
+
+    print(f'index_customer_updates {len(body) / 2 ** 20:.1f}MB body: '
+          f'json.loads peak {loaded_peak / 2 ** 20:.1f}MB, streamed peak '
+          f'{streamed_peak / 2 ** 20:.1f}MB')
+
+    assert streamed_peak * 3 < loaded_peak
@@ -0,0 +1,127 @@
+"""Benchmarks of the DataEntity construction.
+
+"""
+import json
+import time
+import tracemalloc
+from dataclasses import InitVar, dataclass, fields
+import pytest
+
+from services import utils
+
+COLUMN_COUNT = 500
+TABLE_COUNT = 100
+
+
+@dataclass
+class DictDataEntity:
+    """The DataEntity before slots, introspecting its fields for every
+        construction
+    """
+    payload: InitVar
+    entity_type: str = 'azure_sql_table'
+    name: str = 'Unknown asset'
+    display_name: str = ''
+    schema: str = ''
+    system: str = 'Unknown system'
+    server_name: str = ''
+    version: int = 1
+    type: str = ''
+    source_dataset: str = ''
+    source_name: str = ''
+    mapped_name: str = ''
+
+    def __post_init__(self, payload):
+        for data_field in fields(self):
+            if data_field.name in payload:
+                self.__setattr__(data_field.name, payload.get(data_field.name))
+
+        if not self.display_name and 'displayName' in payload:
+            self.display_name = payload.get('displayName')
+
+
+def get_structure(count: int):
+    """Create the ADF structure of a table with count columns
+    """
+    return [{'name': f'Column{index}', 'type': 'String'}
+            for index in range(count)]
+
+
+def measure(build, structure) -> float:
+    """Return the best time per entity of TABLE_COUNT table builds
+    """
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(TABLE_COUNT):
+            build(structure)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / (TABLE_COUNT * len(structure))
+
+
+def measure_memory(build, structure) -> float:
+    """Return the memory held per column of a table build
+    """
+    tracemalloc.start()
+    try:
+        entities = build(structure)
+        return tracemalloc.get_traced_memory()[0] / len(entities)
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.benchmark
+def test_benchmark_data_entity_construction():
+    """Compare the slotted DataEntity with the former dict based one
+    """
+    structure = get_structure(COLUMN_COUNT)
+
+    def build_dict_entities(payloads):
+        return [DictDataEntity(payload) for payload in payloads]
+
+    dict_time = measure(build_dict_entities, structure)
+    slots_time = measure(utils.DataEntity.from_payloads, structure)
+    dict_memory = measure_memory(build_dict_entities, structure)
+    slots_memory = measure_memory(utils.DataEntity.from_payloads, structure)
+
+    print(f'DataEntity per entity: dict {dict_time * 1e6:.2f}us '
+          f'{dict_memory:.0f}B, slots {slots_time * 1e6:.2f}us '
+          f'{slots_memory:.0f}B')
+
+    assert (utils.DataEntity.from_payloads(structure)[-1].name
+            == DictDataEntity(structure[-1]).name == 'Column499'
+            and slots_time * 1.5 < dict_time
+            and slots_memory < dict_memory)
+
+
+def get_wide_structure(count: int):
+    """Create the structure of a curated table with count columns read from
+        a few source datasets, decoded from JSON like a request body
+    """
+    return json.loads(json.dumps([
+        {'name': f'Column{index}', 'type': 'String', 'system': 'curated',
+         'source_name': f'SRC_COLUMN{index}',
+         'source_dataset': f'dataset{index % 5}'}
+        for index in range(count)]))
+
+
+@pytest.mark.benchmark
+def test_benchmark_schema_memory():
+    """Compare the memory of a columnar schema with a list of entities
+    """
+    structure = get_wide_structure(COLUMN_COUNT)
+
+    entities_memory = measure_memory(utils.DataEntity.from_payloads,
+                                     structure)
+    schema_memory = measure_memory(utils.Schema.from_payloads, structure)
+    entities_time = measure(utils.DataEntity.from_payloads, structure)
+    schema_time = measure(utils.Schema.from_payloads, structure)
+
+    print(f'Structure per column: entities {entities_time * 1e6:.2f}us '
+          f'{entities_memory:.0f}B, schema {schema_time * 1e6:.2f}us '
+          f'{schema_memory:.0f}B')
+
+    assert (utils.Schema.from_payloads(structure)
+            == utils.Schema.from_entities(
+                utils.DataEntity.from_payloads(structure))
+            and schema_memory * 1.5 < entities_memory)
@@ -2,12 +2,14 @@
 
 """
 import os
+import asyncio
 from unittest.mock import patch, MagicMock
 import pytest
 import azure.functions as func
 from typing import Mapping
 
 from create_incident import main
+from services import clients
 
 TEST_CREATE_INCIDENT_INPUT = [
     {
@@ -57,7 +59,7 @@ def test_create_incident_invalid_input(test_input: Mapping[str, str],
         url='/api/create_incident',
         params=test_input)
 
-    test_resp = main(test_req)
+    test_resp = asyncio.run(main(test_req))
 
     assert test_resp.status_code == expected_output
 
@@ -81,12 +83,13 @@ CREATE_INCIDENT_TEST_ENV_VAR = [
 @patch('services.cherwell_utils.create_incident')
 @patch('services.utils.get_auth_token')
 @patch('services.purview_utils.get_dependencies_list')
-@patch('create_incident.BlobServiceClient', MagicMock())
+@patch('services.clients.BlobServiceClient', MagicMock())
 @patch('services.utils.ContainerClient', MagicMock())
 def test_create_incident(mock_dp_list, mock_auth_token, mock_incident,
                          mock_input):
     """Test the create_incident function behaviour
     """
+    asyncio.run(clients.reset_clients())
     expected_status = 200
     expected_body = b'59600'
 
@@ -103,7 +106,8 @@ def test_create_incident(mock_dp_list, mock_auth_token, mock_incident,
         url='/api/create_incident',
         params={'pipeline_run_id': 'test_run_id'})
 
-    test_resp = main(test_req)
+    test_resp = asyncio.run(main(test_req))
+    asyncio.run(clients.reset_clients())
 
     assert (test_resp.status_code == expected_status
             and test_resp.get_body() == expected_body)
@@ -0,0 +1,91 @@
+"""Unit tests for the create_metadata Azure Function.
+
+"""
+import os
+import json
+import asyncio
+from unittest.mock import patch, AsyncMock, MagicMock
+import pytest
+import azure.functions as func
+
+from create_metadata import main
+from services import clients
+
+TEST_CREATE_METADATA_INPUT = {
+    "entity_type": "azure_sql_table",
+    "system": "Template",
+    "version": 1,
+    "displayName": "Customer",
+    "name": "Customer",
+    "schema": "SalesLT",
+    "environment": "d01",
+    "data_factory": "adf-test",
+    "pipeline_name": "pl_ingest",
+    "rowsCopied": 10,
+    "dataWritten": 100,
+    "executionDetails": [{
+        "status": "Succeeded",
+        "start": "2022-01-18T10:00:00.0000000Z"
+    }],
+    "structure": [
+        {"name": "id", "type": "int"},
+        {"name": "meta_date", "type": "timestamp"}
+    ]
+}
+
+CREATE_METADATA_TEST_ENV_VAR = [
+    ("purview_account_name", "purview"),
+    ("errorlog__clientId", "4440"),
+    ("azure_subscription", "sub"),
+    ("azure_resource_group", "rg"),
+    ("datalake_name", "lake")
+]
+
+
+@pytest.mark.dev
+@patch.dict(os.environ, CREATE_METADATA_TEST_ENV_VAR, clear=True)
+@patch('services.clients.PurviewAccountClient', MagicMock(return_value=AsyncMock()))
+@patch('services.clients.ManagedIdentityCredential', MagicMock())
+@patch('services.clients.PurviewCatalogClient', return_value=AsyncMock())
+def test_create_metadata_single_bulk_upsert(mock_client):
+    """Test that every entity is written with a single bulk upsert
+    """
+    asyncio.run(clients.reset_clients())
+    client = mock_client.return_value
+    client.entity.get_by_unique_attributes.return_value = {
+        'entity': {
+            'attributes': {
+                'lastRunTime': 1642496400000,
+                'rowCount': 5,
+                'dataSize': 50
+            }
+        }
+    }
+
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps(TEST_CREATE_METADATA_INPUT).encode('utf8'),
+        url='/api/create_metadata')
+
+    test_resp = asyncio.run(main(test_req))
+
+    entities = client.collection.create_or_update_bulk.call_args[0][1][
+        'entities']
+    by_type = {entity['typeName']: entity for entity in entities}
+    copy_activity = by_type['adf_copy_activity']['attributes']
+    operation = by_type['adf_copy_operation']['attributes']
+
+    assert (test_resp.status_code == 200
+            and client.collection.create_or_update_bulk.call_count == 1
+            and not client.collection.create_or_update.called
+            and len({entity['guid'] for entity in entities}) == len(entities)
+            and copy_activity['rowCount'] == 15
+            and copy_activity['dataSize'] == 150
+            and operation['inputs'][0]['guid']
+            == by_type['azure_sql_table']['guid']
+            and operation['outputs'][0]['guid']
+            == by_type['azure_datalake_gen2_resource_set']['guid']
+            and by_type['column']['relationshipAttributes']['composeSchema']
+            == {'guid': by_type['tabular_schema']['guid']})
+
+    asyncio.run(clients.reset_clients())
@@ -0,0 +1,218 @@
+"""Local fakes of the Azure services used by the tests and benchmarks.
+
+"""
+import asyncio
+import itertools
+import json
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from azure.core.exceptions import (ResourceExistsError, ResourceModifiedError,
+                                   ResourceNotFoundError)
+from azure.servicebus.exceptions import (MessageSizeExceededError,
+                                         ServiceBusConnectionError)
+
+from services.http_utils import Response
+
+
+class FakeDownloader():
+    """A fake of the Azure Storage StorageStreamDownloader
+    """
+    def __init__(self, content: bytes, etag: Optional[str] = None):
+        self._content = content
+        self.properties = SimpleNamespace(etag=etag)
+
+    async def readall(self) -> bytes:
+        return self._content
+
+
+class FakeBatchResponse():
+    """A fake of a sub-response of a Blob batch request
+    """
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class FakeContainerClient():
+    """An in-memory Azure Storage container, Azurite style, adding a fixed
+        latency to every request to simulate a network round trip.
+    """
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+        self.blobs: Dict[str, bytes] = {}
+        self.etags: Dict[str, str] = {}
+        self.requests = 0
+        self._versions = itertools.count(1)
+
+    async def _round_trip(self):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    def upload_json(self, name: str, content: object):
+        self.blobs[name] = json.dumps(content).encode('utf-8')
+        self.etags[name] = f'"{next(self._versions)}"'
+
+    async def list_blobs(self, name_starts_with: str = ''):
+        await self._round_trip()
+        for name in list(self.blobs):
+            if name.startswith(name_starts_with):
+                yield name
+
+    async def download_blob(self, blob) -> FakeDownloader:
+        await self._round_trip()
+        name = getattr(blob, 'name', blob)
+        if name not in self.blobs:
+            raise ResourceNotFoundError(f'The blob {name} does not exist')
+        return FakeDownloader(self.blobs[name], self.etags.get(name))
+
+    async def create_container(self):
+        await self._round_trip()
+
+    async def upload_blob(self, name: str, data, overwrite: bool = False,
+                          etag: Optional[str] = None, **kwargs) -> dict:
+        await self._round_trip()
+        if name in self.blobs and not overwrite:
+            raise ResourceExistsError(f'The blob {name} already exists')
+        if etag is not None and self.etags.get(name) != etag:
+            raise ResourceModifiedError(f'The blob {name} was modified')
+        self.blobs[name] = data.encode('utf-8') if isinstance(
+            data, str) else data
+        self.etags[name] = f'"{next(self._versions)}"'
+        return {'etag': self.etags[name]}
+
+    async def delete_blob(self, blob, **kwargs):
+        await self._round_trip()
+        del self.blobs[getattr(blob, 'name', blob)]
+
+    async def delete_blobs(self, *blobs, **kwargs):
+        await self._round_trip()
+
+        async def responses():
+            for blob in blobs:
+                name = getattr(blob, 'name', blob)
+                yield FakeBatchResponse(
+                    202 if self.blobs.pop(name, None) is not None else 404)
+
+        return responses()
+
+
+class FakeBlobServiceClient():
+    """An in-memory Azure Storage account holding fake containers
+    """
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+        self.containers: Dict[str, FakeContainerClient] = {}
+
+    def get_container_client(self, container: str) -> FakeContainerClient:
+        if container not in self.containers:
+            self.containers[container] = FakeContainerClient(self.latency)
+        return self.containers[container]
+
+
+class FakeOperations():
+    """A group of fake Purview operations answering after a fixed latency
+    """
+    def __init__(self, latency: float, **responses):
+        self.latency = latency
+        self.requests = 0
+        for name, response in responses.items():
+            setattr(self, name, self._operation(response))
+
+    def _operation(self, response):
+        async def operation(*args, **kwargs):
+            self.requests += 1
+            await asyncio.sleep(self.latency)
+            return response
+        return operation
+
+
+class FakePurviewClient():
+    """A fake of the asynchronous Purview catalog client returning an entity
+        without lineage for every lookup
+    """
+    def __init__(self, latency: float = 0.005):
+        self.entity = FakeOperations(
+            latency,
+            get_by_unique_attributes={'entity': {'guid': 'guid'}})
+        self.lineage = FakeOperations(
+            latency, get_lineage_graph={'guidEntityMap': {}})
+
+
+class FakeHttp():
+    """A fake of the http_utils get and post functions answering every
+        request with the same JSON body after a fixed latency
+    """
+    def __init__(self, body: dict, latency: float = 0.005,
+                 status_codes: Optional[Dict[str, int]] = None):
+        self.content = json.dumps(body).encode('utf-8')
+        self.latency = latency
+        self.status_codes = status_codes or {}
+        self.requests = 0
+
+    async def request(self, url: str, **kwargs) -> Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        status_code = next((code for path, code in self.status_codes.items()
+                            if url.endswith(path)), 200)
+        return Response(status_code=status_code, content=self.content,
+                        url=url)
+
+
+class FakeMessageBatch():
+    """A fake of the ServiceBusMessageBatch holding a maximum number of
+        messages
+    """
+    def __init__(self, max_messages: int):
+        self.max_messages = max_messages
+        self.messages = []
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add_message(self, message):
+        if len(self.messages) >= self.max_messages:
+            raise MessageSizeExceededError(
+                message='The batch is full')
+        self.messages.append(message)
+
+
+class FakeServiceBusSender():
+    """A fake of the asynchronous ServiceBusSender adding a fixed latency to
+        every request, failing the sends after a number of successful ones.
+        It records the peak number of sends in flight at once.
+    """
+    def __init__(self, latency: float = 0.005, max_messages: int = 100,
+                 max_sends: Optional[int] = None):
+        self.latency = latency
+        self.max_messages = max_messages
+        self.max_sends = max_sends
+        self.sent = []
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def close(self):
+        self.closed = True
+
+    async def create_message_batch(self) -> FakeMessageBatch:
+        return FakeMessageBatch(self.max_messages)
+
+    async def send_messages(self, messages):
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if self.max_sends is not None and self.requests > self.max_sends:
+            raise ServiceBusConnectionError(
+                message='The link was detached')
+        self.sent.append(getattr(messages, 'messages', [messages]))
@@ -1,6 +1,7 @@
 """Unit tests for the log_error Azure Function.
 
 """
+import asyncio
 from unittest.mock import patch, MagicMock
 import pytest
 import azure.functions as func
@@ -36,7 +37,7 @@ def test_log_error(mock_out):
         url='/api/log_error',
         params={'pipeline_run_id': 'test_run_id'})
 
-    test_resp = main(test_req, func.Out[bytes])
+    test_resp = asyncio.run(main(test_req, func.Out[bytes]))
 
     output = mock_out.call_args[0][0]
 
@@ -66,6 +67,6 @@ def test_log_error_invalid_input(test_input: Mapping[str, str],
         url='/api/log_error',
         params=test_input)
 
-    test_resp = main(test_req, func.Out[bytes])
+    test_resp = asyncio.run(main(test_req, func.Out[bytes]))
 
     assert test_resp.status_code == expected_output
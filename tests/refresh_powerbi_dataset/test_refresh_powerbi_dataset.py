@@ -1,19 +1,23 @@
 import os
+import asyncio
 import json
+import time
 from unittest.mock import patch, MagicMock
 import pytest
 import azure.functions as func
 
 from refresh_powerbi_dataset import main
+from services.power_bi_utils import RefreshThrottledError
+from tests.fakes import FakeBlobServiceClient
 
 
 TEST_CREATE_INCIDENT_PARAMS_INPUTS = [
-    ({"dataset_name": "my_dataset"}, Exception("Error getting workspace ID for PowerBI"), None, "dataset_id", None, None, True, 500),
-    ({"dataset_name": "my_dataset"}, None, "workspace_id", Exception("Error getting Dataset ID for PowerBI"), None, None, True, 500),
+    ({"dataset_name": "my_dataset"}, Exception("Error getting workspace ID for PowerBI"), None, "dataset_id", None, None, (True, None), 500),
+    ({"dataset_name": "my_dataset"}, None, "workspace_id", Exception("Error getting Dataset ID for PowerBI"), None, None, (True, None), 500),
     ({'wrong_param': 'value'}, None, None, None, None, None, None, 500),
-    ({}, None, None, None, None, None, True, 500),
-    ({"dataset_name": "my_dataset"}, None, "workspace_id", None, "dataset_id", None, False, 403),
-    ({'dataset_name': 'my_dataset'}, None, "workspace_id", None, "dataset_id", None, True, 200),
+    ({}, None, None, None, None, None, (True, None), 500),
+    ({"dataset_name": "my_dataset"}, None, "workspace_id", None, "dataset_id", None, (False, None), 403),
+    ({'dataset_name': 'my_dataset'}, None, "workspace_id", None, "dataset_id", None, (True, None), 200),
 ]
 
 @pytest.mark.dev
@@ -35,20 +39,185 @@ def test_refresh_powerbi_dataset_invalid_input(mocker, test_input,
     mocker.patch('services.power_bi_utils.PowerBIClient.get_dataset_id',
                  side_effect=get_dataset_id_exception,
                  return_value=get_dataset_id_result)
-    mocker.patch('services.power_bi_utils.PowerBIClient.refresh_dataset',
+    mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh',
                  side_effect=refresh_dataset_exception,
                  return_value=refresh_dataset_result)
-    os.environ['powerbi_organisation'] = "myorg"
-    os.environ['environment'] = "d01"
-    os.environ['powerbi_tenant_id'] = "tenant_id"
-    os.environ['powerbi_client_id'] = "client_id"
-    os.environ['powerbi_client_secret'] = "client_secret"
+    mocker.patch.dict(os.environ, {'powerbi_organisation': "myorg", 'environment': "d01",
+                                   'powerbi_tenant_id': "tenant_id", 'powerbi_client_id': "client_id",
+                                   'powerbi_client_secret': "client_secret"})
     test_req = func.HttpRequest(
         method='POST',
         body=json.dumps(test_input).encode('utf8'),
         url='/api/refresh_powerbi_dataset',
         params='')
 
-    test_resp = main(test_req)
+    test_resp = asyncio.run(main(test_req))
 
     assert test_resp.status_code == expected_output
+
+
+TEST_REFRESH_DATASETS_CASES = [
+    ({"dataset1": {"dataset_id": "id1", "status": "refreshing"}}, 200),
+    ({"dataset1": {"dataset_id": "id1", "status": "refreshing"},
+      "missing": {"dataset_id": None, "status": "not_found"}}, 207),
+]
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize('statuses, expected_output', TEST_REFRESH_DATASETS_CASES)
+def test_refresh_powerbi_datasets(mocker, statuses, expected_output):
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_workspace_id', return_value="workspace_id")
+    mock_refresh = mocker.patch('services.power_bi_utils.PowerBIClient.refresh_datasets', return_value=statuses)
+    mocker.patch.dict(os.environ, {'powerbi_organisation': "myorg", 'environment': "d01",
+                                   'powerbi_tenant_id': "tenant_id", 'powerbi_client_id': "client_id",
+                                   'powerbi_client_secret': "client_secret",
+                                   'powerbi_refresh_max_concurrency': "3"})
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps({"dataset_names": list(statuses)}).encode('utf8'),
+        url='/api/refresh_powerbi_dataset',
+        params='')
+
+    test_resp = asyncio.run(main(test_req))
+
+    assert test_resp.status_code == expected_output
+    assert json.loads(test_resp.get_body()) == {"datasets": statuses}
+    assert mock_refresh.call_args.args == ("myorg", "workspace_id", list(statuses), 3, None)
+
+
+TEST_WAIT_REFRESHES_CASES = [
+    ({"id1": {"request_id": "request1", "status": "completed", "duration": 12.5}}, 200),
+    ({"id1": {"request_id": "request1", "status": "timeout"}}, 207),
+]
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize('outcomes, expected_output', TEST_WAIT_REFRESHES_CASES)
+def test_refresh_powerbi_datasets_wait(mocker, outcomes, expected_output):
+    statuses = {"dataset1": {"dataset_id": "id1", "status": "refreshing", "request_id": "request1"}}
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_workspace_id', return_value="workspace_id")
+    mocker.patch('services.power_bi_utils.PowerBIClient.refresh_datasets', return_value=statuses)
+    mock_wait = mocker.patch('services.power_bi_utils.PowerBIClient.wait_for_refreshes', return_value=outcomes)
+    mocker.patch.dict(os.environ, {'powerbi_organisation': "myorg", 'environment': "d01",
+                                   'powerbi_tenant_id': "tenant_id", 'powerbi_client_id': "client_id",
+                                   'powerbi_client_secret': "client_secret"})
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps({"dataset_names": ["dataset1"], "wait": True, "wait_timeout": 120}).encode('utf8'),
+        url='/api/refresh_powerbi_dataset',
+        params='')
+
+    test_resp = asyncio.run(main(test_req))
+
+    assert test_resp.status_code == expected_output
+    assert json.loads(test_resp.get_body()) == {"datasets": {"dataset1": dict(outcomes["id1"], dataset_id="id1")}}
+    assert mock_wait.call_args.args[2] == {"id1": "request1"}
+    assert mock_wait.call_args.kwargs["timeout"] == 120
+
+
+TEST_WAIT_REFRESH_CASES = [
+    ({"id1": {"request_id": "request1", "status": "completed", "duration": 12.5}}, 200),
+    ({"id1": {"request_id": "request1", "status": "failed"}}, 403),
+]
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize('outcomes, expected_output', TEST_WAIT_REFRESH_CASES)
+def test_refresh_powerbi_dataset_wait(mocker, outcomes, expected_output):
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_workspace_id', return_value="workspace_id")
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_dataset_id', return_value="id1")
+    mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh', return_value=(True, "request1"))
+    mock_wait = mocker.patch('services.power_bi_utils.PowerBIClient.wait_for_refreshes', return_value=outcomes)
+    mocker.patch.dict(os.environ, {'powerbi_organisation': "myorg", 'environment': "d01",
+                                   'powerbi_tenant_id': "tenant_id", 'powerbi_client_id': "client_id",
+                                   'powerbi_client_secret': "client_secret"})
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps({"dataset_name": "dataset1", "wait": True, "wait_timeout": 120}).encode('utf8'),
+        url='/api/refresh_powerbi_dataset',
+        params='')
+
+    test_resp = asyncio.run(main(test_req))
+
+    assert test_resp.status_code == expected_output
+    assert json.loads(test_resp.get_body()) == dict(outcomes["id1"], dataset_id="id1")
+    assert mock_wait.call_args.args[2] == {"id1": "request1"}
+    assert mock_wait.call_args.kwargs["timeout"] == 120
+
+
+@pytest.mark.dev
+def test_refresh_powerbi_dataset_wait_queued(mocker):
+    blob_service = FakeBlobServiceClient(latency=0)
+    blob_service.get_container_client('powerbi-refreshes').upload_json(
+        "workspace_id/id1.json", {"requested_at": time.time(), "request_id": "request1", "pending": True})
+    mocker.patch('services.clients.get_blob_service_client', return_value=blob_service)
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_workspace_id', return_value="workspace_id")
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_dataset_id', return_value="id1")
+    mock_refresh = mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh')
+    mock_wait = mocker.patch('services.power_bi_utils.PowerBIClient.wait_for_refreshes', return_value={})
+    mocker.patch.dict(os.environ, {'powerbi_organisation': "myorg", 'environment': "d01",
+                                   'powerbi_tenant_id': "tenant_id", 'powerbi_client_id': "client_id",
+                                   'powerbi_client_secret': "client_secret", 'errorlog__serviceUri': "https://test.com",
+                                   'powerbi_refresh_coalesce_window': "60"})
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps({"dataset_name": "dataset1", "wait": True}).encode('utf8'),
+        url='/api/refresh_powerbi_dataset',
+        params='')
+
+    test_resp = asyncio.run(main(test_req))
+
+    assert test_resp.status_code == 202
+    assert json.loads(test_resp.get_body()) == {"dataset_id": "id1", "status": "queued", "request_id": None}
+    assert mock_refresh.call_count == 0
+    assert mock_wait.call_args.args[2] == {}
+
+
+@pytest.mark.dev
+def test_refresh_powerbi_dataset_throttled(mocker):
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_workspace_id', return_value="workspace_id")
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_dataset_id', return_value="id1")
+    mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh',
+                 side_effect=RefreshThrottledError("Too many requests", 30.5))
+    mock_wait = mocker.patch('services.power_bi_utils.PowerBIClient.wait_for_refreshes')
+    mocker.patch.dict(os.environ, {'powerbi_organisation': "myorg", 'environment': "d01",
+                                   'powerbi_tenant_id': "tenant_id", 'powerbi_client_id': "client_id",
+                                   'powerbi_client_secret': "client_secret"})
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps({"dataset_name": "dataset1", "wait": True}).encode('utf8'),
+        url='/api/refresh_powerbi_dataset',
+        params='')
+
+    test_resp = asyncio.run(main(test_req))
+
+    assert test_resp.status_code == 429
+    assert test_resp.headers["Retry-After"] == "31"
+    assert mock_wait.call_count == 0
+
+
+@pytest.mark.dev
+def test_refresh_powerbi_dataset_coalesced(mocker):
+    blob_service = FakeBlobServiceClient(latency=0.01)
+    mocker.patch('services.clients.get_blob_service_client', return_value=blob_service)
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_workspace_id', return_value="workspace_id")
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_dataset_id', return_value="dataset_id")
+    mock_refresh = mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh',
+                                return_value=(True, "request_id"))
+    mocker.patch.dict(os.environ, {'powerbi_organisation': "myorg", 'environment': "d01",
+                                   'powerbi_tenant_id': "tenant_id", 'powerbi_client_id': "client_id",
+                                   'powerbi_client_secret': "client_secret", 'errorlog__serviceUri': "https://test.com",
+                                   'powerbi_refresh_coalesce_window': "60"})
+
+    async def invoke_concurrently():
+        return await asyncio.gather(*(main(func.HttpRequest(
+            method='POST', body=json.dumps({"dataset_name": "my_dataset"}).encode('utf8'),
+            url='/api/refresh_powerbi_dataset', params='')) for _ in range(5)))
+
+    responses = asyncio.run(invoke_concurrently())
+
+    assert [response.status_code for response in responses] == [200] * 5
+    assert sorted(json.loads(response.get_body())["status"] for response in responses) == (
+        ["queued"] * 4 + ["refreshing"])
+    assert mock_refresh.call_count == 1
+    assert "workspace_id/dataset_id.json" in blob_service.get_container_client('powerbi-refreshes').blobs
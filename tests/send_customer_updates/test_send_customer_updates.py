@@ -0,0 +1,124 @@
+"""Unit tests for the send_customer_updates Azure Function.
+
+"""
+import os
+import json
+import asyncio
+from unittest.mock import patch, MagicMock
+import pytest
+import azure.functions as func
+
+from send_customer_updates import main, index_customer_updates
+from services import clients
+from tests.fakes import FakeServiceBusSender
+
+TEST_SEND_CUSTOMER_UPDATES_INPUT = [
+    {'SEQUENCE_ID': 1, 'PAR_REFNO': 'A', 'NAME': 'Old name'},
+    {'SEQUENCE_ID': 2, 'PAR_REFNO': 'B', 'NAME': 'Other'},
+    {'SEQUENCE_ID': 3, 'PAR_REFNO': 'A', 'NAME': 'New name'},
+    {'SEQUENCE_ID': 4, 'PAR_REFNO': 'C', 'NAME': 'Third'}
+]
+
+SEND_CUSTOMER_UPDATES_TEST_ENV_VAR = [
+    ('service_bus_connection', 'Endpoint=sb://test/'),
+    ('service_bus_topic', 'customers')
+]
+
+
+@pytest.mark.dev
+@patch.dict(os.environ, SEND_CUSTOMER_UPDATES_TEST_ENV_VAR, clear=True)
+@patch('services.clients.ServiceBusClient')
+def test_send_customer_updates(mock_client: MagicMock):
+    """Test that the latest update of each customer is sent in batches and
+        that the sequence IDs of every sent update are returned
+    """
+    asyncio.run(clients.reset_clients())
+    sender = FakeServiceBusSender(latency=0, max_messages=2)
+    client = mock_client.from_connection_string.return_value
+    client.get_topic_sender.return_value = sender
+
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps(TEST_SEND_CUSTOMER_UPDATES_INPUT).encode('utf8'),
+        url='/api/send_customer_updates',
+        params={'session_id': 'session'})
+
+    test_resp = asyncio.run(main(test_req))
+
+    sent = [[json.loads(str(message))['SEQUENCE_ID'] for message in batch]
+            for batch in sender.sent]
+
+    assert (sorted(test_resp.split(',')) == ['1', '2', '3', '4']
+            and sent == [[2, 3], [4]])
+
+    asyncio.run(clients.reset_clients())
+
+
+@pytest.mark.dev
+@patch.dict(os.environ, SEND_CUSTOMER_UPDATES_TEST_ENV_VAR, clear=True)
+@patch('services.clients.ServiceBusClient')
+def test_send_customer_updates_reuses_sender(mock_client: MagicMock):
+    """Test that the sender is reused across invocations and recreated
+        after its link was detached
+    """
+    asyncio.run(clients.reset_clients())
+    senders = [FakeServiceBusSender(latency=0, max_messages=2, max_sends=3),
+               FakeServiceBusSender(latency=0, max_messages=2)]
+    client = mock_client.from_connection_string.return_value
+    client.get_topic_sender.side_effect = senders
+
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps(TEST_SEND_CUSTOMER_UPDATES_INPUT).encode('utf8'),
+        url='/api/send_customer_updates',
+        params={'session_id': 'session'})
+
+    responses = [asyncio.run(main(test_req)) for _ in range(3)]
+
+    assert (all(sorted(response.split(',')) == ['1', '2', '3', '4']
+                for response in responses)
+            and mock_client.from_connection_string.call_count == 1
+            and client.get_topic_sender.call_count == 2
+            and len(senders[0].sent) == 3 and len(senders[1].sent) == 3)
+
+    asyncio.run(clients.reset_clients())
+
+
+@pytest.mark.dev
+@patch.dict(os.environ, SEND_CUSTOMER_UPDATES_TEST_ENV_VAR, clear=True)
+@patch('services.clients.ServiceBusClient')
+def test_send_customer_updates_drops_failed_sender(mock_client: MagicMock):
+    """Test that a sender still failing after reconnecting is not reused by
+        the next invocation
+    """
+    asyncio.run(clients.reset_clients())
+    senders = [FakeServiceBusSender(latency=0, max_messages=2, max_sends=0),
+               FakeServiceBusSender(latency=0, max_messages=2, max_sends=0),
+               FakeServiceBusSender(latency=0, max_messages=2)]
+    client = mock_client.from_connection_string.return_value
+    client.get_topic_sender.side_effect = senders
+
+    test_req = func.HttpRequest(
+        method='POST',
+        body=json.dumps(TEST_SEND_CUSTOMER_UPDATES_INPUT).encode('utf8'),
+        url='/api/send_customer_updates',
+        params={'session_id': 'session'})
+
+    responses = [asyncio.run(main(test_req)) for _ in range(2)]
+
+    assert (responses[0] == ''
+            and sorted(responses[1].split(',')) == ['1', '2', '3', '4']
+            and client.get_topic_sender.call_count == 3)
+
+    asyncio.run(clients.reset_clients())
+
+
+@pytest.mark.dev
+def test_index_customer_updates():
+    """Test that each customer keeps its latest record and every sequence
+        ID, ordered by the position of its latest record
+    """
+    index = index_customer_updates(TEST_SEND_CUSTOMER_UPDATES_INPUT)
+
+    assert [(record['SEQUENCE_ID'], ids) for record, ids in index.values()] \
+        == [(2, ['2']), (3, ['1', '3']), (4, ['4'])]
@@ -1,6 +1,7 @@
 """Unit tests for the cherwell_utils module.
 
 """
+import asyncio
 from unittest.mock import Mock, patch, mock_open
 from services import cherwell_utils
 
@@ -76,7 +77,7 @@ def test_configure_incident(mock_file):
             TEST_CONFIGURE_INCIDENT_EXPECTED_RESULT) and mock_file.called
 
 
-@patch('services.cherwell_utils.requests.post')
+@patch('services.http_utils.post')
 @pytest.mark.dev
 def test_create_incident(mock_post):
     """Test the create incident function
@@ -90,7 +91,7 @@ def test_create_incident(mock_post):
         status_code=200, json=lambda: {
             'busObPublicId': expected_incident_id})
 
-    incident_id = cherwell_utils.create_incident('', '', '')
+    incident_id = asyncio.run(cherwell_utils.create_incident('', '', ''))
 
     assert incident_id == expected_incident_id
 
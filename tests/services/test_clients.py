@@ -0,0 +1,93 @@
+"""Unit tests for the clients module.
+
+"""
+import os
+import asyncio
+from unittest.mock import patch, AsyncMock, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from services import clients
+from tests.fakes import FakeServiceBusSender
+
+
+CLIENTS_TEST_ENV_VAR = [
+    ("purview_account_name", "purview")
+]
+
+
+@pytest.mark.dev
+@patch.dict(os.environ, CLIENTS_TEST_ENV_VAR, clear=True)
+@patch('services.clients.ManagedIdentityCredential')
+@patch('services.clients.PurviewCatalogClient')
+def test_get_purview_client_is_memoized(mock_client: MagicMock,
+                                        mock_credential: MagicMock):
+    """Test that the clients and credentials are built once per
+        endpoint and identity, even under concurrent invocations
+    """
+    mock_client.side_effect = lambda **kwargs: AsyncMock()
+    mock_credential.side_effect = lambda **kwargs: AsyncMock()
+    asyncio.run(clients.reset_clients())
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda _: clients.get_purview_client(client_id='id1'), range(32)))
+    other = clients.get_purview_client(client_id='id2')
+
+    assert (all(result is results[0] for result in results)
+            and other is not results[0]
+            and mock_client.call_count == 2
+            and mock_credential.call_count == 2
+            and mock_client.call_args_list[0].kwargs['endpoint']
+            == 'https://purview.purview.azure.com'
+            and mock_client.call_args_list[0].kwargs['per_retry_policies'][
+                0].bucket is clients.get_purview_rate_limit())
+
+    asyncio.run(clients.reset_clients())
+
+
+@pytest.mark.dev
+@patch('services.clients.DefaultAzureCredential')
+def test_reset_clients(mock_credential: MagicMock):
+    """Test that reset_clients closes and drops the memoized objects
+    """
+    mock_credential.side_effect = AsyncMock
+    asyncio.run(clients.reset_clients())
+
+    credential = clients.get_credential()
+    asyncio.run(clients.reset_clients())
+
+    credential.close.assert_awaited_once()
+    assert clients.get_credential() is not credential
+
+    asyncio.run(clients.reset_clients())
+
+
+@pytest.mark.dev
+@patch.dict(os.environ, {'service_bus_connection': 'connection'}, clear=True)
+@patch('services.clients.ServiceBusClient')
+def test_get_topic_sender_renews_link(mock_client: MagicMock):
+    """Test that the shared sender is reused, and that its link is renewed
+        once idle for too long or after a failed send
+    """
+    asyncio.run(clients.reset_clients())
+    senders = [FakeServiceBusSender(latency=0) for _ in range(3)]
+    client = mock_client.from_connection_string.return_value
+    client.get_topic_sender.side_effect = senders
+
+    async def get_topic_senders():
+        topic = await clients.get_topic_sender('topic')
+        reused = (await clients.get_topic_sender('topic')).sender
+        topic.last_used -= clients.SERVICE_BUS_LINK_IDLE_TIMEOUT
+        idle_renewed = (await clients.get_topic_sender('topic')).sender
+        topic.healthy = False
+        failure_renewed = (await clients.get_topic_sender('topic')).sender
+        return reused, idle_renewed, failure_renewed
+
+    senders_used = asyncio.run(get_topic_senders())
+
+    assert (list(senders_used) == senders
+            and senders[0].closed and senders[1].closed
+            and not senders[2].closed
+            and mock_client.from_connection_string.call_count == 1)
+
+    asyncio.run(clients.reset_clients())
@@ -0,0 +1,109 @@
+"""Unit tests for the http_utils module.
+
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+import pytest
+from services import http_utils
+
+
+TEST_RETRY_CASES = [
+    ('GET', 500, True),
+    ('GET', 429, True),
+    ('GET', 404, False),
+    ('POST', 429, True),
+    ('POST', 503, True),
+    ('POST', 500, False),
+    ('POST', 502, False)
+]
+
+
+@pytest.mark.parametrize('method, status_code, expected_result',
+                         TEST_RETRY_CASES)
+@pytest.mark.dev
+def test_retry_policy(method: str, status_code: int, expected_result: bool):
+    """Test that non-idempotent requests are only retried when throttled
+    """
+    retry = http_utils.RetryPolicy()
+
+    assert retry.is_retry(method, status_code) == expected_result
+
+
+@pytest.mark.dev
+@patch('services.http_utils.Session._send')
+def test_session_host_timeouts(mock_send: AsyncMock):
+    """Test that the per host timeouts are applied
+    """
+    mock_send.return_value = http_utils.Response(status_code=200)
+    session = http_utils.Session(
+        host_timeouts={'api.test.com': (1, 2)}, default_timeout=(3, 4))
+
+    async def send():
+        await session.request('GET', 'https://api.test.com/path')
+        await session.request('GET', 'https://other.test.com/path')
+        await session.request('GET', 'https://api.test.com/path',
+                              timeout=(5, 10))
+
+    asyncio.run(send())
+
+    timeouts = [(call.kwargs['timeout'].sock_connect,
+                 call.kwargs['timeout'].sock_read)
+                for call in mock_send.mock_calls]
+
+    assert timeouts == [(1, 2), (3, 4), (5, 10)]
+
+
+@pytest.mark.dev
+@patch('services.http_utils.asyncio.sleep')
+@patch('services.http_utils.Session._send')
+def test_session_retries(mock_send: AsyncMock, mock_sleep: AsyncMock):
+    """Test that throttled requests are retried after the Retry-After delay
+        and that the last response is returned once the retries run out
+    """
+    mock_send.side_effect = [
+        http_utils.Response(status_code=429, headers={'retry-after': '7'}),
+        http_utils.Response(status_code=200),
+        http_utils.Response(status_code=500),
+        http_utils.Response(status_code=500)
+    ]
+    session = http_utils.Session(retry=http_utils.RetryPolicy(max_retries=1))
+
+    async def send():
+        return [await session.request('POST', 'https://api.test.com/path'),
+                await session.request('GET', 'https://api.test.com/path')]
+
+    responses = asyncio.run(send())
+
+    assert ([response.status_code for response in responses] == [200, 500]
+            and mock_send.call_count == 4
+            and mock_sleep.await_args_list[0].args == (7.0,))
+
+
+@pytest.mark.dev
+@patch('services.http_utils.Session._send')
+def test_session_request_error(mock_send: AsyncMock):
+    """Test that connection errors are raised as RequestError
+    """
+    mock_send.side_effect = asyncio.TimeoutError()
+    session = http_utils.Session()
+
+    with pytest.raises(http_utils.RequestError):
+        asyncio.run(session.request('GET', 'https://api.test.com/path'))
+
+
+@pytest.mark.dev
+@patch.dict('os.environ', {'http_pool_size': '4'})
+def test_get_session_is_shared():
+    """Test that the session and its connection pool are reused
+    """
+    async def get_sessions():
+        await http_utils.reset_session()
+        session = http_utils.get_session()
+        client_session = session._get_session()
+        shared = (http_utils.get_session() is session
+                  and session._get_session() is client_session)
+        limit = client_session.connector.limit
+        await http_utils.reset_session()
+        return shared, limit, session.retry.max_retries
+
+    assert asyncio.run(get_sessions()) == (True, 4, 3)
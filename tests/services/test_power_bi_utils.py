@@ -1,17 +1,32 @@
+import asyncio
+import json
+import time
 from contextlib import nullcontext as does_not_raise
 
 import pytest
-from requests.exceptions import RequestException
 
-from services.power_bi_utils import PowerBIClient
+from services.http_utils import RequestError
+from services.power_bi_utils import (ID_CACHE, IdCache, PowerBIClient, RefreshCoalescer, RefreshThrottledError,
+                                     TokenCache, _get_poll_interval)
+from tests.fakes import FakeContainerClient
+
+
+@pytest.fixture(autouse=True)
+def reset_id_cache():
+    """Start every test with an empty workspace and dataset ID cache
+    """
+    ID_CACHE.clear()
+    yield
+    ID_CACHE.clear()
 
 
 @pytest.mark.dev
 class MockResponse:
-    def __init__(self, json_data, status_code, content):
+    def __init__(self, json_data, status_code, content, headers=None):
         self.json_data = json_data
         self.status_code = status_code
         self.content = content
+        self.headers = headers or {}
 
     def json(self):
         return self.json_data
@@ -20,7 +35,7 @@ class MockResponse:
 test__get_access_token_cases = [
     (200, {"access_token": "token123"}, "content", None, does_not_raise()),
     (401, {}, "content", None, pytest.raises(Exception, match="Error getting access token for PowerBI")),
-    (400, {}, "content", RequestException("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests")),
+    (400, {}, "content", RequestError("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests")),
 ]
 
 
@@ -31,16 +46,16 @@ test__get_access_token_cases = [
 def test__get_access_token(mocker, test_input_status, test_input_response,
                             test_input_content, test_input_exception, test_output_exception):
     response = MockResponse(test_input_response, test_input_status, test_input_content)
-    mocker.patch('requests.post', return_value=response, side_effect=test_input_exception)
+    mocker.patch('services.http_utils.post', return_value=response, side_effect=test_input_exception)
     powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
     with test_output_exception:
-        access_token = powerbi_client._get_access_token()
+        access_token = asyncio.run(powerbi_client._get_access_token())
         assert access_token == response.json()['access_token']
 
 
 test_get_workspace_id_cases = [
     (Exception("Error with API requests"), None, None, None, "content", None, pytest.raises(Exception, match="Error getting workspace ID for PowerBI"), None),
-    (None, "token123", 200, None, "content", RequestException("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests"), None),
+    (None, "token123", 200, None, "content", RequestError("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests"), None),
     (None, "token123", 401, None, "content", None, pytest.raises(Exception, match="Error getting workspace ID for PowerBI"), None),
     (None, "token123", 200, {"value": [{"id": "workspace_id1"}, {"id": "workspace_id2"}]}, "content", None, pytest.raises(Exception, match="Error getting workspace ID for PowerBI"), None),
     (None, "token123", 200, {"value": [{"id": "workspace_id"}]}, "content", None, does_not_raise(), "workspace_id"),
@@ -59,16 +74,16 @@ def test_get_workspace_id(mocker, get_access_token_exception, get_access_token_r
                  side_effect=get_access_token_exception,
                  return_value=get_access_token_result)
     response = MockResponse(test_input_response, test_input_status, test_input_content)
-    mocker.patch('requests.get', return_value=response, side_effect=test_input_exception)
+    mocker.patch('services.http_utils.get', return_value=response, side_effect=test_input_exception)
     powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
     with test_output_exception:
-        result = powerbi_client.get_workspace_id("org", "workspace_name")
+        result = asyncio.run(powerbi_client.get_workspace_id("org", "workspace_name"))
         assert result == test_output_expected
 
 
 test_get_dataset_id_cases = [
     (Exception("Error with API requests"), None, None, None, "content", None, pytest.raises(Exception, match="Error getting Dataset ID for PowerBI"), None),
-    (None, "token123", 200, None, "content", RequestException("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests"), None),
+    (None, "token123", 200, None, "content", RequestError("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests"), None),
     (None, "token123", 401, None, "content", None, pytest.raises(Exception, match="Error getting Dataset ID for PowerBI"), None),
     (None, "token123", 200, {"value": [{"name": "dataset_name1", "id": "dataset_id1"}, {"name": "dataset_name1", "id": "dataset_id2"}]}, "content", None, pytest.raises(Exception, match="Error getting Dataset ID for PowerBI"), None),
     (None, "token123", 200, {"value": [{"name": "dataset_name1", "id": "dataset_id1"}]}, "content", None, does_not_raise(), "dataset_id1"),
@@ -87,16 +102,16 @@ def test_get_dataset_id(mocker, get_access_token_exception, get_access_token_res
                  side_effect=get_access_token_exception,
                  return_value=get_access_token_result)
     response = MockResponse(test_input_response, test_input_status, test_input_content)
-    mocker.patch('requests.get', return_value=response, side_effect=test_input_exception)
+    mocker.patch('services.http_utils.get', return_value=response, side_effect=test_input_exception)
     powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
     with test_output_exception:
-        result = powerbi_client.get_dataset_id("org", "workspace_id", "dataset_name1")
+        result = asyncio.run(powerbi_client.get_dataset_id("org", "workspace_id", "dataset_name1"))
         assert result == test_output_expected
 
 
 test_refresh_dataset_cases = [
     (Exception("Error with API requests"), None, None, None, "content", None, pytest.raises(Exception, match="Error refreshing Dataset"), None),
-    (None, "token123", 200, None, "content", RequestException("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests"), None),
+    (None, "token123", 200, None, "content", RequestError("Invalid URL ''"), pytest.raises(Exception, match="Error with API requests"), None),
     (None, "token123", 401, None, "content", None, does_not_raise(), False),
     (None, "token123", 202, None, "content", None, does_not_raise(), True),
 ]
@@ -114,8 +129,375 @@ def test_refresh_dataset(mocker, get_access_token_exception, get_access_token_re
                  side_effect=get_access_token_exception,
                  return_value=get_access_token_result)
     response = MockResponse(test_input_response, test_input_status, test_input_content)
-    mocker.patch('requests.post', return_value=response, side_effect=test_input_exception)
+    mocker.patch('services.http_utils.post', return_value=response, side_effect=test_input_exception)
     powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
     with test_output_exception:
-        result = powerbi_client.refresh_dataset("org", "workspace_id", "dataset_id")
+        result = asyncio.run(powerbi_client.refresh_dataset("org", "workspace_id", "dataset_id"))
         assert result == test_output_expected
+
+
+@pytest.mark.dev
+def test_token_cache_reuses_valid_token(mocker):
+    response = MockResponse({"access_token": "token123", "expires_on": str(int(time.time()) + 3600)}, 200, "content")
+    mock_post = mocker.patch('services.http_utils.post', return_value=response)
+    token_cache = TokenCache()
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret', token_cache=token_cache)
+
+    async def get_tokens():
+        first = await asyncio.gather(*(powerbi_client._get_access_token() for _ in range(5)))
+        return first + [await powerbi_client._get_access_token()]
+
+    assert asyncio.run(get_tokens()) == ["token123"] * 6
+    assert mock_post.call_count == 1
+    assert token_cache.stats() == {"hits": 1, "misses": 5, "background_refreshes": 0, "refresh_failures": 0}
+
+
+@pytest.mark.dev
+def test_token_cache_refetches_expired_token():
+    token_cache = TokenCache(refresh_margin=0, expiry_skew=60)
+    tokens = iter([("token1", time.time() + 30), ("token2", time.time() + 3600)])
+
+    async def fetch():
+        return next(tokens)
+
+    async def get_tokens():
+        return [await token_cache.get("key", fetch), await token_cache.get("key", fetch)]
+
+    assert asyncio.run(get_tokens()) == ["token1", "token2"]
+    assert token_cache.stats()["misses"] == 2
+
+
+@pytest.mark.dev
+def test_token_cache_refreshes_in_background():
+    token_cache = TokenCache(refresh_margin=600, expiry_skew=60)
+    tokens = iter([("token1", time.time() + 300), ("token2", time.time() + 3600)])
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return next(tokens)
+
+    async def get_tokens():
+        results = [await token_cache.get("key", fetch), await token_cache.get("key", fetch)]
+        while token_cache.stats()["background_refreshes"] == 0:
+            await asyncio.sleep(0.01)
+        return results + [await token_cache.get("key", fetch)]
+
+    assert asyncio.run(get_tokens()) == ["token1", "token1", "token2"]
+    assert token_cache.stats()["hits"] == 2
+
+
+@pytest.mark.dev
+def test_token_cache_keeps_failed_background_refresh(caplog):
+    token_cache = TokenCache(refresh_margin=600, expiry_skew=60)
+    fetches = []
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        fetches.append(fetch)
+        if len(fetches) > 1:
+            raise Exception("Error getting access token for PowerBI")
+        return "token1", time.time() + 300
+
+    async def get_tokens():
+        first = await token_cache.get("key", fetch)
+        second = await token_cache.get("key", fetch)
+        refreshing = list(token_cache._refreshing.values())
+        while token_cache.stats()["refresh_failures"] == 0:
+            await asyncio.sleep(0.01)
+        return [first, second], refreshing
+
+    tokens, refreshing = asyncio.run(get_tokens())
+
+    assert tokens == ["token1", "token1"]
+    assert len(refreshing) == 1 and refreshing[0].done()
+    assert token_cache._refreshing == {}
+    assert "Background refresh of the PowerBI access token failed" in caplog.text
+
+
+@pytest.mark.dev
+def test_id_cache_resolves_datasets_from_one_listing(mocker):
+    datasets = MockResponse({"value": [{"id": "id1", "name": "dataset1"}, {"id": "id2", "name": "dataset2"},
+                                       {"id": "id3", "name": "shared"}, {"id": "id4", "name": "shared"}]},
+                            200, "content")
+    mocker.patch('services.power_bi_utils.PowerBIClient._get_access_token', return_value="token123")
+    mock_get = mocker.patch('services.http_utils.get', return_value=datasets)
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret', id_cache=IdCache())
+
+    async def resolve():
+        prewarmed = await powerbi_client.prewarm_datasets("org", "workspace_id")
+        return prewarmed, [await powerbi_client.get_dataset_id("org", "workspace_id", name)
+                           for name in ("dataset1", "dataset2", "dataset1")]
+
+    prewarmed, dataset_ids = asyncio.run(resolve())
+
+    assert prewarmed == {"dataset1": "id1", "dataset2": "id2", "shared": None}
+    assert dataset_ids == ["id1", "id2", "id1"]
+    assert mock_get.call_count == 1
+
+
+@pytest.mark.dev
+def test_id_cache_invalidated_on_refresh_not_found(mocker):
+    id_cache = IdCache()
+    id_cache.set(("workspace", "org", "workspace_name"), "workspace_id")
+    id_cache.set(("dataset", "org", "workspace_id", "dataset_name"), "dataset_id")
+    id_cache.set(("dataset", "org", "workspace_id", "other"), "other_id")
+    mocker.patch('services.power_bi_utils.PowerBIClient._get_access_token', return_value="token123")
+    mocker.patch('services.http_utils.post', return_value=MockResponse({}, 404, "content"))
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret', id_cache=id_cache)
+
+    refresh_status = asyncio.run(powerbi_client.refresh_dataset("org", "workspace_id", "dataset_id"))
+
+    assert refresh_status is False
+    assert id_cache.get(("workspace", "org", "workspace_name")) is None
+    assert id_cache.get(("dataset", "org", "workspace_id", "dataset_name")) is None
+    assert id_cache.get(("dataset", "org", "workspace_id", "other")) == "other_id"
+
+
+@pytest.mark.dev
+def test_id_cache_expiry():
+    id_cache = IdCache(ttl=-1)
+    id_cache.set(("workspace", "org", "workspace_name"), "workspace_id")
+
+    assert id_cache.get(("workspace", "org", "workspace_name")) is None
+    assert id_cache.stats() == {"hits": 0, "misses": 1, "size": 0}
+
+
+@pytest.mark.dev
+def test_refresh_datasets(mocker):
+    datasets = MockResponse({"value": [{"id": "id1", "name": "dataset1"}, {"id": "id2", "name": "dataset2"},
+                                       {"id": "id3", "name": "dataset3"}, {"id": "id4", "name": "dataset4"}]},
+                            200, "content")
+    refresh_statuses = {"id1": 202, "id2": 500, "id4": 429}
+    running = []
+    peak = []
+
+    async def post(url, **kwargs):
+        dataset_id = url.split('/')[-2]
+        running.append(dataset_id)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(dataset_id)
+        if dataset_id == "id3":
+            raise RequestError("Connection reset")
+        return MockResponse({}, refresh_statuses[dataset_id], "content",
+                            {"RequestId": f"request_{dataset_id}", "Retry-After": "60"})
+
+    mocker.patch('services.power_bi_utils.PowerBIClient._get_access_token', return_value="token123")
+    mock_get = mocker.patch('services.http_utils.get', return_value=datasets)
+    mocker.patch('services.http_utils.post', side_effect=post)
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret', id_cache=IdCache())
+
+    statuses = asyncio.run(powerbi_client.refresh_datasets(
+        "org", "workspace_id", ["dataset1", "dataset2", "dataset3", "dataset4", "missing", "dataset1"], max_concurrency=2))
+
+    assert statuses == {
+        "dataset1": {"dataset_id": "id1", "status": "refreshing", "request_id": "request_id1"},
+        "dataset2": {"dataset_id": "id2", "status": "failed", "request_id": None},
+        "dataset3": {"dataset_id": "id3", "status": "error", "request_id": None},
+        "dataset4": {"dataset_id": "id4", "status": "throttled", "request_id": None, "retry_after": 60},
+        "missing": {"dataset_id": None, "status": "not_found", "request_id": None}
+    }
+    assert mock_get.call_count == 1
+    assert max(peak) == 2
+
+
+test_start_refresh_cases = [
+    (202, {"RequestId": "request_id"}, (True, "request_id")),
+    (202, {"location": "https://api.powerbi.com/v1.0/myorg/groups/workspace_id/datasets/dataset_id/refreshes/request_id"},
+     (True, "request_id")),
+    (202, {}, (True, None)),
+    (500, {}, (False, None)),
+]
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize("status_code, headers, expected_output", test_start_refresh_cases)
+def test_start_refresh(mocker, status_code, headers, expected_output):
+    mocker.patch('services.power_bi_utils.PowerBIClient._get_access_token', return_value="token123")
+    mocker.patch('services.http_utils.post', return_value=MockResponse({}, status_code, "content", headers))
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
+
+    assert asyncio.run(powerbi_client.start_refresh("org", "workspace_id", "dataset_id")) == expected_output
+
+
+test_start_refresh_throttled_cases = [
+    ({"Retry-After": "30"}, 30),
+    ({}, None),
+]
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize("headers, expected_retry_after", test_start_refresh_throttled_cases)
+def test_start_refresh_throttled(mocker, headers, expected_retry_after):
+    mocker.patch('services.power_bi_utils.PowerBIClient._get_access_token', return_value="token123")
+    mocker.patch('services.http_utils.post', return_value=MockResponse({}, 429, "content", headers))
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
+
+    with pytest.raises(RefreshThrottledError) as error:
+        asyncio.run(powerbi_client.start_refresh("org", "workspace_id", "dataset_id"))
+
+    assert error.value.retry_after == expected_retry_after
+    assert asyncio.run(powerbi_client.refresh_dataset("org", "workspace_id", "dataset_id")) is False
+
+
+@pytest.mark.dev
+def test_wait_for_refreshes(mocker):
+    in_progress = {"requestId": "request1", "status": "Unknown", "startTime": "2024-01-01T10:00:00Z"}
+    histories = {
+        "id1": [[in_progress], [dict(in_progress, status="Completed", endTime="2024-01-01T10:02:30.500Z"),
+                                {"requestId": "request0", "status": "Completed"}]],
+        "id2": [[{"requestId": "request2", "status": "Failed", "startTime": "2024-01-01T10:00:00Z",
+                  "endTime": "2024-01-01T10:00:10Z"}]],
+        "id3": [[in_progress]],
+        "id5": [[{"requestId": "request0", "status": "Completed"}]]
+    }
+    polls = []
+
+    async def get(url, **kwargs):
+        dataset_id = url.split('/')[-2]
+        polls.append(dataset_id)
+        if dataset_id == "id4":
+            raise RequestError("Connection reset")
+        history = histories[dataset_id]
+        return MockResponse({"value": history.pop(0) if len(history) > 1 else history[0]}, 200, "content")
+
+    clock = [0.0]
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+        clock[0] += delay
+
+    mocker.patch('services.power_bi_utils.PowerBIClient._get_access_token', return_value="token123")
+    mocker.patch('services.http_utils.get', side_effect=get)
+    mocker.patch('services.power_bi_utils.time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch('services.power_bi_utils.asyncio.sleep', side_effect=sleep)
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
+
+    outcomes = asyncio.run(powerbi_client.wait_for_refreshes(
+        "org", "workspace_id", {"id1": "request1", "id2": "request2", "id3": "request1", "id4": "request4", "id5": None},
+        poll_interval=0.01, max_poll_interval=0.02, timeout=0.05))
+
+    assert outcomes["id1"]["status"] == "completed"
+    assert outcomes["id1"]["duration"] == 150.5
+    assert outcomes["id2"]["request_id"] == "request2"
+    assert outcomes["id2"]["status"] == "failed"
+    assert outcomes["id2"]["duration"] == 10
+    assert outcomes["id3"]["status"] == "timeout"
+    assert outcomes["id4"]["status"] == "error"
+    # The latest refresh may not be the one requested when PowerBI did not return its request ID
+    assert outcomes["id5"] == {"request_id": None, "status": "untracked", "waited": 0}
+    # Every pending dataset is polled once per round
+    assert polls[:4] == ["id1", "id2", "id3", "id4"]
+    assert polls[4:6] == ["id1", "id3"]
+    assert set(polls[6:]) == {"id3"}
+    assert outcomes["id3"]["waited"] <= 0.05
+    assert all(0.005 <= delay <= 0.02 for delay in delays)
+
+
+@pytest.mark.dev
+def test_poll_interval_backoff():
+    intervals = [_get_poll_interval(attempt, 5, 60) for attempt in range(6)]
+
+    assert 2.5 <= intervals[0] <= 7.5
+    assert 10 <= intervals[2] <= 30
+    assert intervals[5] == 60
+
+
+@pytest.mark.dev
+def test_refresh_coalescer_merges_requests_into_trailing_refresh(mocker):
+    container = FakeContainerClient()
+    mock_refresh = mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh',
+                                side_effect=[(True, "request_id"), (True, "trailing_request_id")])
+    mock_wait = mocker.patch('services.power_bi_utils.PowerBIClient.wait_for_refreshes', return_value={})
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_refresh_history',
+                 return_value=[{"requestId": "request_id", "status": "Completed"}])
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
+    coalescer = RefreshCoalescer(container, window=0.05)
+
+    async def refresh_concurrently():
+        results = await asyncio.gather(*(coalescer.refresh(powerbi_client, "org", "workspace_id", "dataset_id")
+                                         for _ in range(10)))
+        refreshes_before_window = mock_refresh.call_count
+        await coalescer.drain()
+        return results, refreshes_before_window
+
+    results, refreshes_before_window = asyncio.run(refresh_concurrently())
+    state = json.loads(container.blobs["workspace_id/dataset_id.json"])
+
+    assert sorted(results) == [("queued", None)] * 9 + [("refreshing", "request_id")]
+    assert refreshes_before_window == 1
+    # A single trailing refresh serves every merged request once the running refresh completed
+    assert mock_refresh.call_count == 2
+    assert mock_wait.call_args.args[2] == {"dataset_id": "request_id"}
+    assert state["request_id"] == "trailing_request_id" and state["pending"] is False
+
+
+@pytest.mark.dev
+def test_refresh_coalescer_trailing_refresh_outlasts_wait_timeout(mocker):
+    container = FakeContainerClient()
+    mock_refresh = mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh',
+                                side_effect=[(True, "request_id"), (True, "trailing_request_id")])
+    mock_wait = mocker.patch('services.power_bi_utils.PowerBIClient.wait_for_refreshes',
+                             side_effect=[{"dataset_id": {"request_id": "request_id", "status": "timeout"}},
+                                          {"dataset_id": {"request_id": "request_id", "status": "completed"}}])
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
+    coalescer = RefreshCoalescer(container, window=0.05)
+
+    async def refresh_twice():
+        results = [await coalescer.refresh(powerbi_client, "org", "workspace_id", "dataset_id") for _ in range(2)]
+        await coalescer.drain()
+        return results
+
+    results = asyncio.run(refresh_twice())
+    state = json.loads(container.blobs["workspace_id/dataset_id.json"])
+
+    assert results == [("refreshing", "request_id"), ("queued", None)]
+    # The running refresh is polled again after the timeout, then the trailing refresh is requested
+    assert mock_wait.call_count == 2
+    assert mock_refresh.call_count == 2
+    assert state["request_id"] == "trailing_request_id" and state["pending"] is False
+
+
+test_refresh_coalescer_history_cases = [
+    ("Unknown", ("queued", None), 0, True),
+    ("Completed", ("refreshing", "new_request_id"), 1, False),
+]
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize("history_status, expected_output, expected_refreshes, expected_pending",
+                         test_refresh_coalescer_history_cases)
+def test_refresh_coalescer_merges_requests_while_refreshing(mocker, history_status, expected_output,
+                                                            expected_refreshes, expected_pending):
+    container = FakeContainerClient()
+    container.upload_json("workspace_id/dataset_id.json", {"requested_at": time.time() - 120,
+                                                           "request_id": "request_id"})
+    mocker.patch('services.power_bi_utils.PowerBIClient.get_refresh_history',
+                 return_value=[{"requestId": "request_id", "status": history_status}])
+    mock_refresh = mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh',
+                                return_value=(True, "new_request_id"))
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
+    coalescer = RefreshCoalescer(container, window=60)
+
+    result = asyncio.run(coalescer.refresh(powerbi_client, "org", "workspace_id", "dataset_id"))
+
+    assert result == expected_output
+    assert mock_refresh.call_count == expected_refreshes
+    assert json.loads(container.blobs["workspace_id/dataset_id.json"])["pending"] is expected_pending
+
+
+@pytest.mark.dev
+def test_refresh_coalescer_releases_failed_refresh(mocker):
+    container = FakeContainerClient()
+    mock_refresh = mocker.patch('services.power_bi_utils.PowerBIClient.start_refresh',
+                                side_effect=[(False, None), (True, "request_id")])
+    powerbi_client = PowerBIClient('tenant_id', 'client_id', 'client_secret')
+    coalescer = RefreshCoalescer(container, window=60)
+
+    failed = asyncio.run(coalescer.refresh(powerbi_client, "org", "workspace_id", "dataset_id"))
+    retried = asyncio.run(coalescer.refresh(powerbi_client, "org", "workspace_id", "dataset_id"))
+
+    assert failed == ("failed", None)
+    assert retried == ("refreshing", "request_id")
+    assert mock_refresh.call_count == 2
@@ -1,13 +1,15 @@
 """Unit tests for the purview_utils module.
 
 """
+import asyncio
 import json
 import os
 from unittest import expectedFailure
 import pytest
-from unittest.mock import patch
-from azure.purview.catalog import PurviewCatalogClient
-from azure.identity import DefaultAzureCredential
+from unittest.mock import AsyncMock, Mock, patch
+from azure.purview.catalog.aio import PurviewCatalogClient
+from azure.identity.aio import DefaultAzureCredential
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
 from services import purview_utils, utils
 
 TEST_GET_DEPENDENCIES_GUID = {
@@ -51,6 +53,15 @@ TEST_GET_DEPENDENCIES_LINEAGE = {
 }
 
 
+@pytest.fixture(autouse=True)
+def reset_guid_cache():
+    """Start every test with an empty entity GUID cache
+    """
+    purview_utils.set_guid_cache(purview_utils.EntityGuidCache())
+    yield
+    purview_utils.set_guid_cache(None)
+
+
 GET_DEPENDENCIES_TEST_ENV_VAR = [
     ("AZURE_CLIENT_ID", "3670de26-8x8f-4d21-a56c-dc2b2c1n9b7r"),
     ("AZURE_CLIENT_SECRET", "F-X7Q~oZvVA2mBiBT13r2fMRA7OJG~rHUAln-"),
@@ -70,15 +81,13 @@ def test_get_dependencies():
     client = PurviewCatalogClient(
         endpoint='https://',
         credential=DefaultAzureCredential())
-    client.entity.get_by_unique_attributes = (
-        lambda entity_type, attr_qualified_name: TEST_GET_DEPENDENCIES_GUID
-    )
-    client.lineage.get_lineage_graph = (
-        lambda entity_guid, direction="OUTPUT": TEST_GET_DEPENDENCIES_LINEAGE
-    )
+    client.entity.get_by_unique_attributes = AsyncMock(
+        return_value=TEST_GET_DEPENDENCIES_GUID)
+    client.lineage.get_lineage_graph = AsyncMock(
+        return_value=TEST_GET_DEPENDENCIES_LINEAGE)
 
-    assert purview_utils.get_dependencies(
-        client, 'Qname', 'EntityType') == expected_dependencies
+    assert asyncio.run(purview_utils.get_dependencies(
+        client, 'Qname', 'EntityType')) == expected_dependencies
 
 
 TEST_BUILD_PURVIEW_QNAME = [
@@ -152,17 +161,162 @@ def test_get_dependencies_list():
         endpoint='https://',
         credential=DefaultAzureCredential())
 
-    client.entity.get_by_unique_attributes = (
-        lambda entity_type, attr_qualified_name: TEST_GET_DEPENDENCIES_GUID
-    )
-    client.lineage.get_lineage_graph = (
-        lambda entity_guid, direction="OUTPUT": TEST_GET_DEPENDENCIES_LINEAGE
-    )
+    client.entity.get_by_unique_attributes = AsyncMock(
+        return_value=TEST_GET_DEPENDENCIES_GUID)
+    client.lineage.get_lineage_graph = AsyncMock(
+        return_value=TEST_GET_DEPENDENCIES_LINEAGE)
 
     test_input = [utils.ErrorContext(json.loads(TEST_GET_DEPENDENCIES_LIST))]
 
-    assert purview_utils.get_dependencies_list(
-        client, test_input) == expected_dependencies
+    assert asyncio.run(purview_utils.get_dependencies_list(
+        client, test_input)) == expected_dependencies
+
+
+@patch.dict(os.environ, GET_DEPENDENCIES_TEST_ENV_VAR, clear=True)
+@pytest.mark.dev
+def test_get_dependencies_list_deduplicates():
+    """Test that get_dependencies_list looks up each distinct asset once
+    """
+    expected_dependencies = {
+        'TestTable2 (test_table)',
+        'TestTable3 (test_other_table)'}
+
+    client = PurviewCatalogClient(
+        endpoint='https://',
+        credential=DefaultAzureCredential())
+
+    lookups = []
+
+    async def get_by_unique_attributes(entity_type, attr_qualified_name):
+        lookups.append(attr_qualified_name)
+        return TEST_GET_DEPENDENCIES_GUID
+
+    client.entity.get_by_unique_attributes = get_by_unique_attributes
+    client.lineage.get_lineage_graph = AsyncMock(
+        return_value=TEST_GET_DEPENDENCIES_LINEAGE)
+
+    payload = json.loads(TEST_GET_DEPENDENCIES_LIST)
+    other_payload = dict(payload, name='Address')
+    test_input = [utils.ErrorContext(payload),
+                  utils.ErrorContext(other_payload),
+                  utils.ErrorContext(payload)]
+
+    assert (asyncio.run(purview_utils.get_dependencies_list(
+        client, test_input, max_concurrency=2)) == expected_dependencies
+        and sorted(lookups) == [
+            'mssql://https://serv.com/test/SalesLT/Address',
+            'mssql://https://serv.com/test/SalesLT/Customer'])
+
+
+@patch.dict(os.environ, GET_DEPENDENCIES_TEST_ENV_VAR, clear=True)
+@pytest.mark.dev
+def test_resolve_entity_guid_cache():
+    """Test that resolve_entity_guid only calls Purview on cache misses
+    """
+    client = PurviewCatalogClient(
+        endpoint='https://',
+        credential=DefaultAzureCredential())
+
+    lookups = []
+
+    async def get_by_unique_attributes(entity_type, attr_qualified_name):
+        lookups.append(attr_qualified_name)
+        return TEST_GET_DEPENDENCIES_GUID
+
+    client.entity.get_by_unique_attributes = get_by_unique_attributes
+    expected_guid = TEST_GET_DEPENDENCIES_GUID['entity']['guid']
+
+    async def resolve():
+        return await purview_utils.resolve_entity_guid(
+            client, 'table', 'qname')
+
+    guids = [asyncio.run(resolve()) for _ in range(3)]
+
+    asyncio.run(purview_utils.invalidate_entities({'entities': [{
+        'typeName': 'table', 'attributes': {'qualifiedName': 'qname'}}]}))
+    guids.append(asyncio.run(resolve()))
+
+    assert guids == [expected_guid] * 4 and lookups == ['qname', 'qname']
+
+
+@pytest.mark.dev
+def test_entity_guid_cache_eviction():
+    """Test the LRU eviction and time to live of the entity GUID cache
+    """
+    cache = purview_utils.EntityGuidCache(max_entries=2)
+    cache.set('table', 'a', 'guid_a')
+    cache.set('table', 'b', 'guid_b')
+    cache.get('table', 'a')
+    cache.set('table', 'c', 'guid_c')
+
+    expired_cache = purview_utils.EntityGuidCache(ttl=-1)
+    expired_cache.set('table', 'a', 'guid_a')
+
+    assert ([cache.get('table', name) for name in ('a', 'b', 'c')]
+            == ['guid_a', None, 'guid_c']
+            and expired_cache.get('table', 'a') is None)
+
+
+@pytest.mark.dev
+def test_entity_guid_cache_file_store(tmp_path):
+    """Test that the file backed cache survives a new cache instance
+    """
+    path = str(tmp_path / 'guid_cache.json')
+    cache = purview_utils.EntityGuidCache(
+        store=purview_utils.FileCacheStore(path))
+    cache.set('table', 'a', 'guid_a')
+    cache.set('table', 'b', 'guid_b')
+    cache.invalidate('table', 'b')
+    unflushed_cache = purview_utils.EntityGuidCache(
+        store=purview_utils.FileCacheStore(path))
+    unflushed = unflushed_cache.get('table', 'a')
+    asyncio.run(cache.flush())
+
+    new_cache = purview_utils.EntityGuidCache(
+        store=purview_utils.FileCacheStore(path))
+
+    assert (unflushed is None
+            and new_cache.get('table', 'a') == 'guid_a'
+            and new_cache.get('table', 'b') is None)
+
+
+@pytest.mark.dev
+def test_entity_guid_cache_flush_batches_writes():
+    """Test that the changes made while a flush runs are saved by it, once
+    """
+    store = Mock(load=Mock(return_value={}))
+    cache = purview_utils.EntityGuidCache(store=store)
+
+    async def resolve_concurrently():
+        async def resolve(name):
+            cache.set('table', name, f'guid_{name}')
+            await cache.flush()
+        await asyncio.gather(*(resolve(name) for name in 'abcde'))
+        await cache.flush()
+
+    asyncio.run(resolve_concurrently())
+
+    assert (store.save.call_count == 2
+            and len(store.save.call_args.args[0]) == 5)
+
+
+@pytest.mark.dev
+def test_collection_cache():
+    """Test that a collection is only upserted once per time to live
+    """
+    account_client = AsyncMock()
+    account_client.collections.create_or_update_collection.side_effect = [
+        None, ResourceExistsError('Concurrent upsert')]
+
+    cache = purview_utils.CollectionCache(ttl=3600)
+    results = [asyncio.run(cache.ensure(account_client,
+                                        'pview-collection-d01'))
+               for _ in range(3)]
+    results.append(asyncio.run(cache.ensure(account_client,
+                                            'pview-collection-t01')))
+
+    assert (results == [True, False, False, True]
+            and cache.stats() == {'upserts': 2, 'skipped_upserts': 2})
 
 
 @pytest.mark.dev
@@ -324,6 +478,8 @@ def test_get_purview_columns():
 
     assert (
         purview_utils.get_purview_columns(columns, base_qname, -200)
+        == purview_utils.get_purview_columns(
+            utils.Schema.from_entities(columns), base_qname, -200)
         == expected_result)
 
 
@@ -384,6 +540,9 @@ def test_get_purview_column_mapping_staging():
 
     assert purview_utils.get_purview_column_mapping(
         TEST_COLUMNS_STAGING_MAPPING, 'lake', 'sink') == expected_result
+    assert purview_utils.get_purview_column_mapping(
+        utils.Schema.from_entities(TEST_COLUMNS_STAGING_MAPPING), 'lake',
+        'sink') == expected_result
 
 
 @pytest.mark.dev
@@ -417,6 +576,9 @@ def test_get_purview_datasets_staging():
 
     assert(purview_utils.get_purview_datasets(
         TEST_COLUMNS_STAGING_MAPPING, 'lake') == expected_result)
+    assert(purview_utils.get_purview_datasets(
+        utils.Schema.from_entities(TEST_COLUMNS_STAGING_MAPPING), 'lake')
+        == expected_result)
 
 
 @pytest.mark.dev
@@ -463,3 +625,83 @@ def test_get_purview_search_query():
 
     assert(purview_utils.purview_search_query('key', 'colTest', 'azure')
            == expected_result)
+
+
+@pytest.mark.dev
+@patch('services.purview_utils.CLASSIFICATION_BATCH_SIZE', 2)
+def test_apply_classifications():
+    """Test that the classifications are applied in batches and that a
+        failed batch falls back to single entity requests
+    """
+    client = AsyncMock()
+    client.entity.add_classification.side_effect = [
+        None, HttpResponseError('Already classified'), None]
+    client.entity.add_classifications.side_effect = HttpResponseError(
+        'Already classified')
+
+    requests = asyncio.run(purview_utils.apply_classifications(
+        client, {'EMAIL': ['a', 'b', 'c'], 'NAME': ['a']},
+        max_concurrency=1))
+
+    bulk_requests = [
+        (call.args[0]['classification']['typeName'],
+         call.args[0]['entityGuids'])
+        for call in client.entity.add_classification.await_args_list]
+
+    assert (requests == 3
+            and bulk_requests == [('EMAIL', ['a', 'b']), ('EMAIL', ['c']),
+                                  ('NAME', ['a'])]
+            and client.entity.update_classifications.await_args.args
+            == ('c', [{'typeName': 'EMAIL'}]))
+
+
+@pytest.mark.dev
+def test_iter_discovery_query():
+    """Test that every page of results is requested, by offset or by
+        continuation token
+    """
+    client = AsyncMock()
+    client.discovery.query.side_effect = [
+        {'value': [{'id': 1}, {'id': 2}]},
+        {'value': [{'id': 3}, {'id': 4}], 'continuationToken': 'token'},
+        {'value': [{'id': 5}]}
+    ]
+    query = {'keywords': None, 'limit': 1000}
+
+    async def query_all():
+        return [result['id'] async for result in
+                purview_utils.iter_discovery_query(client, query,
+                                                   page_size=2)]
+
+    assert (asyncio.run(query_all()) == [1, 2, 3, 4, 5]
+            and [(call.args[0].get('offset'),
+                  call.args[0].get('continuationToken'))
+                 for call in client.discovery.query.await_args_list]
+            == [(0, None), (2, None), (None, 'token')]
+            and query == {'keywords': None, 'limit': 1000})
+
+
+@pytest.mark.dev
+def test_get_purview_lineage():
+    """Test the get_purview_lineage function groups the columns once for
+        the column mapping and the datasets
+    """
+    columns = TEST_COLUMNS_STAGING_MAPPING + [utils.DataEntity({
+        "name": "email",
+        "type": "string",
+        "system": 'sys1',
+        "source_name": "DV_EMAIL",
+        "source_dataset": "source1"
+    })]
+    schema = utils.Schema.from_entities(columns)
+
+    mapping, datasets = purview_utils.get_purview_lineage(
+        schema, 'lake', 'sink')
+
+    assert purview_utils.group_columns_by_source(schema) == {
+        'source1': [0, 1, 3], 'source2': [2]}
+    assert json.loads(mapping)[0]['ColumnMapping'][-1] == {
+        'Source': 'DV_EMAIL', 'Sink': 'email'}
+    assert mapping == purview_utils.get_purview_column_mapping(
+        columns, 'lake', 'sink')
+    assert datasets == purview_utils.get_purview_datasets(columns, 'lake')
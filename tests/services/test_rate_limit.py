@@ -0,0 +1,65 @@
+"""Unit tests for the rate_limit module.
+
+"""
+import asyncio
+from unittest.mock import AsyncMock, Mock
+import pytest
+from services import rate_limit
+
+
+class FakeClock():
+    """A clock advanced by the sleeps it records instead of waiting
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+@pytest.mark.dev
+def test_token_bucket_rate():
+    """Test that the bucket allows a burst then the sustained rate
+    """
+    clock = FakeClock()
+    bucket = rate_limit.TokenBucket(rate=100, capacity=10,
+                                    clock=clock.time, sleep=clock.sleep)
+
+    async def acquire_all():
+        await asyncio.gather(*(bucket.acquire() for _ in range(30)))
+
+    asyncio.run(acquire_all())
+
+    # 10 tokens of burst, then 20 tokens at 100 per second
+    assert len(clock.sleeps) == 20 and clock.now == pytest.approx(0.2)
+
+
+@pytest.mark.dev
+def test_rate_limit_policy_honours_retry_after():
+    """Test that a throttled response pauses the following requests
+    """
+    clock = FakeClock()
+    bucket = rate_limit.TokenBucket(rate=1000, clock=clock.time,
+                                    sleep=clock.sleep)
+    policy = rate_limit.RateLimitPolicy(bucket)
+    throttled = Mock(http_response=Mock(status_code=429,
+                                        headers={'Retry-After': '0.2'}))
+    ok = Mock(http_response=Mock(status_code=200, headers={}))
+    policy.next = AsyncMock()
+    policy.next.send.side_effect = [throttled, ok]
+    request = Mock()
+
+    async def send_twice():
+        await policy.send(request)
+        return await policy.send(request)
+
+    response = asyncio.run(send_twice())
+
+    assert (response is ok and bucket.throttled == 1
+            and clock.sleeps[0] == pytest.approx(0.2))
@@ -0,0 +1,97 @@
+"""Unit tests for the service_bus_utils module.
+
+"""
+import asyncio
+import pytest
+from azure.servicebus import ServiceBusMessage
+from azure.servicebus.exceptions import ServiceBusError
+from services import service_bus_utils
+from tests.fakes import FakeServiceBusSender
+
+
+def get_messages(count: int):
+    """Return count messages carrying the record IDs 2n and 2n + 1
+    """
+    return [(ServiceBusMessage(str(index)),
+             [str(index * 2), str(index * 2 + 1)])
+            for index in range(count)]
+
+
+async def send(sender, messages):
+    """Return the IDs of the batches sent and the error raised if any
+    """
+    batches = []
+    try:
+        async for ids in service_bus_utils.send_message_batches(sender,
+                                                                messages):
+            batches.append(ids)
+    except ServiceBusError as ex:
+        return batches, ex
+    return batches, None
+
+
+@pytest.mark.dev
+def test_send_message_batches():
+    """Test that the messages are packed in full batches
+    """
+    sender = FakeServiceBusSender(latency=0, max_messages=2)
+
+    batches, error = asyncio.run(send(sender, get_messages(5)))
+
+    assert (error is None
+            and [len(batch) for batch in sender.sent] == [2, 2, 1]
+            and batches == [['0', '1', '2', '3'], ['4', '5', '6', '7'],
+                            ['8', '9']])
+
+
+@pytest.mark.dev
+def test_send_message_batches_failure():
+    """Test that only the IDs of the batches sent are reported
+    """
+    sender = FakeServiceBusSender(latency=0, max_messages=2, max_sends=1)
+
+    batches, error = asyncio.run(send(sender, get_messages(5)))
+
+    assert (isinstance(error, ServiceBusError)
+            and batches == [['0', '1', '2', '3']])
+
+
+@pytest.mark.dev
+def test_send_message_batches_reconnect():
+    """Test that a batch failing on a lost link is sent again with a new
+        sender
+    """
+    senders = [FakeServiceBusSender(latency=0, max_messages=2, max_sends=1),
+               FakeServiceBusSender(latency=0, max_messages=2)]
+
+    async def reconnect():
+        return senders[1]
+
+    async def send_all():
+        return [ids async for ids in service_bus_utils.send_message_batches(
+            senders[0], get_messages(3), reconnect)]
+
+    batches = asyncio.run(send_all())
+
+    assert (batches == [['0', '1', '2', '3'], ['4', '5']]
+            and len(senders[0].sent) == 1 and len(senders[1].sent) == 1)
+
+
+@pytest.mark.dev
+def test_send_message_batches_shared_sender():
+    """Test that the batches of concurrent invocations sharing a sender are
+        sent one at a time
+    """
+    topic = service_bus_utils.TopicSender(
+        FakeServiceBusSender(latency=0.005, max_messages=2))
+
+    async def send_concurrently():
+        return await asyncio.gather(*(send(topic, get_messages(5))
+                                      for _ in range(4)))
+
+    results = asyncio.run(send_concurrently())
+
+    assert (all(error is None and len(batches) == 3
+                for batches, error in results)
+            and len(topic.sender.sent) == 12
+            and topic.sender.peak_in_flight == 1)
@@ -3,15 +3,20 @@
 """
 import pytest
 import os
+import sys
 import json
-from unittest.mock import Mock, patch
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
 from services import utils
 from pathlib import Path
-from azure.storage.blob import ContainerClient
+from azure.core.exceptions import (HttpResponseError, ResourceExistsError,
+                                   ResourceModifiedError, ResourceNotFoundError)
+from azure.storage.blob.aio import ContainerClient
+from tests.fakes import FakeContainerClient
 
 
 @pytest.mark.dev
-@patch('services.utils.requests.post')
+@patch('services.http_utils.post')
 def test_get_auth_token(mock_post):
     """Test the API authentication function
 
@@ -24,7 +29,7 @@ def test_get_auth_token(mock_post):
     mock_post.return_value = Mock(
         status_code=200, json=lambda: {
             token_name: expected_auth_token})
-    auth_token = utils.get_auth_token(None, None, token_name)
+    auth_token = asyncio.run(utils.get_auth_token(None, None, token_name))
 
     assert auth_token == expected_auth_token
 
@@ -93,7 +98,7 @@ class ReadBlob():
     def __init__(self, *args, **kwargs):
         self.name = args[0]
 
-    def readall(self) -> str:
+    async def readall(self) -> str:
         """A mocked function to return the content of a file
 
         Returns:
@@ -105,7 +110,7 @@ class ReadBlob():
         return data
 
 
-def delete_blob_mock(*args, **kwargs):
+async def delete_blob_mock(*args, **kwargs):
     """A mocked function to delete a file
     """
     path = (Path(__file__).parents[1] / 'temp' / args[0]).resolve()
@@ -121,19 +126,312 @@ def test_load_blobs_json(mock_container: Mock, prepare_blob_files):
 
     container = ContainerClient('https://testH9sMs03hkMopLs7345.com', 'TEST')
 
-    assert (utils.load_blobs_json(TEST_BLOB_FILES, container)
+    assert (asyncio.run(utils.load_blobs_json(TEST_BLOB_FILES, container))
             == TEST_BLOB_CONTENT)
 
 @pytest.mark.dev
+@patch('services.utils.ContainerClient.download_blob')
+def test_load_blobs_json_failures(mock_container: Mock):
+    """Assert that every Blob failing to load is reported
+    """
+    async def readall():
+        return '{"item": "first"}'
+
+    async def download_blob(name):
+        if name.endswith('2.json') or name.endswith('3.json'):
+            raise ValueError(name)
+        return Mock(readall=readall)
+
+    mock_container.side_effect = download_blob
+
+    container = ContainerClient('https://testH9sMs03hkMopLs7345.com', 'TEST')
+
+    with pytest.raises(utils.BlobOperationError) as error:
+        asyncio.run(utils.load_blobs_json(['1.json', '2.json', '3.json'],
+                                          container))
+
+    assert list(error.value.failures) == ['2.json', '3.json']
+
+
+@pytest.mark.dev
+def test_run_concurrently():
+    """Assert that results and errors are returned in the input order
+    """
+    async def square(value):
+        if value < 0:
+            raise ValueError(value)
+        return value * value
+
+    results = asyncio.run(utils.run_concurrently(square, [3, -1, 2], 2))
+
+    assert ([result for result, _ in results] == [9, None, 4]
+            and [type(error) for _, error in results]
+            == [type(None), ValueError, type(None)])
+
+
+@pytest.mark.dev
+@patch('services.utils.ContainerClient.delete_blobs')
 @patch('services.utils.ContainerClient.delete_blob')
-def test_delete_blobs(mock_delete: Mock, prepare_blob_files):
-    """Assert the read_blobs function
+def test_delete_blobs(mock_delete: Mock, mock_batch: Mock,
+                      prepare_blob_files):
+    """Assert the delete_blobs function falls back to single deletes
     """
+    mock_batch.side_effect = ValueError('Batch not supported')
     mock_delete.side_effect = delete_blob_mock
 
     container = ContainerClient('https://testH9sMs03hkMopLs7345.com', 'TEST')
-    utils.delete_blobs(TEST_BLOB_FILES, container)
+    results = asyncio.run(utils.delete_blobs(TEST_BLOB_FILES, container))
 
     arr = os.listdir((Path(__file__).parents[1] / 'temp/blob_test/').resolve())
 
-    assert not arr
+    assert not arr and results == {name: None for name in TEST_BLOB_FILES}
+
+
+@pytest.mark.dev
+@patch('services.utils.ContainerClient.delete_blobs')
+@patch('services.utils.ContainerClient.delete_blob')
+def test_delete_blobs_fallback_missing(mock_delete: Mock, mock_batch: Mock):
+    """Assert the single deletes report a missing Blob as deleted, as the
+        batch deletes do, and keep the other failures
+    """
+    async def delete_blob(name, **kwargs):
+        if name == '2.json':
+            raise ResourceNotFoundError('The specified blob does not exist')
+        if name == '3.json':
+            raise HttpResponseError('Server error')
+
+    mock_batch.side_effect = ValueError('Batch not supported')
+    mock_delete.side_effect = delete_blob
+
+    container = ContainerClient('https://testH9sMs03hkMopLs7345.com', 'TEST')
+    results = asyncio.run(
+        utils.delete_blobs(['1.json', '2.json', '3.json'], container))
+
+    assert ([name for name, error in results.items() if error]
+            == ['3.json'] and len(results) == 3)
+
+
+@pytest.mark.dev
+@patch('services.utils.BLOB_BATCH_SIZE', 2)
+@patch('services.utils.ContainerClient.delete_blobs')
+def test_delete_blobs_batch(mock_batch: Mock):
+    """Assert the delete_blobs function batches the deletes and
+        reports the partial failures
+    """
+    status_codes = iter([[202, 500], [404]])
+
+    async def delete_blobs(*args, **kwargs):
+        async def responses():
+            for code in next(status_codes):
+                yield Mock(status_code=code)
+        return responses()
+
+    mock_batch.side_effect = delete_blobs
+
+    container = ContainerClient('https://testH9sMs03hkMopLs7345.com', 'TEST')
+    results = asyncio.run(
+        utils.delete_blobs(['1.json', '2.json', '3.json'], container))
+
+    assert (mock_batch.call_count == 2
+            and [name for name, error in results.items() if error]
+            == ['2.json'])
+
+
+@pytest.mark.dev
+def test_save_blob_json_creates_container():
+    """Assert that a JSON Blob saved in a missing container can be loaded
+    """
+    blobs = {}
+
+    async def upload_blob(name, data, overwrite=False):
+        if not container.create_container.called:
+            raise ResourceNotFoundError('The container does not exist')
+        blobs[name] = data
+
+    async def download_blob(name):
+        if name not in blobs:
+            raise ResourceNotFoundError('The blob does not exist')
+        return Mock(readall=AsyncMock(return_value=blobs[name]))
+
+    container = AsyncMock(upload_blob=upload_blob,
+                          download_blob=download_blob)
+
+    async def save_and_load():
+        missing = await utils.load_blob_json(container, 'state.json', {})
+        await utils.save_blob_json(container, 'state.json', {'key': 1})
+        return missing, await utils.load_blob_json(container, 'state.json')
+
+    assert asyncio.run(save_and_load()) == ({}, {'key': 1})
+
+
+@pytest.mark.dev
+def test_save_blob_json_if_match():
+    """Assert that a JSON Blob is only saved if it was not modified since it
+        was loaded
+    """
+    container = FakeContainerClient()
+
+    async def save_concurrently():
+        state, etag = await utils.load_blob_json_with_etag(container,
+                                                           'state.json')
+        created = await utils.save_blob_json_if_match(
+            container, 'state.json', {'key': 1}, etag)
+        results = await asyncio.gather(*(
+            utils.save_blob_json_if_match(container, 'state.json',
+                                          {'key': key}, etag)
+            for key, etag in ((2, created), (3, created), (4, None))),
+            return_exceptions=True)
+        return state, results, await utils.load_blob_json_with_etag(
+            container, 'state.json')
+
+    state, results, (content, etag) = asyncio.run(save_concurrently())
+
+    assert state is None
+    assert results[0] == etag and content == {'key': 2}
+    assert isinstance(results[1], ResourceModifiedError)
+    assert isinstance(results[2], ResourceExistsError)
+
+
+@pytest.mark.dev
+def test_iter_concurrently():
+    """Assert that every item is processed by a bounded pool of workers
+        and that the errors of the iterable are raised
+    """
+    running = []
+    peak = []
+
+    async def items(count, fail=False):
+        for item in range(count):
+            yield item
+        if fail:
+            raise ValueError('Query failed')
+
+    async def square(value):
+        running.append(value)
+        peak.append(len(running))
+        await asyncio.sleep(0.001)
+        running.remove(value)
+        if value == 3:
+            raise ValueError(value)
+        return value * value
+
+    async def collect(fail=False):
+        return [result async for result
+                in utils.iter_concurrently(square, items(10, fail), 4)]
+
+    results = asyncio.run(collect())
+
+    with pytest.raises(ValueError, match='Query failed'):
+        asyncio.run(collect(fail=True))
+
+    assert (sorted(result for result, _ in results if result is not None)
+            == [0, 1, 4, 16, 25, 36, 49, 64, 81]
+            and [type(error) for _, error in results if error]
+            == [ValueError]
+            and max(peak) == 4)
+
+
+@pytest.mark.dev
+def test_iter_concurrently_closed_early():
+    """Assert that closing the iterator early stops the producer and the
+        workers, even with the item queue full
+    """
+    async def items():
+        for item in range(100):
+            yield item
+
+    async def identity(value):
+        # Only the first item completes, the queue fills up behind the others
+        if value:
+            await asyncio.Event().wait()
+        return value
+
+    async def consume_first():
+        results = utils.iter_concurrently(identity, items(), 2)
+        first = await results.__anext__()
+        await results.aclose()
+        await asyncio.sleep(0.01)
+        return first, [task for task in asyncio.all_tasks()
+                       if task is not asyncio.current_task()]
+
+    first, leftover = asyncio.run(consume_first())
+
+    assert first == (0, None) and leftover == []
+
+
+TEST_JSON_ARRAY = [{'id': 1, 'name': 'Zoë', 'tags': ['a', 'b']}, 12345,
+                   'text', [], {'nested': {'value': None, 'ratio': 0.5}}]
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize('chunk_size', [1, 3, 16, 1024])
+def test_iter_json_array(chunk_size: int):
+    """Assert that a JSON array is parsed identically whatever the chunking
+    """
+    data = json.dumps(TEST_JSON_ARRAY, ensure_ascii=False).encode('utf-8')
+
+    assert (list(utils.iter_json_array(utils.iter_chunks(data, chunk_size)))
+            == TEST_JSON_ARRAY)
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize('chunks, expected', [
+    ([b'[1.', b'5]'], [1.5]),
+    ([b'[1e', b'3]'], [1000.0]),
+    ([b'[2, -1.2', b'5E-', b'1, 3]'], [2, -0.125, 3]),
+    ([b'[tr', b'ue, 1', b'0]'], [True, 10])])
+def test_iter_json_array_split_scalars(chunks: list, expected: list):
+    """Assert that the numbers and literals split across chunks are parsed
+        once complete
+    """
+    assert list(utils.iter_json_array(chunks)) == expected
+
+
+@pytest.mark.dev
+@pytest.mark.parametrize('data', [b'{"id": 1}', b'[1, 2', b'[1 2]', b'[1,]',
+                                  b'[1]x', b''])
+def test_iter_json_array_invalid(data: bytes):
+    """Assert that invalid JSON arrays raise a ValueError
+    """
+    with pytest.raises(ValueError):
+        list(utils.iter_json_array(utils.iter_chunks(data, 2)))
+
+
+@pytest.mark.dev
+def test_data_entity_from_payloads():
+    """Assert that the slotted entities map the payload fields they declare
+    """
+    entities = utils.DataEntity.from_payloads([
+        {'name': 'Column', 'type': 'String', 'unknown': 'ignored'},
+        {'displayName': 'Display'}])
+
+    assert ([(col.name, col.type, col.display_name) for col in entities]
+            == [('Column', 'String', ''), ('Unknown asset', '', 'Display')]
+            and not hasattr(entities[0], 'unknown')
+            and not hasattr(entities[0], '__dict__'))
+
+
+@pytest.mark.dev
+def test_data_movement_schema():
+    """Assert that the structure of a data movement is stored by column and
+        stays available by row
+    """
+    movement = utils.DataMovement({
+        'name': 'Table', 'entity_type': 'oracle_table',
+        'pipeline_name': 'pipeline',
+        'structure': [{'name': 'id', 'type': 'int', 'system': 'sys1'},
+                      {'name': ''.join(['na', 'me']), 'type': 'String'}]})
+    structure = movement.structure
+
+    assert (movement.purview_prefix == 'oracle'
+            and movement.pipeline_name == 'pipeline'
+            and not hasattr(movement, '__dict__')
+            and not hasattr(structure, '__dict__')
+            and structure.names == ['id', 'name']
+            and structure.types == ['int', 'String']
+            and structure.systems == ['sys1', 'Unknown system']
+            and structure.names[1] is sys.intern('name')
+            and [(col.name, col.type) for col in structure]
+            == [('id', 'int'), ('name', 'String')]
+            and not hasattr(structure[0], 'display_name')
+            and utils.as_schema(list(structure)) == structure)
@@ -0,0 +1,106 @@
+"""Unit tests for the update_classification Azure Function.
+
+"""
+import os
+import asyncio
+from unittest.mock import patch, AsyncMock, MagicMock
+import pytest
+import azure.functions as func
+
+from update_classification import main
+from services import clients
+from tests.fakes import FakeBlobServiceClient
+
+RESOURCE_SETS = [
+    'https://lake.dfs.core.windows.net/raw/sys/asset/v1/{Year}/asset.parquet',
+    'https://lake.dfs.core.windows.net/raw/sys/other/v1/{Year}/other.parquet'
+]
+
+
+def get_schema(type_name, attr_qualified_name, **kwargs):
+    """Return a scanned schema classifying the email column or the
+        target schema where the email column of the asset is classified
+    """
+    if attr_qualified_name.endswith('#__tabular_schema'):
+        return {'referredEntities': {
+            'scan_email': {
+                'attributes': {'name': 'email'},
+                'classifications': [
+                    {'typeName': 'MICROSOFT.PERSONAL.EMAIL'},
+                    {'typeName': 'MICROSOFT.PERSONAL.NAME'}]
+            },
+            'scan_id': {'attributes': {'name': 'id'}}
+        }}
+
+    prefix = 'asset' if '/asset/' in attr_qualified_name else 'other'
+    return {'referredEntities': {
+        f'{prefix}_email': {
+            'attributes': {'name': 'email'},
+            'classifications': (
+                [{'typeName': 'MICROSOFT.PERSONAL.EMAIL'}]
+                if prefix == 'asset' else [])
+        },
+        f'{prefix}_id': {'attributes': {'name': 'id'}}
+    }}
+
+
+def run_update_classification(client, params=None):
+    """Run the function over RESOURCE_SETS and return the bulk requests
+        and the number of schema lookups
+    """
+    client.reset_mock()
+    client.discovery.query.side_effect = [
+        {'@search.facets': {'classification': [
+            {'value': 'MICROSOFT.PERSONAL.EMAIL'}]}},
+        {'value': [{'qualifiedName': qname} for qname in RESOURCE_SETS]}
+    ]
+    client.entity.get_by_unique_attributes.side_effect = get_schema
+
+    test_req = func.HttpRequest(method='POST', body=b'', params=params or {},
+                                url='/api/update_classification')
+
+    test_resp = asyncio.run(main(test_req))
+
+    assert test_resp.status_code == 200
+
+    return ({call.args[0]['classification']['typeName']:
+             sorted(call.args[0]['entityGuids'])
+             for call in client.entity.add_classification.await_args_list},
+            client.entity.get_by_unique_attributes.await_count)
+
+
+UPDATE_CLASSIFICATION_TEST_ENV_VAR = [
+    ('purview_account_name', 'purview'),
+    ('errorlog__clientId', '4440'),
+    ('errorlog__serviceUri', 'https://test.com')
+]
+
+
+@pytest.mark.dev
+@patch.dict(os.environ, UPDATE_CLASSIFICATION_TEST_ENV_VAR, clear=True)
+@patch('services.clients.BlobServiceClient',
+       MagicMock(side_effect=lambda *args, **kwargs: FakeBlobServiceClient(
+           latency=0)))
+@patch('services.clients.ManagedIdentityCredential', MagicMock())
+@patch('services.clients.PurviewCatalogClient', return_value=AsyncMock())
+def test_update_classification_bulk(mock_client):
+    """Test that the missing classifications are applied with one bulk
+        request per classification type, and only for the assets whose
+        classifications changed unless a full run is requested
+    """
+    asyncio.run(clients.reset_clients())
+    client = mock_client.return_value
+    expected_requests = {
+        'MICROSOFT.PERSONAL.EMAIL': ['other_email'],
+        'MICROSOFT.PERSONAL.NAME': ['asset_email', 'other_email']}
+
+    first_run = run_update_classification(client)
+    incremental_run = run_update_classification(client)
+    full_run = run_update_classification(client, {'full': 'true'})
+
+    assert (first_run == (expected_requests, 4)
+            and incremental_run == ({}, 2)
+            and full_run == (expected_requests, 4)
+            and not client.entity.add_classifications.called)
+
+    asyncio.run(clients.reset_clients())
@@ -2,15 +2,21 @@
 
 """
 import os
+import logging
 import azure.functions as func
-from azure.identity import ManagedIdentityCredential
-from azure.purview.catalog import PurviewCatalogClient
-from azure.core.exceptions import HttpResponseError
-import azure.functions as func
+
+from services import clients, utils, purview_utils
+
+
+CHECKPOINT_BLOB = 'update_classification.json'
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     """Apply the Purview classifications.
+        Runs incrementally by default: a checkpoint stored in Blob storage
+        keeps a fingerprint of the scanned classifications of every asset
+        and assets whose fingerprint did not change are skipped. Pass the
+        param full=true to reapply the classifications of every asset.
 
     Args:
         req (func.HttpRequest): Function inputs
@@ -21,17 +27,23 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     Returns:
         func.HttpResponse: A 200 status on success or a 500 status on failure
     """
-    credential = ManagedIdentityCredential(
+    client = clients.get_purview_client(
         client_id=os.environ['errorlog__clientId'])
 
-    client = PurviewCatalogClient(
-        endpoint=f"https://{os.environ['purview_account_name']}"
-                 ".purview.azure.com",
-        credential=credential)
+    checkpoint_container = clients.get_blob_service_client(
+        os.environ['errorlog__serviceUri'],
+        os.environ['errorlog__clientId']).get_container_client(
+            os.environ.get('classification_checkpoint_container',
+                           'checkpoints'))
+
+    full = req.params.get('full', '').lower() == 'true'
+    checkpoint = ({} if full else await utils.load_blob_json(
+        checkpoint_container, CHECKPOINT_BLOB, {}))
+    new_checkpoint = {}
 
     query = {
         "keywords": None,
-        "limit": 1000,
+        "limit": 1,
         "filter": {
             "and": [
                 {
@@ -49,7 +61,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         ]
     }
 
-    response = client.discovery.query(query)
+    response = await client.discovery.query(query)
 
     classifications = [{"classification": item['value']} for item
                        in response['@search.facets']['classification']]
@@ -57,27 +69,24 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     query['filter']['and'].append(
         {'or': classifications}
     )
-    response = client.discovery.query(query)
+    del query['facets']
 
-    assets = [item['qualifiedName'] for item in response['value']
-              if '/curated/data_quality/' not in item['qualifiedName']]
+    assets = (item['qualifiedName'] async for item
+              in purview_utils.iter_discovery_query(client, query)
+              if '/curated/data_quality/' not in item['qualifiedName'])
 
-    for qname in assets:
-        response = client.entity.get_by_unique_attributes(
+    async def plan(qname):
+        response = await client.entity.get_by_unique_attributes(
             type_name='tabular_schema', attr_qualified_name=qname +
             '#__tabular_schema', min_ext_info=True, ignore_relationships=False)
 
-        columns = {}
-
-        for entity in response['referredEntities']:
-            col = response['referredEntities'][entity]
-            classifications = col.get('classifications')
-
-            if classifications:
-                cl_types = [item['typeName'] for item in classifications]
-                cl_name = col['attributes']['name']
+        columns = purview_utils.get_column_classifications(response)
+        fingerprint = purview_utils.get_classifications_fingerprint(columns)
+        new_checkpoint[qname] = fingerprint
 
-                columns[cl_name] = cl_types
+        # Scanned schema and classifications unchanged since the last run
+        if not columns or fingerprint == checkpoint.get(qname):
+            return {}
 
         # Get the actual schema. Different matching for raw and staging/curated
         if (('/staging/' in qname or '/curated/' in qname) and
@@ -88,22 +97,57 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         else:
             schema_qname = qname.replace('.parquet', '#tabular_schema')
 
-        response = client.entity.get_by_unique_attributes(
+        response = await client.entity.get_by_unique_attributes(
             type_name='tabular_schema', attr_qualified_name=schema_qname,
             min_ext_info=True, ignore_relationships=False)
 
-        for entity in response['referredEntities']:
-            col = response['referredEntities'][entity]
-            cl_name = col['attributes']['name']
-
-            if cl_name in columns:
-                # There is not upsert logic for classifications
-                # Existing classifications are always preserved
-                try:
-                    client.entity.add_classifications(entity, columns[cl_name])
-                except HttpResponseError:
-                    client.entity.update_classifications(entity,
-                                                         columns[cl_name])
-                    pass
+        return purview_utils.plan_classifications(columns, response)
+
+    # Stream the assets through a pool of workers, collecting the assignments
+    # and sending a bulk request as soon as a classification type fills a
+    # batch. The Purview clients share a rate limit across the workers.
+    # Resource sets can share a schema, so the column GUIDs are deduplicated.
+    assignments = {}
+    classified = 0
+    requests = 0
+
+    async def flush(type_names):
+        nonlocal classified, requests
+        flushed = {type_name: list(assignments.pop(type_name))
+                   for type_name in type_names}
+        classified += sum(len(guids) for guids in flushed.values())
+        requests += await purview_utils.apply_classifications(client, flushed)
+
+    workers = int(os.environ.get('classification_workers',
+                                 purview_utils.PURVIEW_MAX_CONCURRENCY))
+
+    results = utils.iter_concurrently(plan, assets, workers)
+    try:
+        async for planned, error in results:
+            if error:
+                raise error
+
+            full_batches = []
+            for type_name, guids in planned.items():
+                type_guids = assignments.setdefault(type_name, {})
+                type_guids.update(dict.fromkeys(guids))
+                if len(type_guids) >= purview_utils.CLASSIFICATION_BATCH_SIZE:
+                    full_batches.append(type_name)
+
+            if full_batches:
+                await flush(full_batches)
+    finally:
+        # Stop the workers when the loop exits early
+        await results.aclose()
+
+    await flush(list(assignments))
+
+    # Only checkpoint once every classification has been applied
+    await utils.save_blob_json(checkpoint_container, CHECKPOINT_BLOB,
+                               new_checkpoint)
+
+    logging.info('Applied %d column classifications in %d requests, '
+                 '%s run over %d assets', classified, requests,
+                 'full' if full else 'incremental', len(new_checkpoint))
 
     return func.HttpResponse(status_code=200)